@@ -0,0 +1,262 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils, columnar_store
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Score columns: the summary score of every Perspective attribute
+ATTRIBUTES = [attribute.lower() for attribute in columnar_store.PERSPECTIVE_ATTRIBUTES]
+
+UTTERANCE_COLUMNS = ["video_id", "turn", "start", "end", "speaker"] + ATTRIBUTES
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def load_video_details(details_path=ConfigConstants.VIDEO_DETAILS_PATH):
+    """
+    Load the metadata of the videos.
+
+    Args:
+        details_path (str): Path of video_details.json.
+
+    Returns:
+        pd.DataFrame: One row per video: video_id, major_label (categorical), minor_labels (list),
+            total_duration, publish_time and view_count.
+    """
+    with open(details_path) as fd:
+        details = json.load(fd)
+    return pd.DataFrame({
+        "video_id": [video["yt_vid_id"] for video in details],
+        "major_label": pd.Categorical([video.get("major_label") for video in details]),
+        "minor_labels": [video.get("minor_labels") or [] for video in details],
+        "total_duration": np.array([video.get("total_duration", 0) for video in details], dtype=np.float32),
+        "publish_time": pd.to_datetime([video.get("publish_time") for video in details], utc=True),
+        "view_count": pd.to_numeric([video.get("yt_stats", {}).get("viewCount") for video in details],
+                                    errors="coerce"),
+    })
+
+
+def _utterances_from_json(file_paths):
+    # Fallback for the videos missing from the columnar store: parse the files once into flat columns
+    columns = {column: [] for column in UTTERANCE_COLUMNS}
+    for file_path in file_paths:
+        video_id = os.path.basename(file_path)[:-len(".json")]
+        with open(file_path) as fd:
+            records = json.load(fd)
+        columns["video_id"].extend([video_id] * len(records))
+        columns["turn"].extend(range(len(records)))
+        columns["start"].extend(float(record["segment_start"]) / 1000 for record in records)
+        columns["end"].extend(float(record["segment_end"]) / 1000 for record in records)
+        columns["speaker"].extend(record["speaker"] for record in records)
+        for attribute, column in zip(columnar_store.PERSPECTIVE_ATTRIBUTES, ATTRIBUTES):
+            columns[column].extend(
+                record.get("perspective", {}).get("attributeScores", {}).get(attribute, {})
+                .get("summaryScore", {}).get("value", np.nan) for record in records)
+    return pd.DataFrame(columns)
+
+
+def get_sources():
+    """
+    Get the files holding the Perspective results: the columnar store partition of every stored
+    video, and the JSON file of every video missing from the store (e.g. scored before the store
+    existed).
+
+    Returns:
+        tuple: (sorted store partition paths, sorted JSON file paths)
+    """
+    stored_video_ids = columnar_store.stored_video_ids("perspective")
+    store_paths = sorted(os.path.join(columnar_store.get_partition_dir("perspective", video_id), "part-0.parquet")
+                         for video_id in stored_video_ids)
+    json_dir = ConfigConstants.PERSPECTIVE_FILE_DIR
+    json_paths = sorted(os.path.join(json_dir, file_name) for file_name in os.listdir(json_dir)
+                        if file_name.endswith(".json") and file_name[:-len(".json")] not in stored_video_ids)
+    return store_paths, json_paths
+
+
+def fingerprint(file_paths):
+    """
+    Hash the paths, sizes and modification times of the source files; a cached aggregate is valid
+    as long as this doesn't change.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        digest.update(f"{file_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def cached(name, key, compute, use_cache=True):
+    """
+    Get a DataFrame from the analytics cache, or compute and cache it.
+
+    Args:
+        name (str): Name of the cached DataFrame.
+        key (str): Fingerprint of everything it depends on.
+        compute (callable): Computes the DataFrame on a cache miss.
+        use_cache (bool): Whether to read (and write) the cache.
+
+    Returns:
+        pd.DataFrame: The DataFrame.
+    """
+    cache_path = os.path.join(ConfigConstants.ANALYTICS_CACHE_DIR, f"{name}-{key}.parquet")
+    if use_cache and os.path.exists(cache_path):
+        logger.debug(f"Analytics cache hit: {cache_path}")
+        return pd.read_parquet(cache_path)
+    df = compute()
+    if use_cache:
+        # Only the latest version of every cached DataFrame is kept
+        for file_name in os.listdir(ConfigConstants.ANALYTICS_CACHE_DIR):
+            if file_name.startswith(f"{name}-"):
+                os.remove(os.path.join(ConfigConstants.ANALYTICS_CACHE_DIR, file_name))
+        df.to_parquet(cache_path, index=False)
+    return df
+
+
+def load_utterances(use_cache=True):
+    """
+    Load the scored utterances of all videos into one DataFrame.
+
+    Returns:
+        pd.DataFrame: One row per utterance: video_id, turn, start, end, duration, speaker (seconds,
+            float32) and the float32 score of every attribute (NaN for empty utterances).
+    """
+    store_paths, json_paths = get_sources()
+    logger.info(f"Loading the utterances of {len(store_paths)} videos from the columnar store and "
+                f"{len(json_paths)} from the JSON files")
+    if store_paths and json_paths:
+        logger.warning(f"{len(json_paths)} videos are only in the Perspective JSON files, which are slower to "
+                       f"load; store them with `python -m src.tv_debs_utils.columnar_store convert perspective`")
+
+    def compute():
+        parts = []
+        if store_paths:
+            parts.append(columnar_store.read_stage("perspective", columns=UTTERANCE_COLUMNS).to_pandas())
+        if json_paths or not parts:
+            parts.append(_utterances_from_json(json_paths))
+        df = pd.concat(parts, ignore_index=True)
+        df["video_id"] = df["video_id"].astype(str)
+        df["speaker"] = df["speaker"].astype(str)
+        for column in ["start", "end"] + ATTRIBUTES:
+            df[column] = df[column].astype(np.float32)
+        df["duration"] = df["end"] - df["start"]
+        return df
+
+    return cached("utterances", fingerprint(store_paths + json_paths), compute, use_cache)
+
+
+def above_threshold(scores, threshold):
+    # NaN for unscored (empty) utterances, so that they don't count in the shares
+    return (scores > threshold).astype(np.float32).where(scores.notna())
+
+
+def speaker_stats(utterances, attribute="toxicity", threshold=0.5):
+    """
+    Per-speaker statistics of every video (speakers are only identified within a video).
+
+    Args:
+        utterances (pd.DataFrame): Output of `load_utterances`.
+        attribute (str): Score column.
+        threshold (float): Score above which an utterance counts as uncivil.
+
+    Returns:
+        pd.DataFrame: video_id, speaker, num_utterances, speaking_time, mean_turn_duration, mean
+            and max score, and share of the utterances above the threshold.
+    """
+    return (utterances.assign(above=above_threshold(utterances[attribute], threshold))
+            .groupby(["video_id", "speaker"], observed=True, sort=False)
+            .agg(num_utterances=("turn", "size"),
+                 speaking_time=("duration", "sum"),
+                 mean_turn_duration=("duration", "mean"),
+                 **{f"mean_{attribute}": (attribute, "mean"), f"max_{attribute}": (attribute, "max")},
+                 share_above=("above", "mean"))
+            .reset_index())
+
+
+def group_stats(utterances, details, group_by="major_label", attribute="toxicity", threshold=0.5,
+                quantiles=QUANTILES):
+    """
+    Statistics of the utterances grouped by a video property (video_id, major_label, minor_labels).
+
+    A video with several minor labels counts in every one of them.
+
+    Args:
+        utterances (pd.DataFrame): Output of `load_utterances`.
+        details (pd.DataFrame): Output of `load_video_details`.
+        group_by (str): Column to group by.
+        attribute (str): Score column.
+        threshold (float): Score above which an utterance counts as uncivil.
+        quantiles (list): Quantiles of the score to report.
+
+    Returns:
+        pd.DataFrame: One row per group: num_videos, num_utterances, speaking_time (hours), mean
+            score of every attribute, quantiles of `attribute` and share of the utterances above
+            the threshold.
+    """
+    df = utterances
+    if group_by != "video_id":
+        video_groups = details[["video_id", group_by]]
+        if group_by == "minor_labels":
+            video_groups = video_groups.explode("minor_labels").dropna()
+        df = df.merge(video_groups, on="video_id", how="inner")
+    df = df.assign(above=above_threshold(df[attribute], threshold))
+
+    grouped = df.groupby(group_by, observed=True)
+    stats = grouped.agg(num_videos=("video_id", "nunique"),
+                        num_utterances=("turn", "size"),
+                        speaking_time=("duration", "sum"),
+                        share_above=("above", "mean"),
+                        **{f"mean_{column}": (column, "mean") for column in ATTRIBUTES})
+    stats["speaking_time"] = stats["speaking_time"] / 3600
+    score_quantiles = grouped[attribute].quantile(quantiles).unstack()
+    score_quantiles.columns = [f"{attribute}_q{int(quantile * 100)}" for quantile in score_quantiles.columns]
+    return stats.join(score_quantiles).sort_values("num_utterances", ascending=False)
+
+
+def build_report(group_by="major_label", attribute="toxicity", threshold=0.5, use_cache=True):
+    """
+    Compute (or get from the cache) the grouped statistics.
+
+    Returns:
+        pd.DataFrame: Output of `group_stats` (or `speaker_stats` for group_by="speaker").
+    """
+    utterances = load_utterances(use_cache)
+    details_mtime = os.stat(ConfigConstants.VIDEO_DETAILS_PATH).st_mtime_ns
+    store_paths, json_paths = get_sources()
+    key = hashlib.sha256(json.dumps([fingerprint(store_paths + json_paths), details_mtime, group_by, attribute,
+                                     threshold]).encode()).hexdigest()[:16]
+    if group_by == "speaker":
+        return cached("speaker_stats", key, lambda: speaker_stats(utterances, attribute, threshold), use_cache)
+    return cached(f"{group_by}_stats", key,
+                  lambda: group_stats(utterances, load_video_details(), group_by, attribute, threshold).reset_index(),
+                  use_cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incivility statistics over the Perspective results.")
+    parser.add_argument("--group-by", choices=["major_label", "minor_labels", "video_id", "speaker"],
+                        default="major_label")
+    parser.add_argument("--attribute", choices=ATTRIBUTES, default="toxicity")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Score above which an utterance is uncivil")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute everything, without reading the cache")
+    parser.add_argument("--output", default=None, help="CSV file to save the report to")
+    args = parser.parse_args()
+
+    ConfigConstants.create_directories()
+    report = build_report(args.group_by, args.attribute, args.threshold, not args.no_cache)
+    if args.output:
+        report.to_csv(args.output, index=False)
+    with pd.option_context("display.max_rows", 100, "display.width", 200):
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
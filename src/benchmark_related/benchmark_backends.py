@@ -0,0 +1,251 @@
+import os
+import gc
+import json
+import time
+import argparse
+import numpy as np
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils, inference_backend
+from ..transcription_related import run_pipeline_transcription, turn_consolidation
+from ..transcription_related.benchmark_transcription_modes import word_error_rate
+from .run_benchmarks import get_metadata
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+
+def load_sample(video_id):
+    """
+    Download and cut a video of the sample like the pipelines do, from its saved VAD and OSD data.
+
+    Args:
+        video_id (str): YouTube video ID (with VAD, OSD and diarization data available)
+
+    Returns:
+        dict: video_id, audio (part_0), part_2, dia_data (consolidated like the transcription
+            pipeline) and original_seconds; None if the download failed
+    """
+    if not debate_utils.download_ytvid_as_wav(video_id):
+        logger.debug(f"Video download failed for {video_id=}")
+        return None
+    audio = debate_utils.load_audio(video_id)
+    stage_data = {}
+    for name, data_dir in [("vad", ConfigConstants.VAD_FILE_DIR), ("osd", ConfigConstants.OSD_FILE_DIR),
+                           ("diarization", ConfigConstants.DIARIZATION_FILE_DIR)]:
+        with open(os.path.join(data_dir, f"{video_id}.json"), 'r') as fd:
+            stage_data[name] = json.load(fd)
+    speech_audio, _ = debate_utils.remove_non_speech(audio, stage_data["vad"])
+    non_overlap_audio, _ = debate_utils.write_non_overlap(speech_audio, stage_data["osd"])
+    dia_data, _ = turn_consolidation.consolidate_turns(
+        stage_data["diarization"], ConfigConstants.TURN_MERGE_MAX_GAP, ConfigConstants.TURN_MERGE_MAX_DURATION)
+    return {"video_id": video_id, "audio": audio, "part_2": non_overlap_audio, "dia_data": dia_data,
+            "original_seconds": len(audio) / debate_utils.sr}
+
+
+def get_speed(seconds, samples):
+    """
+    Real-time factors of a processing time: per second of the audio processed, and per second of
+    the original videos (what the corpus estimates are based on).
+    """
+    original_seconds = sum(sample["original_seconds"] for sample in samples)
+    return {"seconds": seconds, "real_time_factor_original": seconds / max(original_seconds, 1e-9)}
+
+
+def benchmark_whisper(samples, model_name, precision, device, threads, mode, references):
+    """
+    Transcribe the sample with a whisper option.
+
+    Args:
+        samples (list): Outputs of `load_sample`.
+        model_name (str): Whisper model size.
+        precision (str): 'fp32' or 'int8'.
+        device (str): Device to run on.
+        threads (list): Intra-op thread counts to time the option with.
+        mode (str): Transcription mode.
+        references (dict, optional): Reference transcripts by video ID; WERs are computed against them.
+
+    Returns:
+        tuple: One result dict per thread count, and the transcripts (by video ID) of the first one.
+    """
+    start_time = time.perf_counter()
+    whisper_model = run_pipeline_transcription.load_whisper_model(model_name, device, precision)
+    load_seconds = time.perf_counter() - start_time
+
+    results, first_transcripts = [], None
+    for num_threads in threads:
+        inference_backend.configure_threads(num_threads, 0)
+        transcripts, seconds = {}, 0.0
+        for sample in samples:
+            start_time = time.perf_counter()
+            with inference_backend.inference_mode():
+                transcripts[sample["video_id"]] = run_pipeline_transcription.transcribe_track(
+                    whisper_model, sample["part_2"], sample["dia_data"], mode)
+            seconds += time.perf_counter() - start_time
+        part_2_seconds = sum(len(sample["part_2"]) for sample in samples) / debate_utils.sr
+        result = {"model": model_name, "precision": precision, "threads": num_threads, "load_seconds": load_seconds,
+                  **get_speed(seconds, samples), "real_time_factor": seconds / max(part_2_seconds, 1e-9)}
+        if references is not None:
+            result["wer"] = float(np.mean([word_error_rate(references[video_id], transcript)
+                                           for video_id, transcript in transcripts.items()]))
+        logger.info(f"whisper {model_name} {precision} ({num_threads} threads): {json.dumps(result)}")
+        results.append(result)
+        first_transcripts = first_transcripts or transcripts
+
+    del whisper_model
+    gc.collect()
+    return results, first_transcripts
+
+
+def benchmark_diarization(samples, precision, device, references):
+    """
+    Run VAD/OSD and diarization on the sample with a precision.
+
+    Args:
+        samples (list): Outputs of `load_sample`.
+        precision (str): 'fp32' or 'int8'.
+        device (str): Device to run on.
+        references (dict, optional): fp32 outputs by video ID (frame scores and diarization); the
+            agreement of the frame decisions and the diarization error rate are computed against them.
+
+    Returns:
+        tuple: Result dict, and the outputs (by video ID) of the option.
+    """
+    from pyannote.metrics.diarization import DiarizationErrorRate
+    from ..diarization_vad_osd_related import run_pipeline_osd_vad, speech_overlap_detection, frame_scores
+
+    speaker_diarization_model, _, speech_overlap_inference = run_pipeline_osd_vad.load_models(device, precision)
+    outputs, vad_osd_seconds, diarization_seconds = {}, 0.0, 0.0
+    for sample in samples:
+        with inference_backend.inference_mode():
+            start_time = time.perf_counter()
+            scores, _ = speech_overlap_detection.get_frame_scores(speech_overlap_inference, sample["audio"])
+            vad_osd_seconds += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            # Diarized on the part_2 track cut from the saved data, so that every option sees the same audio
+            diarization = speaker_diarization_model(debate_utils.as_pyannote_input(sample["part_2"]))
+            diarization_seconds += time.perf_counter() - start_time
+        outputs[sample["video_id"]] = {"scores": scores, "diarization": diarization}
+
+    result = {"precision": precision, "vad_osd": get_speed(vad_osd_seconds, samples),
+              "diarization": get_speed(diarization_seconds, samples)}
+    result["seconds"] = vad_osd_seconds + diarization_seconds
+    result["real_time_factor_original"] = (result["vad_osd"]["real_time_factor_original"]
+                                           + result["diarization"]["real_time_factor_original"])
+    if references is not None:
+        onset = frame_scores.HYPER_PARAMETERS["onset"]
+        agreements = {"speech": [], "overlap": []}
+        der = DiarizationErrorRate()
+        for video_id, output in outputs.items():
+            reference_scores = references[video_id]["scores"]
+            for column, name in [(frame_scores.SPEECH_COLUMN, "speech"), (frame_scores.OVERLAP_COLUMN, "overlap")]:
+                agreements[name].append(np.mean((output["scores"][:, column] > onset)
+                                                == (reference_scores[:, column] > onset)))
+            der(references[video_id]["diarization"], output["diarization"])
+        result["speech_frame_agreement"] = float(np.mean(agreements["speech"]))
+        result["overlap_frame_agreement"] = float(np.mean(agreements["overlap"]))
+        result["diarization_error_rate"] = float(abs(der))
+    logger.info(f"VAD/OSD and diarization {precision}: {json.dumps(result)}")
+
+    del speaker_diarization_model, speech_overlap_inference
+    gc.collect()
+    return result, outputs
+
+
+def project_corpus(options):
+    """
+    Estimate the processing hours of the whole corpus (data/video_details.json) for every option,
+    from its real-time factor on the original videos.
+
+    Returns:
+        dict: num_videos, audio_hours and, for every option (by label), the estimated hours; None
+            without video details.
+    """
+    if not os.path.exists(ConfigConstants.VIDEO_DETAILS_PATH):
+        return None
+    from ..tv_debs_utils.video_catalog import VideoCatalog
+
+    catalog = VideoCatalog()
+    audio_hours = float(catalog.columns["total_duration"].sum() / 3600)
+    return {"num_videos": len(catalog.video_ids), "audio_hours": audio_hours,
+            "hours": {label: audio_hours * result["real_time_factor_original"] for label, result in options.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the speed and accuracy of the inference backend options (whisper model sizes, int8 "
+                    "quantization, thread counts) against the fp32 baseline on a fixed sample of videos.")
+    parser.add_argument("video_ids", help="YouTube ID or path to a JSON list of IDs (with diarization data)")
+    parser.add_argument("--whisper-models", nargs="+", default=[ConfigConstants.WHISPER_MODEL],
+                        help="Whisper model sizes; the first one in fp32 is the baseline")
+    parser.add_argument("--precisions", nargs="+", choices=inference_backend.PRECISIONS,
+                        default=inference_backend.PRECISIONS)
+    parser.add_argument("--threads", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="Intra-op thread counts to time every option with")
+    parser.add_argument("--device", default="cpu", help="Device of all the options (int8 runs on cpu only)")
+    parser.add_argument("--mode", default=run_pipeline_transcription.PER_UTTERANCE_MODE,
+                        choices=[run_pipeline_transcription.PER_UTTERANCE_MODE,
+                                 run_pipeline_transcription.WHOLE_TRACK_MODE])
+    parser.add_argument("--reference-dir", default=None,
+                        help="Reference transcripts (<id>.json); by default the baseline output is the reference")
+    parser.add_argument("--skip-diarization", action="store_true", help="Only compare the whisper options")
+    parser.add_argument("--output", default="inference_backend_benchmark.json")
+    args = parser.parse_args()
+    ConfigConstants.create_directories()
+
+    samples = [sample for sample in map(load_sample, run_pipeline_transcription.load_video_ids(args.video_ids))
+               if sample is not None]
+    report = {"metadata": {**get_metadata(), "device": args.device, "mode": args.mode},
+              "sample": [{"video_id": sample["video_id"], "original_seconds": sample["original_seconds"],
+                          "part_2_seconds": len(sample["part_2"]) / debate_utils.sr,
+                          "num_turns": len(sample["dia_data"])} for sample in samples],
+              "whisper": [], "diarization": []}
+
+    # Whisper: the baseline runs first, every other option is compared with its transcripts
+    references = None
+    if args.reference_dir is not None:
+        references = {}
+        for sample in samples:
+            with open(os.path.join(args.reference_dir, f"{sample['video_id']}.json"), 'r') as fd:
+                references[sample["video_id"]] = json.load(fd)
+    whisper_options = [(model_name, precision) for model_name in args.whisper_models for precision in args.precisions]
+    baseline = (args.whisper_models[0], inference_backend.FP32)
+    whisper_options = [baseline] + [option for option in whisper_options if option != baseline]
+    for model_name, precision in whisper_options:
+        results, transcripts = benchmark_whisper(samples, model_name, precision, args.device, args.threads,
+                                                 args.mode, references)
+        if references is None:
+            references = transcripts
+            for result in results:
+                result["wer"] = 0.0
+        report["whisper"].extend(results)
+
+    # VAD/OSD and diarization: fp32 first, as the reference of the other precisions
+    if not args.skip_diarization:
+        diarization_references = None
+        precisions = [inference_backend.FP32] + [precision for precision in args.precisions
+                                                 if precision != inference_backend.FP32]
+        for precision in precisions:
+            result, outputs = benchmark_diarization(samples, precision, args.device, diarization_references)
+            diarization_references = diarization_references or outputs
+            report["diarization"].append(result)
+
+    options = {f"whisper {result['model']} {result['precision']} {result['threads']} threads": result
+               for result in report["whisper"]}
+    options.update({f"vad_osd+diarization {result['precision']}": result for result in report["diarization"]})
+    report["corpus"] = project_corpus(options)
+
+    with open(args.output, 'w') as fd:
+        json.dump(report, fd, indent=1)
+    logger.info(f"Benchmark results written to: {args.output}")
+
+    corpus_hours = report["corpus"]["hours"] if report["corpus"] else {}
+    print(f"{'option':>44} {'RTF':>8} {'WER/DER':>8} {'corpus hours':>13}")
+    for label, result in options.items():
+        error_rate = result.get("wer", result.get("diarization_error_rate"))
+        error_rate = f"{error_rate:8.3f}" if error_rate is not None else f"{'-':>8}"
+        hours = f"{corpus_hours[label]:13.0f}" if label in corpus_hours else f"{'-':>13}"
+        print(f"{label:>44} {result['real_time_factor_original']:8.3f} {error_rate} {hours}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,498 @@
+import os
+import sys
+import json
+import time
+import shutil
+import queue
+import asyncio
+import argparse
+import threading
+import platform
+import statistics
+import subprocess
+import multiprocessing
+from functools import cached_property
+import numpy as np
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils, instrumentation
+from . import synthetic_debate, stub_models
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Stages benchmarked, each in its own process so that its peak RSS is its own
+STAGES = ["vad_osd_postprocessing", "remove_non_speech", "write_non_overlap", "streaming_cut", "utterance_slicing",
+          "utterance_export", "transcription_dispatch", "perspective_scheduling"]
+
+DEFAULT_LENGTHS = [600, 1800, 3600]
+
+DEFAULT_DATA_ROOT = os.path.join(ConfigConstants.ProjectDir, "data/benchmark")
+
+
+def use_data_root(data_root):
+    """
+    Move every data folder and file of ConfigConstants under `data_root`, so that benchmarks never
+    touch the real results, scratch folder or caches.
+
+    Args:
+        data_root (str): Folder replacing the project's data folder.
+    """
+    data_dir = os.path.normpath(os.path.join(ConfigConstants.ProjectDir, "data"))
+    for attribute, value in list(vars(ConfigConstants).items()):
+        if isinstance(value, str) and os.path.normpath(value).startswith(data_dir + os.sep):
+            setattr(ConfigConstants, attribute, os.path.join(data_root, os.path.relpath(value, data_dir)))
+    ConfigConstants.all_directories = [os.path.join(data_root, os.path.relpath(directory, data_dir))
+                                       for directory in ConfigConstants.all_directories]
+    # Only the stages themselves are measured
+    ConfigConstants.COLUMNAR_STORE = False
+    ConfigConstants.AUDIO_CACHE = False
+    ConfigConstants.TRACING = False
+    ConfigConstants.create_directories()
+
+
+def get_video_id(length, seed):
+    return f"synthetic_{length}s_seed{seed}"
+
+
+class BenchmarkInputs:
+    """
+    Inputs of the stages for one synthetic debate, computed (outside the measurements) on first use.
+
+    Args:
+        video_id (str): ID of the debate, whose WAV is in the part_0 folder.
+        options (dict): Benchmark options.
+    """
+
+    def __init__(self, video_id, options):
+        self.video_id = video_id
+        self.options = options
+        self.part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{video_id}.wav")
+
+    @cached_property
+    def truth(self):
+        return synthetic_debate.load_truth(self.part_0_path)
+
+    @cached_property
+    def audio(self):
+        return debate_utils.load_audio(self.video_id)
+
+    @cached_property
+    def frame_scores(self):
+        return stub_models.StubSpeechOverlapInference(self.truth, self.options["seed"]).get_frame_scores(len(self.audio))
+
+    @cached_property
+    def timestamps(self):
+        from ..diarization_vad_osd_related import frame_scores
+
+        scores, sliding_window = self.frame_scores
+        return frame_scores.binarize_frame_scores(scores, sliding_window, frame_scores.HYPER_PARAMETERS)
+
+    @cached_property
+    def part_1(self):
+        return debate_utils.remove_non_speech(self.audio, self.timestamps[0])
+
+    @cached_property
+    def osd(self):
+        return debate_utils.project_timestamps(self.timestamps[1], self.part_1[1])
+
+    @cached_property
+    def timeline_map(self):
+        from ..tv_debs_utils.timeline_map import build_timeline_map
+
+        return build_timeline_map(self.timestamps[0], self.osd, len(self.audio))
+
+    @cached_property
+    def part_2(self):
+        return debate_utils.write_non_overlap(self.part_1[0], self.osd)[0]
+
+    @cached_property
+    def dia_data(self):
+        return stub_models.StubDiarization(self.truth).diarize(self.timeline_map)
+
+    @cached_property
+    def utterance_bounds(self):
+        sr = debate_utils.sr
+        return [(int(utter[0]['start'] * sr), int(utter[0]['end'] * sr)) for utter in self.dia_data]
+
+    @cached_property
+    def transcript(self):
+        from ..transcription_related import run_pipeline_transcription
+
+        return run_pipeline_transcription.transcribe_track(
+            stub_models.StubWhisperModel(), self.part_2, self.dia_data, run_pipeline_transcription.WHOLE_TRACK_MODE)
+
+
+# Every stage: (prepare, run). prepare computes the inputs outside the measurement; run returns
+# the number of items (turns, utterances) it processed, or None
+def _prepare_vad_osd_postprocessing(inputs):
+    return inputs.frame_scores
+
+
+def _run_vad_osd_postprocessing(inputs):
+    from ..diarization_vad_osd_related import frame_scores
+    from ..tv_debs_utils.timeline_map import build_timeline_map
+
+    scores, sliding_window = inputs.frame_scores
+    speech, overlap = frame_scores.binarize_frame_scores(scores, sliding_window, frame_scores.HYPER_PARAMETERS)
+    # The speech cut itself is the remove_non_speech stage: only its segment map is built here
+    speech_segment_map = debate_utils.build_segment_map(
+        debate_utils.timestamps_to_sample_bounds(speech, debate_utils.sr, len(inputs.audio)))
+    osd = debate_utils.project_timestamps(overlap, speech_segment_map)
+    build_timeline_map(speech, osd, len(inputs.audio))
+    return len(scores)
+
+
+def _prepare_remove_non_speech(inputs):
+    return inputs.audio, inputs.timestamps
+
+
+def _run_remove_non_speech(inputs):
+    debate_utils.remove_non_speech(inputs.audio, inputs.timestamps[0])
+    return len(inputs.timestamps[0])
+
+
+def _prepare_write_non_overlap(inputs):
+    return inputs.part_1, inputs.osd
+
+
+def _run_write_non_overlap(inputs):
+    debate_utils.write_non_overlap(inputs.part_1[0], inputs.osd)
+    return len(inputs.osd)
+
+
+def _prepare_streaming_cut(inputs):
+    return inputs.timeline_map
+
+
+def _run_streaming_cut(inputs):
+    from ..tv_debs_utils import audio_stream
+    from ..tv_debs_utils.timeline_map import ORIGINAL, PART_2
+
+    part_2_path = os.path.join(ConfigConstants.PART_2_PATH, f"{inputs.video_id}.wav")
+    segment_map = inputs.timeline_map.maps[(ORIGINAL, PART_2)].segment_map
+    with audio_stream.AudioFileReader(inputs.part_0_path) as reader:
+        audio_stream.write_cut(reader, part_2_path, segment_map)
+    os.remove(part_2_path)
+    return len(segment_map)
+
+
+def _prepare_utterance_slicing(inputs):
+    return inputs.part_2, inputs.utterance_bounds
+
+
+def _run_utterance_slicing(inputs):
+    # What the per-utterance transcription does before whisper: slice and convert every turn
+    for start, end in inputs.utterance_bounds:
+        debate_utils.to_float32(inputs.part_2[start:end])
+    return len(inputs.utterance_bounds)
+
+
+def _prepare_utterance_export(inputs):
+    return inputs.part_2, inputs.utterance_bounds
+
+
+def _run_utterance_export(inputs):
+    import soundfile as sf
+
+    export_dir = os.path.join(ConfigConstants.UTTERANCES_FILE_DIR_TMP, inputs.video_id)
+    os.makedirs(export_dir, exist_ok=True)
+    for idx, (start, end) in enumerate(inputs.utterance_bounds):
+        sf.write(os.path.join(export_dir, f"{idx}.wav"), inputs.part_2[start:end], debate_utils.sr)
+    shutil.rmtree(export_dir)
+    return len(inputs.utterance_bounds)
+
+
+def _prepare_transcription_dispatch(inputs):
+    return inputs.part_2, inputs.dia_data
+
+
+def _run_transcription_dispatch(inputs):
+    from ..transcription_related import run_pipeline_transcription, turn_consolidation
+
+    dia_data, source_turns = turn_consolidation.consolidate_turns(
+        inputs.dia_data, ConfigConstants.TURN_MERGE_MAX_GAP, ConfigConstants.TURN_MERGE_MAX_DURATION)
+    whisper_model = stub_models.StubWhisperModel(real_time_factor=inputs.options["whisper_real_time_factor"])
+    trans_data = run_pipeline_transcription.transcribe_track(
+        whisper_model, inputs.part_2, dia_data, run_pipeline_transcription.WHOLE_TRACK_MODE, source_turns)
+    return len(trans_data)
+
+
+def _prepare_perspective_scheduling(inputs):
+    with open(os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{inputs.video_id}.json"), 'w') as fd:
+        json.dump(inputs.transcript, fd)
+    for stale_path in [ConfigConstants.RUN_MANIFEST_PATH, ConfigConstants.PERSPECTIVE_CACHE_PATH]:
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(stale_path + suffix):
+                os.remove(stale_path + suffix)
+    return inputs.transcript
+
+
+async def _score_with_mock_server(video_id, options):
+    from aiohttp import web
+    from ..tv_debs_utils.run_manifest import RunManifest
+    from ..perspective_related import mock_perspective_server, run_pipeline_perspective
+
+    # The mock server stands in for the Perspective API, with its per-key quota
+    runner = web.AppRunner(mock_perspective_server.create_app(options["perspective_qps"],
+                                                              options["perspective_latency"], 0.0))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    ConfigConstants.PERSPECTIVE_API_URL = f"http://127.0.0.1:{port}{mock_perspective_server.ANALYZE_PATH}"
+    ConfigConstants.PERSPECTIVE_API_KEYS = [f"benchmark-key-{idx}" for idx in range(options["perspective_keys"])]
+    ConfigConstants.PERSPECTIVE_QPS_PER_KEY = options["perspective_qps"]
+    manifest = RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    try:
+        await run_pipeline_perspective.run([video_id], manifest)
+    finally:
+        manifest.close()
+        await runner.cleanup()
+
+
+def _run_perspective_scheduling(inputs):
+    asyncio.run(_score_with_mock_server(inputs.video_id, inputs.options))
+    return len(inputs.transcript)
+
+
+class _RssGrowth:
+    """
+    Largest growth of the resident set size above its size on entry (after the inputs are prepared),
+    from the reset peak RSS on Linux, else sampled by a thread.
+    """
+
+    def __enter__(self):
+        self.rss_before = instrumentation.get_rss_bytes()
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.sampled_peak = self.rss_before
+        if not instrumentation.reset_peak_rss():
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(0.005):
+            self.sampled_peak = max(self.sampled_peak, instrumentation.get_rss_bytes())
+
+    def __exit__(self, *exc_info):
+        if self.sampler is None:
+            self.peak = instrumentation.get_peak_rss_bytes()
+        else:
+            self.stopped.set()
+            self.sampler.join()
+            self.peak = max(self.sampled_peak, instrumentation.get_rss_bytes())
+        self.growth = max(0, self.peak - self.rss_before)
+
+
+def _run_stage_child(stage, video_id, data_root, options, result_queue):
+    try:
+        use_data_root(data_root)
+        inputs = BenchmarkInputs(video_id, options)
+        prepare, run = globals()[f"_prepare_{stage}"], globals()[f"_run_{stage}"]
+        prepare(inputs)
+        wall_times, cpu_times, rss_growths = [], [], []
+        for repeat in range(options["repeats"]):
+            if stage == "perspective_scheduling" and repeat:
+                # Every repeat scores the transcript again, without the cached scores
+                prepare(inputs)
+            # Only the memory the stage itself adds counts, not the interpreter, imports and inputs
+            with _RssGrowth() as rss_growth:
+                start_wall, start_cpu = time.perf_counter(), time.process_time()
+                num_items = run(inputs)
+                wall_times.append(time.perf_counter() - start_wall)
+                cpu_times.append(time.process_time() - start_cpu)
+            rss_growths.append(rss_growth)
+        wall_seconds = statistics.median(wall_times)
+        audio_seconds = len(inputs.audio) / debate_utils.sr
+        result_queue.put({
+            "wall_seconds": wall_seconds,
+            "min_wall_seconds": min(wall_times),
+            "cpu_seconds": statistics.median(cpu_times),
+            "audio_seconds": audio_seconds,
+            "audio_seconds_per_second": audio_seconds / max(wall_seconds, 1e-9),
+            "num_items": num_items,
+            "items_per_second": num_items / max(wall_seconds, 1e-9) if num_items is not None else None,
+            "rss_before_mb": rss_growths[0].rss_before / 1024 ** 2,
+            "peak_rss_mb": max(rss_growth.peak for rss_growth in rss_growths) / 1024 ** 2,
+            "rss_growth_mb": max(rss_growth.growth for rss_growth in rss_growths) / 1024 ** 2,
+        })
+    except BaseException as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def run_stage(stage, video_id, data_root, options):
+    """
+    Benchmark a stage in a fresh process.
+
+    Returns:
+        dict: Median wall and CPU seconds of the repeats, audio seconds processed per second,
+            items per second, resident memory before the stage and peak resident memory; or the error
+            if the stage raised or its process died (e.g. killed by the OOM killer).
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_run_stage_child, args=(stage, video_id, data_root, options, result_queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may have been put just before the process exited
+                try:
+                    result = result_queue.get(timeout=1)
+                except queue.Empty:
+                    result = {"error": f"exit code {process.exitcode}"}
+    process.join()
+    return result
+
+
+def fit_exponent(lengths, values):
+    """
+    Exponent of the power law value ~ length^exponent fitted on the results (1 = linear scaling).
+    """
+    pairs = [(length, value) for length, value in zip(lengths, values) if value and value > 0]
+    if len(pairs) < 2:
+        return None
+    return float(np.polyfit(np.log([pair[0] for pair in pairs]), np.log([pair[1] for pair in pairs]), 1)[0])
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ConfigConstants.ProjectDir,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def run_benchmarks(lengths, stages, data_root, options):
+    """
+    Generate the synthetic debates and benchmark every stage on each of them.
+
+    Args:
+        lengths (list): Lengths of the debates, in seconds.
+        stages (list): Names of the stages (from STAGES).
+        data_root (str): Folder of the benchmark data.
+        options (dict): seed, num_speakers, repeats, whisper_real_time_factor, perspective_qps,
+            perspective_latency and perspective_keys.
+
+    Returns:
+        dict: metadata, options, results (stage -> length -> measurements) and scaling (stage ->
+            exponents of the wall time and of the memory growth with the length).
+    """
+    use_data_root(data_root)
+    video_ids = {}
+    for length in lengths:
+        video_ids[length] = get_video_id(length, options["seed"])
+        wav_path = os.path.join(ConfigConstants.PART_0_PATH, f"{video_ids[length]}.wav")
+        if not os.path.exists(wav_path):
+            logger.info(f"Synthesizing a {length}s debate")
+            synthetic_debate.write_debate(wav_path, length, options["num_speakers"], options["seed"])
+
+    results = {stage: {} for stage in stages}
+    for stage in stages:
+        for length in lengths:
+            result = run_stage(stage, video_ids[length], data_root, options)
+            results[stage][str(length)] = result
+            logger.info(f"{stage} on {length}s: {json.dumps(result)}")
+
+    scaling = {}
+    for stage in stages:
+        measured = [(length, results[stage][str(length)]) for length in lengths
+                    if "error" not in results[stage][str(length)]]
+        scaling[stage] = {
+            "wall_seconds_exponent": fit_exponent([length for length, _ in measured],
+                                                  [result["wall_seconds"] for _, result in measured]),
+            "rss_growth_exponent": fit_exponent([length for length, _ in measured],
+                                                [result["rss_growth_mb"] for _, result in measured]),
+        }
+    return {"metadata": get_metadata(), "options": options, "results": results, "scaling": scaling}
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """
+    Compare the wall time and RSS growth of every (stage, length) measured in both reports.
+
+    Args:
+        report (dict): Output of `run_benchmarks`.
+        baseline (dict): Earlier output of `run_benchmarks`.
+        tolerance (float): Relative increase above which a measurement is a regression.
+
+    Returns:
+        list: One dict per compared measurement: stage, length, metric, baseline, current, ratio
+            and regression.
+    """
+    comparisons = []
+    for stage, stage_results in report["results"].items():
+        for length, result in stage_results.items():
+            baseline_result = baseline.get("results", {}).get(stage, {}).get(length)
+            if baseline_result is None or "error" in result or "error" in baseline_result:
+                continue
+            # Baselines saved before rss_growth_mb existed only compare the wall time
+            for metric in [metric for metric in ["wall_seconds", "rss_growth_mb"] if metric in baseline_result]:
+                ratio = result[metric] / max(baseline_result[metric], 1e-9)
+                comparisons.append({"stage": stage, "length": int(length), "metric": metric,
+                                    "baseline": baseline_result[metric], "current": result[metric],
+                                    "ratio": ratio, "regression": ratio > 1 + tolerance})
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages offline, on synthetic debates with "
+                                                 "stub models, and compare against a saved baseline.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_LENGTHS, help="Debate lengths in seconds")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of every stage; the median is reported")
+    parser.add_argument("--whisper-real-time-factor", type=float, default=0.0,
+                        help="Seconds the stub whisper sleeps per second of audio")
+    parser.add_argument("--perspective-qps", type=float, default=200.0, help="Quota per key of the mock API")
+    parser.add_argument("--perspective-latency", type=float, default=0.01, help="Seconds per mock API request")
+    parser.add_argument("--perspective-keys", type=int, default=2)
+    parser.add_argument("--data-root", default=DEFAULT_DATA_ROOT,
+                        help="Folder of the synthetic debates and stage outputs (kept between runs)")
+    parser.add_argument("--output", default="pipeline_benchmark.json", help="JSON file to save the results to")
+    parser.add_argument("--baseline", default=None, help="Results of an earlier run to compare against; exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown (or memory increase) counted as a regression")
+    args = parser.parse_args()
+
+    options = {"seed": args.seed, "num_speakers": args.speakers, "repeats": args.repeats,
+               "whisper_real_time_factor": args.whisper_real_time_factor, "perspective_qps": args.perspective_qps,
+               "perspective_latency": args.perspective_latency, "perspective_keys": args.perspective_keys}
+    report = run_benchmarks(args.lengths, args.stages, args.data_root, options)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        report["baseline"] = {"path": args.baseline, "commit": baseline.get("metadata", {}).get("commit"),
+                              "comparisons": compare_to_baseline(report, baseline, args.tolerance)}
+        regressions = [comparison for comparison in report["baseline"]["comparisons"] if comparison["regression"]]
+
+    with open(args.output, 'w') as fd:
+        json.dump(report, fd, indent=1)
+    logger.info(f"Benchmark results written to: {args.output}")
+
+    for stage, stage_results in report["results"].items():
+        for length, result in stage_results.items():
+            if "error" in result:
+                print(f"{stage:>24} {length:>6}s  error: {result['error']}")
+                continue
+            print(f"{stage:>24} {length:>6}s  {result['wall_seconds']:8.3f}s  "
+                  f"{result['audio_seconds_per_second']:10.0f}x real time  RSS growth {result['rss_growth_mb']:8.1f} MB")
+    for regression in regressions:
+        print(f"REGRESSION {regression['stage']} {regression['length']}s {regression['metric']}: "
+              f"{regression['baseline']:.3f} -> {regression['current']:.3f} ({regression['ratio']:.2f}x)")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
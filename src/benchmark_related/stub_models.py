@@ -0,0 +1,107 @@
+import time
+import hashlib
+from types import SimpleNamespace
+import numpy as np
+from ..tv_debs_utils import debate_utils
+from ..tv_debs_utils.timeline_map import ORIGINAL, PART_2
+
+# Deterministic stand-ins of the models, built from the ground truth of a synthetic debate, so that
+# the stages around the models can be benchmarked without weights, GPUs or network access
+
+# Frames of pyannote/segmentation: 270-sample step, 991-sample receptive field
+FRAME_STEP = 270 / debate_utils.sr
+FRAME_DURATION = 991 / debate_utils.sr
+
+VOCABULARY = ["the", "debate", "policy", "tax", "people", "we", "they", "never", "always", "economy", "said", "vote",
+              "country", "plan", "wrong", "right", "look", "listen", "jobs", "health", "because", "that", "is", "not"]
+
+
+def _in_regions(times, regions):
+    regions = np.asarray(regions, dtype=np.float64).reshape(-1, 2)
+    idx = np.searchsorted(regions[:, 0], times, side='right') - 1
+    return (idx >= 0) & (times < regions[np.clip(idx, 0, None), 1]) if len(regions) else np.zeros(len(times), bool)
+
+
+class StubSpeechOverlapInference:
+    """
+    Stand-in for the VAD/OSD segmentation inference: frame scores high inside the speech and
+    overlap regions of the ground truth, low outside, with a deterministic jitter.
+
+    Args:
+        truth (dict): Ground truth of the debate (see `synthetic_debate.write_debate`).
+        seed (int): Seed of the jitter.
+    """
+
+    def __init__(self, truth, seed=0):
+        self.truth = truth
+        self.seed = seed
+
+    def get_frame_scores(self, num_samples):
+        """
+        Same output as `speech_overlap_detection.get_frame_scores` for an audio of `num_samples`.
+        """
+        num_frames = max(0, int((num_samples / debate_utils.sr - FRAME_DURATION) / FRAME_STEP) + 1)
+        centers = FRAME_DURATION / 2 + np.arange(num_frames) * FRAME_STEP
+        jitter = np.random.default_rng(self.seed).uniform(-0.1, 0.1, size=(num_frames, 2))
+        scores = np.column_stack((np.where(_in_regions(centers, self.truth["speech"]), 0.9, 0.05),
+                                  np.where(_in_regions(centers, self.truth["overlap"]), 0.85, 0.1)))
+        sliding_window = {"start": 0.0, "duration": FRAME_DURATION, "step": FRAME_STEP}
+        return np.clip(scores + jitter, 0, 1).astype(np.float16), sliding_window
+
+
+class StubDiarization:
+    """
+    Stand-in for the speaker diarization pipeline: the ground-truth turns, moved onto the part_2
+    timeline the real pipeline runs on.
+
+    Args:
+        truth (dict): Ground truth of the debate.
+    """
+
+    def __init__(self, truth, min_duration=0.05):
+        self.truth = truth
+        self.min_duration = min_duration
+
+    def diarize(self, timeline_map):
+        """
+        Returns:
+            list: Diarization data, as saved by the OSD+VAD pipeline.
+        """
+        turns = np.asarray(self.truth["turns"], dtype=np.float64).reshape(-1, 3)
+        intervals = timeline_map.convert_intervals(turns[:, :2], ORIGINAL, PART_2)
+        dia_data = [({"start": float(start), "end": float(end)}, {"A": f"SPEAKER_{int(speaker):02d}"})
+                    for (start, end), speaker in zip(intervals, turns[:, 2]) if end - start >= self.min_duration]
+        return sorted(dia_data, key=lambda utter: utter[0]["start"])
+
+
+class StubWhisperModel:
+    """
+    Stand-in for a whisper model: `transcribe` returns words at a steady rate over the audio, picked
+    from a hash of the samples, so the same audio always gives the same text.
+
+    Args:
+        words_per_second (float): Speaking rate of the transcripts.
+        real_time_factor (float): Seconds slept per second of audio, to simulate the model's cost.
+    """
+
+    def __init__(self, words_per_second=2.5, real_time_factor=0.0):
+        self.words_per_second = words_per_second
+        self.real_time_factor = real_time_factor
+        # Like a whisper model loaded on CPU
+        self.device = SimpleNamespace(type="cpu")
+
+    def transcribe(self, audio, language="en", word_timestamps=False, **kwargs):
+        seconds = len(audio) / debate_utils.sr
+        if self.real_time_factor:
+            time.sleep(seconds * self.real_time_factor)
+        digest = hashlib.sha256(np.ascontiguousarray(audio[:debate_utils.sr]).tobytes()).digest()
+        num_words = int(seconds * self.words_per_second)
+        word_ids = (np.arange(num_words) * 7 + digest[0]) % len(VOCABULARY)
+        starts = np.arange(num_words) / self.words_per_second
+        words = [{"word": f" {VOCABULARY[word_id]}", "start": float(start), "end": float(start + 0.3)}
+                 for word_id, start in zip(word_ids, starts)]
+        segment = {"start": 0.0, "end": seconds, "text": "".join(word["word"] for word in words),
+                   "no_speech_prob": 0.01}
+        if word_timestamps:
+            segment["words"] = words
+        return {"text": segment["text"], "language": language, "segments": [segment]}
@@ -0,0 +1,155 @@
+import os
+import json
+import numpy as np
+from ..tv_debs_utils import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Seconds of audio synthesized at once
+BLOCK_SECONDS = 60
+
+# Amplitude of the background noise, in int16 units
+NOISE_AMPLITUDE = 40
+
+
+def generate_turns(duration, num_speakers=3, seed=0, overlap_probability=0.15, break_probability=0.02,
+                   turn_seconds=(1.5, 20.0), pause_seconds=(0.2, 2.0), break_seconds=(10.0, 60.0)):
+    """
+    Draw the speaking turns of a debate: speakers alternate, sometimes interrupting the previous
+    speaker (overlapped speech) and sometimes pausing for a long break (e.g. an ad break).
+
+    Args:
+        duration (float): Length of the debate in seconds.
+        num_speakers (int): Number of speakers.
+        seed (int): Seed of the random generator; the same arguments always give the same turns.
+        overlap_probability (float): Probability that a turn starts before the previous one ends.
+        break_probability (float): Probability of a long break between two turns.
+        turn_seconds (tuple): Range of the turn lengths.
+        pause_seconds (tuple): Range of the pauses between turns.
+        break_seconds (tuple): Range of the long breaks.
+
+    Returns:
+        list: Sorted [start, end, speaker index] turns, in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    turns = []
+    start, speaker = rng.uniform(*pause_seconds), 0
+    while start < duration:
+        length = rng.uniform(*turn_seconds)
+        end = min(duration, start + length)
+        turns.append([float(start), float(end), int(speaker)])
+        draw = rng.random()
+        if draw < overlap_probability:
+            start = end - rng.uniform(0.3, min(2.0, length / 2))
+        elif draw < overlap_probability + break_probability:
+            start = end + rng.uniform(*break_seconds)
+        else:
+            start = end + rng.uniform(*pause_seconds)
+        speaker = (speaker + rng.integers(1, num_speakers)) % num_speakers
+    return turns
+
+
+def active_regions(turns, min_active):
+    """
+    Get the regions where at least `min_active` turns are active.
+
+    Args:
+        turns (list): [start, end, speaker] turns in seconds.
+        min_active (int): 1 for speech, 2 for overlapped speech.
+
+    Returns:
+        list: Sorted [start, end] regions in seconds.
+    """
+    if not turns:
+        return []
+    bounds = np.asarray(turns, dtype=np.float64)[:, :2]
+    times = np.concatenate((bounds[:, 0], bounds[:, 1]))
+    # Ends sort before starts at the same time, so that touching turns don't overlap
+    changes = np.concatenate((np.ones(len(bounds)), -np.ones(len(bounds))))
+    order = np.lexsort((changes, times))
+    times, active = times[order], np.cumsum(changes[order])
+    is_active = active >= min_active
+    entering = np.flatnonzero(is_active & ~np.concatenate(([False], is_active[:-1])))
+    leaving = np.flatnonzero(~is_active & np.concatenate(([False], is_active[:-1])))
+    return np.column_stack((times[entering], times[leaving])).tolist()
+
+
+def get_voices(num_speakers, seed):
+    """
+    Get the voice of every speaker: fundamental frequency, harmonic amplitudes and syllable rate.
+    """
+    rng = np.random.default_rng([seed, 1])
+    return [{"f0": rng.uniform(95, 230), "harmonics": rng.uniform(0.2, 1.0, size=4), "syllable_rate": rng.uniform(3, 6),
+             "phase": rng.uniform(0, 2 * np.pi)} for _ in range(num_speakers)]
+
+
+def synthesize_block(block_start, num_samples, turns, voices, seed):
+    """
+    Synthesize the samples [block_start, block_start + num_samples) of a debate.
+
+    Every speaker is a harmonic tone modulated at a syllable rate; the tones of overlapping turns add up.
+
+    Returns:
+        np.ndarray: int16 samples.
+    """
+    sr = debate_utils.sr
+    block_idx = block_start // (BLOCK_SECONDS * sr)
+    block = np.random.default_rng([seed, 2, block_idx]).standard_normal(num_samples).astype(np.float32) * NOISE_AMPLITUDE
+    block_end = block_start + num_samples
+    for start, end, speaker in turns:
+        turn_start, turn_end = max(block_start, int(start * sr)), min(block_end, int(end * sr))
+        if turn_end <= turn_start:
+            continue
+        voice = voices[speaker]
+        t = np.arange(turn_start, turn_end, dtype=np.float64) / sr
+        envelope = (0.5 + 0.5 * np.sin(2 * np.pi * voice["syllable_rate"] * t + voice["phase"])) ** 2
+        tone = sum(amplitude * np.sin(2 * np.pi * (harmonic + 1) * voice["f0"] * t)
+                   for harmonic, amplitude in enumerate(voice["harmonics"]))
+        block[turn_start - block_start:turn_end - block_start] += (4000 * envelope * tone).astype(np.float32)
+    return np.clip(block, -32768, 32767).astype(np.int16)
+
+
+def write_debate(save_path, duration, num_speakers=3, seed=0, **turn_options):
+    """
+    Write a synthetic debate as a canonical 16 kHz mono int16 WAV file, a block at a time, and its
+    ground truth next to it (<save_path without .wav>.truth.json).
+
+    Args:
+        save_path (str): Path of the WAV file.
+        duration (float): Length of the debate in seconds.
+        num_speakers (int): Number of speakers.
+        seed (int): Seed of the turns, voices and noise.
+        **turn_options: Passed to `generate_turns`.
+
+    Returns:
+        dict: Ground truth: duration, turns ([start, end, speaker] in seconds), speech and overlap regions.
+    """
+    import soundfile as sf
+
+    sr = debate_utils.sr
+    turns = generate_turns(duration, num_speakers, seed, **turn_options)
+    voices = get_voices(num_speakers, seed)
+    num_samples = int(duration * sr)
+    tmp_path = f"{save_path}.tmp"
+    with sf.SoundFile(tmp_path, 'w', samplerate=sr, channels=1, subtype='PCM_16', format='WAV') as fd:
+        for block_start in range(0, num_samples, BLOCK_SECONDS * sr):
+            fd.write(synthesize_block(block_start, min(BLOCK_SECONDS * sr, num_samples - block_start), turns, voices,
+                                      seed))
+    os.replace(tmp_path, save_path)
+
+    truth = {"duration": duration, "num_speakers": num_speakers, "seed": seed, "turns": turns,
+             "speech": active_regions(turns, 1), "overlap": active_regions(turns, 2)}
+    with open(get_truth_path(save_path), 'w') as fd:
+        json.dump(truth, fd)
+    logger.debug(f"Synthetic debate of {duration}s with {len(turns)} turns written to {save_path}")
+    return truth
+
+
+def get_truth_path(wav_path):
+    return f"{wav_path[:-len('.wav')]}.truth.json"
+
+
+def load_truth(wav_path):
+    with open(get_truth_path(wav_path)) as fd:
+        return json.load(fd)
@@ -4,13 +4,73 @@ class ConfigConstants:
     HUGGINGFACE_TOKEN = os.environ.get(
         'HUGGINGFACE_TOKEN', os.environ.get('HUGGINGFACE_TOKEN', None))
 
-    PERSPECTIVE_API_KEYS = [os.environ.get('PERSPECTIVE_API_KEY', None)]
+    # One or more comma-separated keys; all keys pull utterances from the same work queue
+    PERSPECTIVE_API_KEYS = os.environ.get(
+        'PERSPECTIVE_API_KEYS', os.environ.get('PERSPECTIVE_API_KEY', '')).split(',')
+    # Point this to the mock server (src/perspective_related/mock_perspective_server.py) to test offline
+    PERSPECTIVE_API_URL = os.environ.get(
+        'PERSPECTIVE_API_URL', 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze')
+    PERSPECTIVE_QPS_PER_KEY = float(os.environ.get('PERSPECTIVE_QPS_PER_KEY', 1.0))
+    PERSPECTIVE_MAX_IN_FLIGHT_PER_KEY = int(os.environ.get('PERSPECTIVE_MAX_IN_FLIGHT_PER_KEY', 8))
+    PERSPECTIVE_MAX_RETRIES = int(os.environ.get('PERSPECTIVE_MAX_RETRIES', 5))
+    PERSPECTIVE_REQUEST_TIMEOUT = float(os.environ.get('PERSPECTIVE_REQUEST_TIMEOUT', 60.0))
+
+    # Inference backend: device ('auto' picks cuda when available), weight precision ('fp32', or 'int8'
+    # for dynamically quantized Linear/LSTM layers, CPU only), whisper model size and torch threads
+    # (0 keeps torch's default, or the per-worker count of --workers for the intra-op threads)
+    INFERENCE_DEVICE = os.environ.get('INFERENCE_DEVICE', 'auto')
+    INFERENCE_PRECISION = os.environ.get('INFERENCE_PRECISION', 'fp32')
+    WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'large-v2')
+    TORCH_INTRA_OP_THREADS = int(os.environ.get('TORCH_INTRA_OP_THREADS', 0))
+    TORCH_INTER_OP_THREADS = int(os.environ.get('TORCH_INTER_OP_THREADS', 0))
+
+    # Number of utterances whisper decodes per forward pass
+    WHISPER_BATCH_SIZE = int(os.environ.get('WHISPER_BATCH_SIZE', 16))
+
+    # Consecutive diarization turns of the same speaker are merged before transcription when the gap
+    # between them is at most TURN_MERGE_MAX_GAP seconds and the merged turn is at most
+    # TURN_MERGE_MAX_DURATION seconds long (whisper's 30 second window)
+    TURN_MERGE_MAX_GAP = float(os.environ.get('TURN_MERGE_MAX_GAP', 0.5))
+    TURN_MERGE_MAX_DURATION = float(os.environ.get('TURN_MERGE_MAX_DURATION', 30.0))
+
+    # Directory with local media files named <video id>.<ext>; when set, they are used instead of
+    # downloading the videos from YouTube
+    LOCAL_AUDIO_DIR = os.environ.get('LOCAL_AUDIO_DIR', None)
+
+    # Number of videos downloaded and decoded ahead of model inference
+    PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 2))
+
+    # Windows of the streaming mode (--streaming): length and overlap in seconds of the audio read at once
+    STREAM_WINDOW_SECONDS = float(os.environ.get('STREAM_WINDOW_SECONDS', 600))
+    STREAM_OVERLAP_SECONDS = float(os.environ.get('STREAM_OVERLAP_SECONDS', 30))
+
+    # Whether the downloaded and cut audio tracks are kept in the audio cache, and its size limit
+    AUDIO_CACHE = os.environ.get('AUDIO_CACHE', '1') == '1'
+    AUDIO_CACHE_MAX_BYTES = int(float(os.environ.get('AUDIO_CACHE_MAX_GB', 50)) * 1024 ** 3)
+
+    # Whether the stages also append their outputs to the columnar (Parquet) store
+    COLUMNAR_STORE = os.environ.get('COLUMNAR_STORE', '1') == '1'
+
+    # Whether the stages record timing spans (results/traces/<run id>.jsonl and .prom), and the stages
+    # (comma-separated span names) to profile with PROFILER ('cprofile' or 'py-spy')
+    TRACING = os.environ.get('TRACING', '1') == '1'
+    PROFILE_STAGES = [stage for stage in os.environ.get('PROFILE_STAGES', '').split(',') if stage]
+    PROFILER = os.environ.get('PROFILER', 'cprofile')
+
+    # Time after which a video claimed in the run manifest can be claimed by another worker
+    MANIFEST_LEASE_SECONDS = float(os.environ.get('MANIFEST_LEASE_SECONDS', 6 * 3600))
+
+    # Unix socket of the model server (src/tv_debs_utils/model_server.py)
+    MODEL_SERVER_SOCKET = os.environ.get(
+        'MODEL_SERVER_SOCKET', os.path.join(os.path.dirname(__file__), '../data/scratch_folder/model_server.sock'))
 
     # Directory paths
     ProjectDir = os.path.join(os.path.dirname(__file__), '../')
 
+    VIDEO_DETAILS_PATH = os.path.join(ProjectDir, 'data/video_details.json')
     SAVE_RESULTS_BASE_DIR = os.path.join(ProjectDir, 'data/results/')
     SCRATCH_FOLDER_DIR = os.path.join(ProjectDir, 'data/scratch_folder/')
+    AUDIO_CACHE_DIR = os.path.join(ProjectDir, 'data/audio_cache/')
 
     OSD_FILE_DIR = os.path.join(SAVE_RESULTS_BASE_DIR, "osd_data")
     VAD_FILE_DIR = os.path.join(SAVE_RESULTS_BASE_DIR, "vad_data")
@@ -20,6 +80,26 @@ class ConfigConstants:
         SAVE_RESULTS_BASE_DIR, "transcription_data")
     PERSPECTIVE_FILE_DIR = os.path.join(
         SAVE_RESULTS_BASE_DIR, "perspective_data")
+    PERSPECTIVE_CACHE_PATH = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "perspective_cache.sqlite")
+    RUN_MANIFEST_PATH = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "run_manifest.sqlite")
+    COLUMNAR_STORE_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "columnar_store")
+    ANALYTICS_CACHE_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "analytics_cache")
+    JOURNAL_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "journals")
+    SEGMENTATION_SCORES_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "segmentation_scores")
+    REBINARIZED_FILE_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "rebinarized")
+    TIMELINE_MAP_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "timeline_maps")
+    ORIGINAL_TIMELINE_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "original_timeline")
+    TRACE_DIR = os.path.join(
+        SAVE_RESULTS_BASE_DIR, "traces")
 
     PART_0_PATH = os.path.join(SCRATCH_FOLDER_DIR, "part_0")
     PART_1_PATH = os.path.join(SCRATCH_FOLDER_DIR, "part_1")
@@ -30,9 +110,17 @@ class ConfigConstants:
         SCRATCH_FOLDER_DIR, "utterances_tmp")
 
     all_directories = [SAVE_RESULTS_BASE_DIR, SCRATCH_FOLDER_DIR, OSD_FILE_DIR, VAD_FILE_DIR, DIARIZATION_FILE_DIR,
-                       PART_0_PATH, PART_1_PATH, PART_2_PATH, MP3_FILE_DIR, UTTERANCES_FILE_DIR_TMP, TRANSCRIPT_FILE_DIR, PERSPECTIVE_FILE_DIR]
+                       PART_0_PATH, PART_1_PATH, PART_2_PATH, MP3_FILE_DIR, UTTERANCES_FILE_DIR_TMP, TRANSCRIPT_FILE_DIR, PERSPECTIVE_FILE_DIR,
+                       SEGMENTATION_SCORES_DIR, REBINARIZED_FILE_DIR, JOURNAL_DIR, COLUMNAR_STORE_DIR,
+                       ANALYTICS_CACHE_DIR, TIMELINE_MAP_DIR, ORIGINAL_TIMELINE_DIR, TRACE_DIR,
+                       AUDIO_CACHE_DIR]
 
-    # create the directories if they don't exist
-    for _dir in all_directories:
-        if not os.path.exists(_dir):
-            os.makedirs(_dir, exist_ok=True)
+    @classmethod
+    def create_directories(cls):
+        """
+        Create the directories if they don't exist. Called by the entry points before any file is
+        written, rather than when this module is imported.
+        """
+        for _dir in cls.all_directories:
+            if not os.path.exists(_dir):
+                os.makedirs(_dir, exist_ok=True)
@@ -0,0 +1,137 @@
+import os
+import json
+import numpy as np
+from ..config_constants import ConfigConstants
+
+# Hyperparameters for Audio Processing
+HYPER_PARAMETERS = {
+    "onset": 0.5,  # onset activation threshold
+    "offset": 0.5,  # offset activation threshold
+    "min_duration_on": 0.0,  # remove speech regions shorter than this (in seconds)
+    "min_duration_off": 0.0,  # fill non-speech regions shorter than this (in seconds)
+}
+
+# Columns of the frame scores
+SPEECH_COLUMN = 0
+OVERLAP_COLUMN = 1
+
+
+def get_scores_paths(video_id):
+    """
+    Get the paths of the cached frame scores of a video.
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        tuple: Path of the float16 .npy scores and path of the JSON metadata.
+    """
+    return (os.path.join(ConfigConstants.SEGMENTATION_SCORES_DIR, f"{video_id}.npy"),
+            os.path.join(ConfigConstants.SEGMENTATION_SCORES_DIR, f"{video_id}.json"))
+
+
+def save_frame_scores(video_id, scores, sliding_window, num_samples):
+    """
+    Save the speech and overlap frame scores of a video.
+
+    Args:
+        video_id (str): YouTube video ID.
+        scores (np.ndarray): float16 array of shape (num_frames, 2) with speech and overlap scores.
+        sliding_window (dict): start, duration and step (in seconds) of the frames.
+        num_samples (int): Number of samples of the part_0 audio the scores were computed on.
+    """
+    scores_path, meta_path = get_scores_paths(video_id)
+    np.save(scores_path, scores.astype(np.float16))
+    with open(meta_path, 'w') as fd:
+        json.dump({"sliding_window": sliding_window, "num_samples": int(num_samples),
+                   "columns": ["speech", "overlap"]}, fd, indent=1)
+
+
+def load_frame_scores(video_id):
+    """
+    Load the cached frame scores of a video, memory-mapped.
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        tuple: Memory-mapped float16 (num_frames, 2) scores, sliding window dict and number of samples.
+    """
+    scores_path, meta_path = get_scores_paths(video_id)
+    with open(meta_path) as fd:
+        meta = json.load(fd)
+    return np.load(scores_path, mmap_mode='r'), meta["sliding_window"], meta["num_samples"]
+
+
+def binarize_scores(scores, sliding_window, onset, offset=None, min_duration_on=0.0, min_duration_off=0.0):
+    """
+    Binarize frame scores with hysteresis thresholding.
+
+    NumPy port of `pyannote.audio.utils.signal.Binarize` (without padding), so thresholds can be
+    changed without importing or running any model. Assumes onset >= offset.
+
+    Args:
+        scores (np.ndarray): 1-D array of frame scores.
+        sliding_window (dict): start, duration and step (in seconds) of the frames.
+        onset (float): Activation threshold.
+        offset (float, optional): Deactivation threshold. Defaults to onset.
+        min_duration_on (float): Remove active regions shorter than this (in seconds).
+        min_duration_off (float): Fill inactive regions shorter than this (in seconds).
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) with sorted [start, end] active regions.
+    """
+    offset = onset if offset is None else offset
+    scores = np.asarray(scores, dtype=np.float32)
+    num_frames = len(scores)
+    if num_frames == 0:
+        return np.zeros((0, 2))
+    timestamps = sliding_window["start"] + sliding_window["duration"] / 2 + np.arange(num_frames) * sliding_window["step"]
+
+    # A frame switches the state on above onset, off below offset and keeps the previous state otherwise
+    state = np.full(num_frames, -1, dtype=np.int8)
+    state[scores < offset] = 0
+    state[scores > onset] = 1
+    state[0] = scores[0] > onset
+    last_decided = np.maximum.accumulate(np.where(state >= 0, np.arange(num_frames), 0))
+    active = state[last_decided] == 1
+
+    changes = np.flatnonzero(np.diff(active.astype(np.int8))) + 1
+    start_frames = changes[active[changes]]
+    end_frames = changes[~active[changes]]
+    if active[0]:
+        start_frames = np.concatenate(([0], start_frames))
+    if active[-1]:
+        end_frames = np.concatenate((end_frames, [num_frames - 1]))
+    regions = np.column_stack((timestamps[start_frames], timestamps[end_frames]))
+    regions = regions[regions[:, 1] > regions[:, 0]]
+
+    # Fill gaps shorter than min_duration_off
+    if min_duration_off > 0.0 and len(regions) > 1:
+        breaks = np.flatnonzero(regions[1:, 0] - regions[:-1, 1] >= min_duration_off) + 1
+        group_starts = np.concatenate(([0], breaks))
+        group_ends = np.concatenate((breaks, [len(regions)])) - 1
+        regions = np.column_stack((regions[group_starts, 0], regions[group_ends, 1]))
+
+    # Remove regions shorter than min_duration_on
+    if min_duration_on > 0.0:
+        regions = regions[regions[:, 1] - regions[:, 0] >= min_duration_on]
+    return regions
+
+
+def binarize_frame_scores(scores, sliding_window, hyper_parameters):
+    """
+    Turn speech and overlap frame scores into timestamps, as the VAD and OSD pipelines do.
+
+    Args:
+        scores (np.ndarray): (num_frames, 2) speech and overlap scores.
+        sliding_window (dict): start, duration and step (in seconds) of the frames.
+        hyper_parameters (dict): onset, offset, min_duration_on and min_duration_off.
+
+    Returns:
+        tuple: Sorted [start, end] speech timestamps and overlap timestamps, both on the timeline of
+            the audio the scores were computed on (part_0).
+    """
+    speech = binarize_scores(scores[:, SPEECH_COLUMN], sliding_window, **hyper_parameters)
+    overlap = binarize_scores(scores[:, OVERLAP_COLUMN], sliding_window, **hyper_parameters)
+    return speech.tolist(), overlap.tolist()
@@ -1,11 +1,14 @@
 import os
-import sys
 import json
-import torch
-from pyannote.audio import Model, Pipeline
-from pyannote.audio.pipelines import VoiceActivityDetection, OverlappedSpeechDetection
+import argparse
+import functools
 from ..config_constants import ConfigConstants
 from ..tv_debs_utils import debate_utils
+from ..tv_debs_utils.staged_pipeline import Stage, run_stages
+from ..tv_debs_utils import worker_pool, run_manifest, columnar_store, audio_stream, audio_cache, instrumentation
+from ..tv_debs_utils import inference_backend
+from ..tv_debs_utils.timeline_map import TimelineMap, build_timeline_map, ORIGINAL, PART_1, PART_2
+from . import speech_overlap_detection, frame_scores
 
 # Utility functions for debate processing
 CURR_FILE_DIR = os.path.dirname(__file__)
@@ -13,6 +16,13 @@ CURR_FILE_DIR = os.path.dirname(__file__)
 # Get a logger to use
 logger = debate_utils.get_logger()
 
+# Name of the stage in the run manifest
+STAGE = "diarization"
+
+# Pretrained models
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
+SEGMENTATION_MODEL = "pyannote/segmentation"
+
 def load_video_ids(args_received):
     """
     Load video IDs from command line argument or JSON file.
@@ -26,121 +36,361 @@ def load_video_ids(args_received):
     if args_received.endswith(".json"):
         assert os.path.exists(args_received)
         with open(args_received) as fd:
-            return json.load(fd)
+            vid_ids = json.load(fd)
+        if vid_ids and isinstance(vid_ids[0], dict):
+            # data/video_details.json: longest videos first, so that no worker is left with a
+            # long video once the others are done
+            vid_ids = sorted(vid_ids, key=lambda vid: -vid.get("total_duration", 0))
+            vid_ids = [vid["yt_vid_id"] for vid in vid_ids]
+        return vid_ids
     else:
         return [args_received]
 
-# Load video IDs
-vid_id_list = load_video_ids(sys.argv[1])
-
-# Hyperparameters for Audio Processing
-HYPER_PARAMETERS = {
-    "onset": 0.5,  # onset activation threshold
-    "offset": 0.5,  # offset activation threshold
-    "min_duration_on": 0.0,  # remove speech regions shorter than this (in seconds)
-    "min_duration_off": 0.0,  # fill non-speech regions shorter than this (in seconds)
-}
-
-def load_models():
+def load_models(device=None, precision=None):
     """
-    Load and initialize all required models for audio processing.
+    Load and initialize all required models for audio processing, on the configured inference backend.
+
+    Args:
+        device (str, optional): 'auto', 'cpu' or 'cuda' (default: INFERENCE_DEVICE)
+        precision (str, optional): 'fp32' or 'int8' (default: INFERENCE_PRECISION)
 
     Returns:
-        tuple: Containing initialized models (speaker_diarization_model, segmentation_model, VAD, OSD)
+        tuple: Containing initialized models (speaker_diarization_model, segmentation_model, speech_overlap_inference)
     """
+    from pyannote.audio import Model, Pipeline
+
+    inference_backend.configure_threads()
+    device = inference_backend.get_device(device)
+    precision = precision or ConfigConstants.INFERENCE_PRECISION
+    inference_backend.check_precision(precision, device)
+
     # Load speaker diarization pipeline model
     pipeline = Pipeline.from_pretrained(
-        "pyannote/speaker-diarization-3.1", use_auth_token=ConfigConstants.HUGGINGFACE_TOKEN)
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        DIARIZATION_MODEL, use_auth_token=ConfigConstants.HUGGINGFACE_TOKEN)
     pipeline.to(device)
-    speaker_diarization_model = pipeline
+    speaker_diarization_model = inference_backend.prepare_diarization_pipeline(pipeline, precision)
     logger.info("Speaker diarization model loaded.")
 
     # Load segmentation model for VAD and OSD
     segmentation_model = Model.from_pretrained(
-        "pyannote/segmentation", use_auth_token=ConfigConstants.HUGGINGFACE_TOKEN).to(device)
+        SEGMENTATION_MODEL, use_auth_token=ConfigConstants.HUGGINGFACE_TOKEN).to(device)
+    segmentation_model = inference_backend.prepare_pyannote_model(segmentation_model, precision)
     logger.info("Segmentation model loaded.")
 
-    # Load Voice Activity Detection (VAD) model
-    VAD = VoiceActivityDetection(segmentation=segmentation_model)
-    VAD.instantiate(HYPER_PARAMETERS)
-    logger.info("VAD model loaded.")
+    # A single sliding-window pass of the segmentation model gives both the Voice Activity
+    # Detection (VAD) and the Overlapped Speech Detection (OSD) scores
+    speech_overlap_inference = speech_overlap_detection.load_speech_overlap_inference(segmentation_model)
+    logger.info("VAD/OSD inference loaded.")
 
-    # Load Overlapped Speech Detection (OSD) model
-    OSD = OverlappedSpeechDetection(segmentation=segmentation_model)
-    OSD.instantiate(HYPER_PARAMETERS)
-    logger.info("OSD model loaded.")
+    return speaker_diarization_model, segmentation_model, speech_overlap_inference
 
-    return speaker_diarization_model, segmentation_model, VAD, OSD
+def prepare_video(curr_yt_id, streaming=False):
+    """
+    Download and decode a video.
 
-# Load all required models
-speaker_diarization_model, segmentation_model, VAD, OSD = load_models()
+    Args:
+        curr_yt_id (str): YouTube video ID
+        streaming (bool): Only download the video; it is read from disk while it's processed
 
-def process_video(curr_yt_id, VAD, OSD, speaker_diarization_model):
+    Returns:
+        tuple: (curr_yt_id, int16 audio buffer or None when streaming), or None if the download failed
     """
-    Process a single video through the entire pipeline.
+    # Step 1: Download the video and save as WAV
+    if not debate_utils.download_ytvid_as_wav(curr_yt_id):
+        logger.debug(f"Video download failed for {curr_yt_id=}")
+        return None
+    if streaming:
+        return curr_yt_id, None
+
+    # Decode the audio once; every later step works on this in-memory buffer
+    return curr_yt_id, debate_utils.load_audio(curr_yt_id)
+
+def save_stage_data(stage, save_dir, curr_yt_id, data):
+    """
+    Save the data of a stage as JSON, and append it to the columnar store.
+    """
+    with open(os.path.join(save_dir, f"{curr_yt_id}.json"), 'w') as fd:
+        json.dump(data, fd, indent=1)
+    columnar_store.store_video(stage, curr_yt_id, data)
+
+def diarize(curr_yt_id, audio_input, speaker_diarization_model, audio_seconds=None):
+    """
+    Run speaker diarization on the part_2 track of a video and save its data.
 
     Args:
         curr_yt_id (str): YouTube video ID
-        VAD: Voice Activity Detection model
-        OSD: Overlapped Speech Detection model
+        audio_input: Input of the diarization pipeline: an in-memory waveform or {"audio": path}
         speaker_diarization_model: Speaker diarization model
+        audio_seconds (float, optional): Length of the part_2 track, recorded with the diarization span
 
     Returns:
-        bool: True if processing was successful, False otherwise
+        list: Diarization data, as saved
     """
-    # Check if diarization data already exists
-    diarization_file_path = os.path.join(
-        ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json")
-    if os.path.exists(diarization_file_path):
-        logger.debug(f"Diarization data already exists for: {curr_yt_id}")
-        return True
+    with instrumentation.span("diarization", curr_yt_id, audio_seconds) as span:
+        dz = speaker_diarization_model(audio_input)
+        logger.debug("Diarization running done")
+        dia_ans = dict(dz.__dict__['_tracks']).items()
+        dia_ans = [(x[0].__dict__, x[1]) for x in dia_ans]
+        span.set(num_turns=len(dia_ans))
+    save_stage_data("diarization", ConfigConstants.DIARIZATION_FILE_DIR, curr_yt_id, dia_ans)
+    return dia_ans
 
-    # Step 1: Download the video and save as WAV
-    if not debate_utils.download_ytvid_as_wav(curr_yt_id):
-        logger.debug(f"Video download failed for {curr_yt_id=}")
-        return False
+def detect_speech_overlap(curr_yt_id, audio, speech_overlap_inference, cache=None):
+    """
+    Run VAD and OSD on the decoded audio of a video, save their data and cut its part_2 track.
 
-    # Step 2: Apply VAD on the video
-    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
-    output = VAD(part_0_path)
-    logger.debug("VAD model applied")
-    speech_segments = output.get_timeline().support()
-    ans = debate_utils.extract_speech_segments(speech_segments)
+    Args:
+        curr_yt_id (str): YouTube video ID
+        audio (np.ndarray): int16 audio buffer of the video
+        speech_overlap_inference: Segmentation inference producing speech and overlap scores
+        cache (AudioCache, optional): Cache to keep the part_1 and part_2 tracks in
 
-    save_path = os.path.join(ConfigConstants.VAD_FILE_DIR, f"{curr_yt_id}.json")
-    with open(save_path, 'w') as fd:
-        json.dump(ans, fd, indent=1)
+    Returns:
+        np.ndarray: int16 audio of the part_2 (speech without overlap) track
+    """
+    # Step 2: Apply VAD and OSD on the video, with one segmentation pass. The raw frame scores are
+    # cached so that the thresholds can later be changed without running the model again
+    with instrumentation.span("vad_osd", curr_yt_id, instrumentation.get_audio_seconds(audio)):
+        scores, sliding_window = speech_overlap_detection.get_frame_scores(speech_overlap_inference, audio)
+    frame_scores.save_frame_scores(curr_yt_id, scores, sliding_window, len(audio))
+    ans, overlap_timestamps = frame_scores.binarize_frame_scores(
+        scores, sliding_window, frame_scores.HYPER_PARAMETERS)
+    logger.debug("VAD/OSD model applied")
+    save_stage_data("vad", ConfigConstants.VAD_FILE_DIR, curr_yt_id, ans)
+
+    # Remove non-speech areas
+    speech_audio, speech_segment_map = debate_utils.remove_non_speech(audio, ans)
 
-    # Remove non-speech areas and save the WAV
-    debate_utils.remove_non_speech(curr_yt_id, ans)
+    # Step 3: Map the overlap onto the speech-only (part_1) timeline the OSD data refers to
+    ans_2 = debate_utils.project_timestamps(overlap_timestamps, speech_segment_map)
+    save_stage_data("osd", ConfigConstants.OSD_FILE_DIR, curr_yt_id, ans_2)
+    non_overlap_audio, non_overlap_segment_map = debate_utils.write_non_overlap(speech_audio, ans_2)
+    # Keep both cuts, to map the diarization and transcription times back onto the original video
+    timeline_map = TimelineMap(speech_segment_map, non_overlap_segment_map)
+    timeline_map.save(curr_yt_id)
+    if cache is not None:
+        with instrumentation.span("cache_tracks", curr_yt_id):
+            for track, track_audio in [(PART_1, speech_audio), (PART_2, non_overlap_audio)]:
+                cache.put(curr_yt_id, track, audio_cache.get_track_params(track, timeline_map), track_audio)
+    return non_overlap_audio
 
-    # Step 3: Apply OSD on the video
-    ans_2 = debate_utils.remove_overlap(OSD, curr_yt_id)
-    save_path = os.path.join(ConfigConstants.OSD_FILE_DIR, f"{curr_yt_id}.json")
-    with open(save_path, 'w') as fd:
-        json.dump(ans_2, fd, indent=1)
-    debate_utils.write_non_overlap(curr_yt_id, ans_2)
+def process_audio(curr_yt_id, audio, speech_overlap_inference, speaker_diarization_model, cache=None):
+    """
+    Run VAD, OSD and diarization on the decoded audio of a video and save their data.
+
+    Args:
+        curr_yt_id (str): YouTube video ID
+        audio (np.ndarray): int16 audio buffer of the video
+        speech_overlap_inference: Segmentation inference producing speech and overlap scores
+        speaker_diarization_model: Speaker diarization model
+        cache (AudioCache, optional): Cache to keep the part_1 and part_2 tracks in
+    """
+    non_overlap_audio = detect_speech_overlap(curr_yt_id, audio, speech_overlap_inference, cache)
 
     # Step 4: Get diarization data
-    save_path = os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json")
+    diarize(curr_yt_id, debate_utils.as_pyannote_input(non_overlap_audio), speaker_diarization_model,
+            instrumentation.get_audio_seconds(non_overlap_audio))
+
+    # Step 5: Clean up intermediate files
+    os.remove(os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav"))
+    logger.debug("Removed intermediate data")
+
+def process_audio_streaming(curr_yt_id, speech_overlap_inference, speaker_diarization_model, cache=None):
+    """
+    Same as `process_audio`, reading the downloaded audio from disk a window at a time instead of
+    decoding it into memory, so that the memory used doesn't grow with the length of the video.
+
+    The part_2 track is streamed to the scratch folder and diarized from there: diarization has to
+    see all the turns of the video at once, and part_2 is the shortest of the tracks.
+
+    Args:
+        curr_yt_id (str): YouTube video ID
+        speech_overlap_inference: Segmentation inference producing speech and overlap scores
+        speaker_diarization_model: Speaker diarization model
+        cache (AudioCache, optional): Cache to keep the part_1 and part_2 tracks in
+    """
+    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
     part_2_path = os.path.join(ConfigConstants.PART_2_PATH, f"{curr_yt_id}.wav")
-    dz = speaker_diarization_model(part_2_path)
-    logger.debug("Diarization running done")
-    dia_ans = dict(dz.__dict__['_tracks']).items()
-    dia_ans = [(x[0].__dict__, x[1]) for x in dia_ans]
-    with open(save_path, 'w') as fd:
-        json.dump(dia_ans, fd, indent=1)
+    with audio_stream.AudioFileReader(part_0_path) as reader:
+        # Step 2: Apply VAD and OSD on overlapping windows of the video, stitched into one set of frame scores
+        with instrumentation.span("vad_osd", curr_yt_id, instrumentation.get_audio_seconds(reader), streaming=True):
+            scores, sliding_window = speech_overlap_detection.get_frame_scores_windowed(
+                speech_overlap_inference, reader, ConfigConstants.STREAM_WINDOW_SECONDS,
+                ConfigConstants.STREAM_OVERLAP_SECONDS)
+        frame_scores.save_frame_scores(curr_yt_id, scores, sliding_window, len(reader))
+        ans, overlap_timestamps = frame_scores.binarize_frame_scores(
+            scores, sliding_window, frame_scores.HYPER_PARAMETERS)
+        logger.debug("VAD/OSD model applied")
+        save_stage_data("vad", ConfigConstants.VAD_FILE_DIR, curr_yt_id, ans)
+
+        # Step 3: Map the overlap onto the part_1 timeline, and cut part_2 straight out of the downloaded audio
+        speech_segment_map = debate_utils.build_segment_map(
+            debate_utils.timestamps_to_sample_bounds(ans, debate_utils.sr, len(reader)))
+        ans_2 = debate_utils.project_timestamps(overlap_timestamps, speech_segment_map)
+        save_stage_data("osd", ConfigConstants.OSD_FILE_DIR, curr_yt_id, ans_2)
+        timeline_map = build_timeline_map(ans, ans_2, len(reader))
+        timeline_map.save(curr_yt_id)
+        with instrumentation.span("write_cut", curr_yt_id, instrumentation.get_audio_seconds(reader)):
+            audio_stream.write_cut(reader, part_2_path, timeline_map.maps[(ORIGINAL, PART_2)].segment_map)
+        if cache is not None:
+            with instrumentation.span("cache_tracks", curr_yt_id):
+                cache.put_segments(curr_yt_id, PART_1, audio_cache.get_track_params(PART_1, timeline_map), reader,
+                                   timeline_map.maps[(ORIGINAL, PART_1)].segment_map)
+                cache.put_file(curr_yt_id, PART_2, audio_cache.get_track_params(PART_2, timeline_map), part_2_path)
+
+    # Step 4: Get diarization data
+    part_2_map = timeline_map.maps[(ORIGINAL, PART_2)].segment_map
+    diarize(curr_yt_id, {"audio": part_2_path}, speaker_diarization_model,
+            float((part_2_map[:, 1] - part_2_map[:, 0]).sum()) / debate_utils.sr)
 
     # Step 5: Clean up intermediate files
-    for path in [part_0_path, os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav"), part_2_path]:
-        os.remove(path)
+    os.remove(part_2_path)
+    os.remove(part_0_path)
     logger.debug("Removed intermediate data")
 
-    return True
+def process_video(curr_yt_id, speech_overlap_inference, speaker_diarization_model):
+    """
+    Process a single video through the entire pipeline.
+
+    Args:
+        curr_yt_id (str): YouTube video ID
+        speech_overlap_inference: Segmentation inference producing speech and overlap scores
+        speaker_diarization_model: Speaker diarization model
+
+    Returns:
+        bool: True if processing was successful (or already done), False otherwise
+    """
+    models = (speaker_diarization_model, None, speech_overlap_inference)
+    return not process_videos([curr_yt_id], models, prefetch=1)
+
+def get_params_hash():
+    """
+    Returns:
+        str: Hash of the models and thresholds the diarization data is computed with
+    """
+    params = {"diarization_model": DIARIZATION_MODEL, "segmentation_model": SEGMENTATION_MODEL,
+              "hyper_parameters": frame_scores.HYPER_PARAMETERS}
+    if ConfigConstants.INFERENCE_PRECISION != inference_backend.FP32:
+        # Kept out of the fp32 hash, so that the videos done before precisions existed stay done
+        params["precision"] = ConfigConstants.INFERENCE_PRECISION
+    return run_manifest.make_params_hash(params)
+
+def process_videos(vid_ids, models, prefetch=ConfigConstants.PREFETCH_WORKERS, on_progress=None, streaming=False):
+    """
+    Process the videos with loaded models, prefetching the next ones while the models run.
+
+    Args:
+        vid_ids (iterable): YouTube video IDs
+        models (tuple): Output of `load_models`
+        prefetch (int): Number of videos downloaded and decoded while the models run
+        on_progress (callable, optional): Called with an event dict (video_id, status and, for
+            errors, error) whenever a video is done, skipped or failed
+        streaming (bool): Process the videos with `process_audio_streaming`, in bounded memory
+
+    Returns:
+        list: [video ID, error] of the videos that failed
+    """
+    ConfigConstants.create_directories()
+    speaker_diarization_model, segmentation_model, speech_overlap_inference = models
+    on_progress = on_progress or (lambda event: None)
+
+    # The manifest tells which videos are done, and keeps concurrent runs off the same video
+    manifest = run_manifest.RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    manifest.sync_directory(STAGE)
+    params_hash = get_params_hash()
+    # The cut tracks are cached for the transcription stage
+    cache = audio_cache.open_cache()
+
+    error_ids = []
+
+    def prepare(curr_yt_id):
+        if not manifest.try_start(STAGE, curr_yt_id, params_hash):
+            logger.debug(f"Diarization data already exists (or is being computed) for: {curr_yt_id}")
+            on_progress({"video_id": curr_yt_id, "status": "skipped"})
+            return None
+        prepared = prepare_video(curr_yt_id, streaming)
+        if prepared is None:
+            raise RuntimeError(f"Video download failed for {curr_yt_id}")
+        return prepared
+
+    def consume(prepared):
+        curr_yt_id, audio = prepared
+        logger.debug(f"Starting to process: {curr_yt_id}")
+        # The video span holds the spans of the model stages (the download was traced ahead of it)
+        with inference_backend.inference_mode(), instrumentation.span("osd_vad_video", curr_yt_id, streaming=streaming):
+            if streaming:
+                process_audio_streaming(curr_yt_id, speech_overlap_inference, speaker_diarization_model, cache)
+            else:
+                process_audio(curr_yt_id, audio, speech_overlap_inference, speaker_diarization_model, cache)
+        manifest.mark_done(STAGE, curr_yt_id, os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json"))
+        on_progress({"video_id": curr_yt_id, "status": "done"})
+
+    def on_error(stage_name, item, e):
+        curr_yt_id = item[0] if isinstance(item, tuple) else item
+        error_ids.append([curr_yt_id, f"{e}"])
+        manifest.mark_failed(STAGE, curr_yt_id, e)
+        on_progress({"video_id": curr_yt_id, "status": "error", "error": f"{e}"})
+        for scratch_dir in [ConfigConstants.PART_0_PATH, ConfigConstants.PART_2_PATH]:
+            scratch_path = os.path.join(scratch_dir, f"{curr_yt_id}.wav")
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+    # Downloads and decodes run on a thread pool, ahead of the models; decoded videos wait in a
+    # bounded queue, which caps the scratch disk and RAM used by prefetched videos
+    stages = [Stage("download", prepare, max(1, prefetch), max(1, prefetch))]
+    try:
+        run_stages(vid_ids, stages, consume, on_error=on_error)
+    finally:
+        # Gives back the videos still claimed if the run is interrupted
+        manifest.close()
+        if cache is not None:
+            cache.close()
+    return error_ids
+
+def run_videos(vid_ids, prefetch=ConfigConstants.PREFETCH_WORKERS, streaming=False):
+    """
+    Load the models and process the videos.
+
+    Args:
+        vid_ids (iterable): YouTube video IDs
+        prefetch (int): Number of videos downloaded and decoded while the models run
+        streaming (bool): Process the videos in bounded memory
+
+    Returns:
+        list: [video ID, error] of the videos that failed
+    """
+    return process_videos(vid_ids, load_models(), prefetch, streaming=streaming)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run VAD, OSD and speaker diarization on the videos.")
+    parser.add_argument("video_ids", help="YouTube ID, path to a JSON list of IDs or data/video_details.json")
+    parser.add_argument("--prefetch", type=int, default=ConfigConstants.PREFETCH_WORKERS,
+                        help="Number of videos downloaded and decoded while the models run")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, each holding its own models")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch threads of every worker (default: cores / workers)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read the audio from disk in overlapping windows, so that memory stays flat with the "
+                             "length of the videos")
+    args = parser.parse_args()
+
+    # Load video IDs
+    vid_id_list = load_video_ids(args.video_ids)
+
+    if args.workers > 1:
+        error_ids = worker_pool.run_workers(vid_id_list, args.workers,
+                                            functools.partial(run_videos, prefetch=args.prefetch,
+                                                              streaming=args.streaming),
+                                            args.threads_per_worker)
+    else:
+        if args.threads_per_worker is not None:
+            inference_backend.configure_threads(args.threads_per_worker, 1, pin=True)
+        error_ids = run_videos(vid_id_list, args.prefetch, args.streaming)
+
+    logger.info(f"Errors in {len(error_ids)} videos: {error_ids}")
+    logger.debug("ENTIRE PROCESS COMPLETED. Done")
 
-for curr_vid_idx, curr_yt_id in enumerate(vid_id_list):
-    logger.debug(f"Starting to process: {curr_vid_idx}/{len(vid_id_list)}: {curr_yt_id}")
-    process_video(curr_yt_id, VAD, OSD, speaker_diarization_model)
 
-logger.debug("ENTIRE PROCESS COMPLETED. Done")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import json
+import argparse
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils
+from . import frame_scores
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+
+def load_video_ids(args_received):
+    """
+    Load video IDs from command line argument or JSON file.
+
+    Args:
+        args_received (str): Command line argument (video ID, path to JSON file, or "all" for every
+            video with cached frame scores)
+
+    Returns:
+        list: List of video IDs
+    """
+    if args_received == "all":
+        return sorted(file_name[:-len(".npy")] for file_name in os.listdir(ConfigConstants.SEGMENTATION_SCORES_DIR)
+                      if file_name.endswith(".npy"))
+    if args_received.endswith(".json"):
+        assert os.path.exists(args_received)
+        with open(args_received) as fd:
+            return json.load(fd)
+    else:
+        return [args_received]
+
+
+def rebinarize_video(curr_yt_id, hyper_parameters, vad_dir, osd_dir):
+    """
+    Rebuild the VAD and OSD data of a video from its cached frame scores, without running any model.
+
+    Args:
+        curr_yt_id (str): YouTube video ID
+        hyper_parameters (dict): onset, offset, min_duration_on and min_duration_off
+        vad_dir (str): Directory to write the VAD JSON to
+        osd_dir (str): Directory to write the OSD JSON to
+
+    Returns:
+        bool: True if processing was successful, False otherwise
+    """
+    scores_path, _ = frame_scores.get_scores_paths(curr_yt_id)
+    if not os.path.exists(scores_path):
+        logger.debug(f"Frame scores don't exist for: {curr_yt_id} | hence, skipping it.")
+        return False
+
+    scores, sliding_window, num_samples = frame_scores.load_frame_scores(curr_yt_id)
+    ans, overlap_timestamps = frame_scores.binarize_frame_scores(scores, sliding_window, hyper_parameters)
+
+    # The OSD data refers to the speech-only (part_1) timeline
+    speech_segment_map = debate_utils.build_segment_map(
+        debate_utils.timestamps_to_sample_bounds(ans, debate_utils.sr, num_samples))
+    ans_2 = debate_utils.project_timestamps(overlap_timestamps, speech_segment_map)
+
+    with open(os.path.join(vad_dir, f"{curr_yt_id}.json"), 'w') as fd:
+        json.dump(ans, fd, indent=1)
+    with open(os.path.join(osd_dir, f"{curr_yt_id}.json"), 'w') as fd:
+        json.dump(ans_2, fd, indent=1)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild VAD/OSD data for new thresholds from the cached segmentation frame scores.")
+    parser.add_argument("video_ids", help='YouTube ID, path to a JSON list of IDs, or "all"')
+    defaults = frame_scores.HYPER_PARAMETERS
+    parser.add_argument("--onset", type=float, default=defaults["onset"])
+    parser.add_argument("--offset", type=float, default=defaults["offset"])
+    parser.add_argument("--min-duration-on", type=float, default=defaults["min_duration_on"])
+    parser.add_argument("--min-duration-off", type=float, default=defaults["min_duration_off"])
+    parser.add_argument("--output-dir", default=None,
+                        help="Where to write vad_data/ and osd_data/ (default: a folder named after the thresholds)")
+    args = parser.parse_args()
+    ConfigConstants.create_directories()
+
+    hyper_parameters = {
+        "onset": args.onset,
+        "offset": args.offset,
+        "min_duration_on": args.min_duration_on,
+        "min_duration_off": args.min_duration_off,
+    }
+    output_dir = args.output_dir or os.path.join(
+        ConfigConstants.REBINARIZED_FILE_DIR, "_".join(f"{key}={value}" for key, value in hyper_parameters.items()))
+    vad_dir, osd_dir = os.path.join(output_dir, "vad_data"), os.path.join(output_dir, "osd_data")
+    os.makedirs(vad_dir, exist_ok=True)
+    os.makedirs(osd_dir, exist_ok=True)
+
+    vid_id_list = load_video_ids(args.video_ids)
+    for curr_vid_idx, curr_yt_id in enumerate(vid_id_list):
+        logger.debug(f"Rebinarizing: {curr_vid_idx}/{len(vid_id_list)}: {curr_yt_id}")
+        rebinarize_video(curr_yt_id, hyper_parameters, vad_dir, osd_dir)
+
+    logger.info(f"Rebinarized data written to: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import numpy as np
+from ..tv_debs_utils import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+
+def speech_and_overlap_hook(scores):
+    """
+    Reduce per-speaker segmentation scores to speech and overlapped speech scores.
+
+    This is the pre-aggregation hook of pyannote's VoiceActivityDetection (highest speaker
+    probability) and OverlappedSpeechDetection (second highest speaker probability), stacked
+    so that a single sliding-window pass produces both.
+
+    Args:
+        scores (np.ndarray): Segmentation scores of shape (num_chunks, num_frames, num_speakers).
+
+    Returns:
+        np.ndarray: Scores of shape (num_chunks, num_frames, 2) with speech and overlap columns.
+    """
+    speech = np.max(scores, axis=-1, keepdims=True)
+    overlap = np.partition(scores, -2, axis=-1)[:, :, -2, np.newaxis]
+    return np.concatenate([speech, overlap], axis=-1)
+
+
+def load_speech_overlap_inference(segmentation_model, batch_size=32):
+    """
+    Wrap the segmentation model into a sliding-window inference producing speech and overlap scores.
+
+    Args:
+        segmentation_model: Loaded `pyannote/segmentation` model.
+        batch_size (int): Number of chunks per forward pass.
+
+    Returns:
+        Inference: Inference object returning (num_frames, 2) aggregated scores.
+    """
+    from pyannote.audio import Inference
+
+    return Inference(segmentation_model, pre_aggregation_hook=speech_and_overlap_hook, batch_size=batch_size)
+
+
+def get_frame_scores(speech_overlap_inference, audio):
+    """
+    Run the segmentation model once over the whole audio.
+
+    Args:
+        speech_overlap_inference (Inference): Object returned by `load_speech_overlap_inference`.
+        audio (np.ndarray): 1-D int16 audio samples sampled at `debate_utils.sr`.
+
+    Returns:
+        tuple: float16 array of shape (num_frames, 2) with speech and overlap scores, and the
+            start, duration and step (in seconds) of the frames.
+    """
+    frame_scores = speech_overlap_inference(debate_utils.as_pyannote_input(audio))
+    frames = frame_scores.sliding_window
+    sliding_window = {"start": frames.start, "duration": frames.duration, "step": frames.step}
+    return np.nan_to_num(frame_scores.data).astype(np.float16), sliding_window
+
+
+def get_frame_scores_windowed(speech_overlap_inference, reader, window_seconds, overlap_seconds):
+    """
+    Run the segmentation model over an audio file window by window, holding one window in memory.
+
+    Consecutive windows overlap, and every frame is taken from the window whose center it is
+    closest to, so no frame is scored within `overlap_seconds / 2` of a window edge. Windows start
+    on the grid of the frames and of the model's chunks, so away from the edges the frames are the
+    ones a single pass over the whole audio gives.
+
+    Args:
+        speech_overlap_inference (Inference): Object returned by `load_speech_overlap_inference`.
+        reader (AudioFileReader): Audio to score.
+        window_seconds (float): Length of a window.
+        overlap_seconds (float): Overlap of consecutive windows; should be at least twice the
+            duration of the model's chunks.
+
+    Returns:
+        tuple: Same as `get_frame_scores`, for the whole audio.
+    """
+    sr = debate_utils.sr
+    num_samples = len(reader)
+    window_samples = int(window_seconds * sr)
+    overlap_samples = int(overlap_seconds * sr)
+    hop_samples = window_samples - overlap_samples
+    if hop_samples <= 0:
+        raise ValueError(f"The overlap ({overlap_seconds}s) must be shorter than the windows ({window_seconds}s)")
+
+    pieces, sliding_window = [], None
+    start, next_frame = 0, 0  # next_frame: first frame of the whole audio not taken from a window yet
+    while True:
+        end = min(num_samples, start + window_samples)
+        scores, window_frames = get_frame_scores(speech_overlap_inference, reader[start:end])
+        if sliding_window is None:
+            sliding_window = window_frames
+            frame_step = window_frames["step"] * sr
+            # Align the next windows on the frames and chunks grids, now that the frame step is known
+            chunk_step = getattr(speech_overlap_inference, "step", window_frames["step"]) * sr
+            alignment = int(np.lcm(int(round(frame_step)), int(round(chunk_step))))
+            hop_samples = max(alignment, hop_samples // alignment * alignment)
+
+        first_frame = int(round(start / frame_step))
+        if end >= num_samples:
+            stop_frame = first_frame + len(scores)
+        else:
+            # Frames centered before the middle of the overlap with the next window
+            frames_center = sliding_window["start"] + sliding_window["duration"] / 2
+            boundary = (start + hop_samples + (end - start - hop_samples) / 2) / sr
+            stop_frame = int(np.ceil((boundary - frames_center) / sliding_window["step"]))
+        pieces.append(scores[next_frame - first_frame:stop_frame - first_frame])
+        next_frame = stop_frame
+        logger.debug(f"Frames scored up to {end / sr:.0f}s out of {num_samples / sr:.0f}s")
+        if end >= num_samples:
+            break
+        start += hop_samples
+    return np.concatenate(pieces), sliding_window
@@ -0,0 +1,235 @@
+import os
+import argparse
+import threading
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils
+from ..tv_debs_utils import run_manifest, audio_cache, inference_backend, instrumentation
+from ..tv_debs_utils.stage_graph import Node, StageGraph
+from ..diarization_vad_osd_related import run_pipeline_osd_vad
+from ..transcription_related import run_pipeline_transcription
+from ..perspective_related import run_pipeline_perspective
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Names of the stages in the run manifest
+DIARIZATION_STAGE = run_pipeline_osd_vad.STAGE
+TRANSCRIPTION_STAGE = run_pipeline_transcription.STAGE
+PERSPECTIVE_STAGE = run_pipeline_perspective.STAGE
+STAGES = [DIARIZATION_STAGE, TRANSCRIPTION_STAGE, PERSPECTIVE_STAGE]
+
+# Stage of the manifest every node works for, where its errors are recorded
+NODE_STAGES = {
+    "download": DIARIZATION_STAGE,
+    "vad_osd": DIARIZATION_STAGE,
+    "diarization": DIARIZATION_STAGE,
+    "cut": TRANSCRIPTION_STAGE,
+    "transcription": TRANSCRIPTION_STAGE,
+    "perspective": PERSPECTIVE_STAGE,
+}
+
+
+class CorpusRun:
+    """
+    The whole pipeline as one graph of stages, run over the videos in a single process:
+
+        download -> vad_osd -> diarization -> cut -> transcription -> perspective
+
+    The stage outputs are handed over in memory (the decoded audio, the part_2 track and its
+    diarization, the transcript), and every stage works on another video at the same time, each in
+    its own resource pool: downloads, the pyannote models, the audio cutting, whisper and the
+    Perspective clients. A stage runs for a video only if its output is missing, was computed with
+    other parameters, or was computed from another version of its input (see
+    `RunManifest.try_start`); the stages after a rerun stage are rerun as well.
+
+    Args:
+        stages (list): Stages of the run manifest to compute (the others are only read).
+        mode (str): Transcription mode.
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them.
+        downloads (int): Number of videos downloaded and decoded at once.
+        cut_workers (int): Number of threads cutting the part_2 tracks of already diarized videos.
+        max_videos (int): Number of videos in flight at once, which bounds the audio held in memory.
+    """
+
+    def __init__(self, stages=STAGES, mode=run_pipeline_transcription.PER_UTTERANCE_MODE, merge_turns=True,
+                 downloads=ConfigConstants.PREFETCH_WORKERS, cut_workers=1, max_videos=None):
+        self.stages = stages
+        self.mode = mode
+        self.merge_turns = merge_turns
+        self.max_videos = max_videos or max(1, downloads) + 4
+        self.params_hashes = {DIARIZATION_STAGE: run_pipeline_osd_vad.get_params_hash(),
+                              TRANSCRIPTION_STAGE: run_pipeline_transcription.get_params_hash(mode, merge_turns),
+                              PERSPECTIVE_STAGE: None}
+
+        # Models (and the Perspective clients) are loaded by the first video needing them
+        self.load_lock = threading.Lock()
+        self.models = {}
+        self.manifest = None
+        self.cache = None
+        self.error_ids = []
+
+        self.graph = StageGraph([
+            Node("download", self.download, [], "download"),
+            Node("vad_osd", self.detect_speech_overlap, ["download"], "pyannote"),
+            Node("diarization", self.diarize, ["vad_osd"], "pyannote", self.make_claim(DIARIZATION_STAGE),
+                 self.make_release(DIARIZATION_STAGE)),
+            Node("cut", self.cut, ["diarization"], "cut"),
+            Node("transcription", self.transcribe, ["cut"], "whisper",
+                 self.make_claim(TRANSCRIPTION_STAGE, DIARIZATION_STAGE), self.make_release(TRANSCRIPTION_STAGE)),
+            Node("perspective", self.score, ["transcription"], "perspective",
+                 self.make_claim(PERSPECTIVE_STAGE, TRANSCRIPTION_STAGE), self.make_release(PERSPECTIVE_STAGE)),
+        ], {"download": max(1, downloads), "pyannote": 1, "cut": max(1, cut_workers), "whisper": 1,
+            # Scoring threads only wait for the event loop of the Perspective clients
+            "perspective": self.max_videos})
+
+    def get_models(self, name):
+        with self.load_lock:
+            if name not in self.models:
+                logger.info(f"Loading the {name} models")
+                if name == "pyannote":
+                    self.models[name] = run_pipeline_osd_vad.load_models()
+                elif name == "whisper":
+                    self.models[name] = run_pipeline_transcription.load_whisper_model()
+                else:
+                    self.models[name] = run_pipeline_perspective.PerspectiveScorer(self.manifest)
+        return self.models[name]
+
+    def make_claim(self, stage, input_stage=None):
+        """
+        Claim function of the node writing the output of `stage`, computed from the output of `input_stage`.
+        """
+        def claim(curr_yt_id, upstream_rerun):
+            if stage not in self.stages:
+                return False
+            input_stages = [input_stage] if input_stage else None
+            if upstream_rerun:
+                # Its input is being redone: the output is stale whatever its parameters
+                return self.manifest.try_start(stage, curr_yt_id, self.params_hashes[stage], input_stages=input_stages,
+                                               force=True)
+            if input_stage and not self.manifest.is_done(input_stage, curr_yt_id):
+                # Not done yet (nor claimed by this run: left out of the stages, or computed by another worker)
+                return False
+            return self.manifest.try_start(stage, curr_yt_id, self.params_hashes[stage], input_stages=input_stages)
+        return claim
+
+    def make_release(self, stage):
+        return lambda curr_yt_id: self.manifest.release(stage, curr_yt_id)
+
+    def download(self, curr_yt_id, inputs):
+        prepared = run_pipeline_osd_vad.prepare_video(curr_yt_id)
+        if prepared is None:
+            raise RuntimeError(f"Video download failed for {curr_yt_id}")
+        return prepared[1]
+
+    def detect_speech_overlap(self, curr_yt_id, inputs):
+        _, _, speech_overlap_inference = self.get_models("pyannote")
+        with inference_backend.inference_mode():
+            non_overlap_audio = run_pipeline_osd_vad.detect_speech_overlap(
+                curr_yt_id, inputs["download"], speech_overlap_inference, self.cache)
+        # The decoded audio is all the later stages need from the download
+        os.remove(os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav"))
+        return non_overlap_audio
+
+    def diarize(self, curr_yt_id, inputs):
+        speaker_diarization_model, _, _ = self.get_models("pyannote")
+        non_overlap_audio = inputs["vad_osd"]
+        with inference_backend.inference_mode():
+            dia_data = run_pipeline_osd_vad.diarize(
+                curr_yt_id, debate_utils.as_pyannote_input(non_overlap_audio), speaker_diarization_model,
+                instrumentation.get_audio_seconds(non_overlap_audio))
+        self.manifest.mark_done(DIARIZATION_STAGE, curr_yt_id,
+                                os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json"))
+        return {"audio": non_overlap_audio, "dia_data": dia_data}
+
+    def cut(self, curr_yt_id, inputs):
+        if inputs["diarization"] is not None:
+            return run_pipeline_transcription.make_cut_data(
+                curr_yt_id, inputs["diarization"]["audio"], inputs["diarization"]["dia_data"], self.merge_turns)
+        # Diarized by an earlier run: the part_2 track comes from the audio cache, else from a new download
+        return run_pipeline_transcription.cut_video(curr_yt_id, self.merge_turns, cache=self.cache)
+
+    def transcribe(self, curr_yt_id, inputs):
+        trans_data = run_pipeline_transcription.transcribe_video(inputs["cut"], self.get_models("whisper"), self.mode)
+        self.manifest.mark_done(TRANSCRIPTION_STAGE, curr_yt_id,
+                                os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{curr_yt_id}.json"),
+                                input_stages=[DIARIZATION_STAGE])
+        return trans_data
+
+    def score(self, curr_yt_id, inputs):
+        # Marked as done in the manifest once its file is written
+        self.get_models("perspective").score(curr_yt_id, inputs["transcription"])
+
+    def on_error(self, node_name, curr_yt_id, e):
+        self.error_ids.append([curr_yt_id, node_name, f"{e}"])
+        if node_name in NODE_STAGES:
+            self.manifest.mark_failed(NODE_STAGES[node_name], curr_yt_id, e)
+        for scratch_dir in [ConfigConstants.PART_0_PATH, ConfigConstants.PART_2_PATH]:
+            scratch_path = os.path.join(scratch_dir, f"{curr_yt_id}.wav")
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+    def on_video_done(self, curr_yt_id, ran):
+        if ran:
+            logger.info(f"Done with {curr_yt_id}: {', '.join(ran)}")
+        else:
+            logger.debug(f"Nothing to do for {curr_yt_id}")
+
+    def run(self, vid_ids):
+        """
+        Run the stages over the videos.
+
+        Args:
+            vid_ids (iterable): YouTube video IDs
+
+        Returns:
+            list: [video ID, node, error] of the nodes that failed
+        """
+        ConfigConstants.create_directories()
+        self.manifest = run_manifest.RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+        for stage in STAGES:
+            self.manifest.sync_directory(stage)
+        self.cache = audio_cache.open_cache()
+        try:
+            with instrumentation.span("corpus_run", stages=self.stages, max_videos=self.max_videos):
+                self.graph.run(vid_ids, self.max_videos, self.on_error, self.on_video_done)
+        finally:
+            if "perspective" in self.models:
+                self.models["perspective"].close()
+            logger.info(f"Run manifest: {self.manifest.summary()}")
+            self.manifest.close()
+            if self.cache is not None:
+                self.cache.close()
+        return self.error_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run download, VAD/OSD, diarization, transcription and Perspective scoring over the videos as "
+                    "one job, computing only the missing or outdated stage outputs.")
+    parser.add_argument("video_ids", help="YouTube ID, path to a JSON list of IDs or data/video_details.json")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="Stages to compute; the outputs of the others are only read")
+    parser.add_argument("--mode", choices=[run_pipeline_transcription.PER_UTTERANCE_MODE,
+                                           run_pipeline_transcription.WHOLE_TRACK_MODE],
+                        default=run_pipeline_transcription.PER_UTTERANCE_MODE)
+    parser.add_argument("--no-turn-merging", action="store_true",
+                        help="Transcribe every diarization turn separately, without merging same-speaker turns")
+    parser.add_argument("--downloads", type=int, default=ConfigConstants.PREFETCH_WORKERS,
+                        help="Number of videos downloaded and decoded at once")
+    parser.add_argument("--cut-workers", type=int, default=1,
+                        help="Number of threads cutting the part_2 tracks of videos diarized by earlier runs")
+    parser.add_argument("--max-videos", type=int, default=None,
+                        help="Number of videos in flight at once, which bounds the memory used (default: downloads + 4)")
+    args = parser.parse_args()
+
+    vid_id_list = run_pipeline_osd_vad.load_video_ids(args.video_ids)
+    corpus_run = CorpusRun(args.stages, args.mode, not args.no_turn_merging, args.downloads, args.cut_workers,
+                           args.max_videos)
+    error_ids = corpus_run.run(vid_id_list)
+
+    logger.info(f"Errors in {len(error_ids)} videos: {error_ids}")
+    logger.info("ENTIRE RAN. Done")
+
+
+if __name__ == "__main__":
+    main()
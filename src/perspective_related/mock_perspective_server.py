@@ -0,0 +1,153 @@
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import aiohttp
+from aiohttp import web
+from ..tv_debs_utils import debate_utils
+from . import perspective_client
+
+# get a logger to use
+logger = debate_utils.get_logger()
+
+ANALYZE_PATH = "/v1alpha1/comments:analyze"
+
+
+def fake_score(text, attribute):
+    """
+    Deterministic stand-in for a Perspective score.
+
+    Args:
+        text (str): Text of the comment.
+        attribute (str): Requested attribute.
+
+    Returns:
+        float: Score in [0, 1).
+    """
+    digest = hashlib.sha256(f"{attribute}:{text}".encode()).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32
+
+
+def build_fake_response(body):
+    """
+    Build a response with the same structure as the Perspective API's.
+
+    Args:
+        body (dict): comments:analyze request body.
+
+    Returns:
+        dict: Response body.
+    """
+    text = body['comment']['text']
+    attribute_scores = {}
+    for attribute in body['requestedAttributes']:
+        value = fake_score(text, attribute)
+        attribute_scores[attribute] = {
+            'spanScores': [{'begin': 0, 'end': len(text), 'score': {'value': value, 'type': 'PROBABILITY'}}],
+            'summaryScore': {'value': value, 'type': 'PROBABILITY'},
+        }
+    return {'attributeScores': attribute_scores, 'languages': body.get('languages', ["en"]),
+            'detectedLanguages': ["en"]}
+
+
+def create_app(qps, latency, error_rate):
+    """
+    Create the mock server, which enforces a per-key QPS quota like the real API.
+
+    Args:
+        qps (float): Requests per second allowed per key; extra requests get a 429.
+        latency (float): Seconds spent on every request.
+        error_rate (float): Fraction of requests answered with a 503.
+
+    Returns:
+        web.Application: The mock server.
+    """
+    buckets = {}
+
+    async def analyze(request):
+        key = request.query.get('key', '')
+        if key not in buckets:
+            buckets[key] = perspective_client.TokenBucket(qps)
+        if not buckets[key].try_acquire():
+            return web.json_response({'error': {'code': 429, 'message': 'Quota exceeded'}}, status=429)
+        body = await request.json()
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            return web.json_response({'error': {'code': 503, 'message': 'Unavailable'}}, status=503)
+        return web.json_response(build_fake_response(body))
+
+    app = web.Application()
+    app.router.add_post(ANALYZE_PATH, analyze)
+    return app
+
+
+async def load_test(port, num_requests, api_keys, client_qps, max_in_flight):
+    """
+    Send requests through PerspectiveClient to a running mock server and report the throughput.
+
+    Args:
+        port (int): Port of the mock server.
+        num_requests (int): Number of requests to send.
+        api_keys (list): Keys to spread the requests over.
+        client_qps (float): Client-side rate limit per key.
+        max_in_flight (int): Concurrent requests per key.
+    """
+    api_url = f"http://127.0.0.1:{port}{ANALYZE_PATH}"
+    queue = asyncio.Queue()
+    for idx in range(num_requests):
+        queue.put_nowait(perspective_client.build_analyze_request(f"utterance number {idx}"))
+
+    async def worker(client):
+        while True:
+            try:
+                body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await client.analyze(body)
+            except perspective_client.PerspectiveRequestError as e:
+                logger.debug(f"Request failed: {e}")
+
+    async with aiohttp.ClientSession() as session:
+        clients = [perspective_client.PerspectiveClient(session, key, api_url, qps=client_qps,
+                                                        max_in_flight=max_in_flight, base_backoff=0.1)
+                   for key in api_keys]
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker(client) for client in clients for _ in range(max_in_flight)])
+        elapsed = time.perf_counter() - start_time
+
+    num_retries = sum(client.num_retries for client in clients)
+    logger.info(f"{num_requests} requests in {elapsed:.2f}s: {num_requests / elapsed:.1f} QPS, {num_retries} retries")
+
+
+async def serve(args):
+    runner = web.AppRunner(create_app(args.qps, args.latency, args.error_rate))
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+    logger.info(f"Mock Perspective API listening on http://127.0.0.1:{args.port}{ANALYZE_PATH}")
+    try:
+        if args.load_test:
+            api_keys = [f"mock-key-{idx}" for idx in range(args.num_keys)]
+            await load_test(args.port, args.load_test, api_keys, args.qps, args.max_in_flight)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Perspective comments:analyze endpoint.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--qps", type=float, default=1.0, help="Quota per API key")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds spent on every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503")
+    parser.add_argument("--load-test", type=int, default=0,
+                        help="Send this many requests through the async client, report the throughput and exit")
+    parser.add_argument("--num-keys", type=int, default=1, help="Number of API keys used by the load test")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Concurrent requests per key in the load test")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
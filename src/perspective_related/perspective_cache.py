@@ -0,0 +1,187 @@
+import json
+import bisect
+import sqlite3
+import asyncio
+import hashlib
+import unicodedata
+from ..tv_debs_utils import debate_utils
+from . import perspective_client
+
+# get a logger to use
+logger = debate_utils.get_logger()
+
+
+def normalize_text(text):
+    """
+    Normalize the text of an utterance before it is scored and hashed.
+
+    Only the Unicode form and the surrounding whitespace are normalized: casing and punctuation
+    change Perspective scores.
+
+    Args:
+        text (str): Text of the utterance.
+
+    Returns:
+        str: Normalized text.
+    """
+    return unicodedata.normalize('NFC', text).strip()
+
+
+def make_cache_key(body):
+    """
+    Hash a comments:analyze request body (normalized text plus requested attributes and options).
+
+    Args:
+        body (dict): Request body, see `perspective_client.build_analyze_request`.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def get_offset_boundaries(text):
+    """
+    Offsets where a stripped text and its NFC form line up: normalizing the text before such an
+    offset gives the start of the normalized text. Composition changes the length of the text (e.g.
+    decomposed accents or Devanagari), so offsets past it can't be used as they are.
+
+    Args:
+        text (str): Stripped text of the utterance.
+
+    Returns:
+        list: Sorted (normalized offset, original offset) pairs, or None if the normalization doesn't
+            change the text.
+    """
+    normalized = unicodedata.normalize('NFC', text)
+    if normalized == text:
+        return None
+    boundaries = []
+    for end in range(len(text) + 1):
+        # Characters combining with the previous ones are never boundaries
+        if end < len(text) and unicodedata.combining(text[end]):
+            continue
+        prefix = unicodedata.normalize('NFC', text[:end])
+        if normalized.startswith(prefix):
+            boundaries.append((len(prefix), end))
+    return boundaries
+
+
+def map_span_annotations(response, text):
+    """
+    Map the span annotations of a response computed on `normalize_text(text)` back onto `text`.
+
+    Args:
+        response (dict): Perspective API response.
+        text (str): Original text of the utterance.
+
+    Returns:
+        dict: Response with mapped spans (a copy if any span moves).
+    """
+    offset = len(text) - len(text.lstrip())
+    boundaries = get_offset_boundaries(text.strip())
+    if offset == 0 and boundaries is None:
+        return response
+    normalized_offsets = [normalized_offset for normalized_offset, _ in boundaries or []]
+
+    def map_offset(normalized_offset, widen_right):
+        if boundaries is None:
+            return normalized_offset + offset
+        # An offset inside a composed character is moved to its start (or end, for the end of a span)
+        idx = bisect.bisect_left(normalized_offsets, normalized_offset) if widen_right \
+            else bisect.bisect_right(normalized_offsets, normalized_offset) - 1
+        return boundaries[min(max(idx, 0), len(boundaries) - 1)][1] + offset
+
+    response = json.loads(json.dumps(response))
+    for attribute_score in response.get('attributeScores', {}).values():
+        for span_score in attribute_score.get('spanScores', []):
+            span_score['begin'] = map_offset(span_score.get('begin', 0), False)
+            span_score['end'] = map_offset(span_score.get('end', 0), True)
+    return response
+
+
+class PerspectiveCache:
+    """
+    Persistent, content-addressed cache of Perspective responses, stored in SQLite.
+
+    Concurrent requests for the same key share a single API call.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+        self.connection.commit()
+        self.in_flight = {}
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    def get(self, key):
+        row = self.connection.execute("SELECT response FROM scores WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, response):
+        self.connection.execute("INSERT OR REPLACE INTO scores (key, response) VALUES (?, ?)",
+                                (key, json.dumps(response)))
+        self.connection.commit()
+
+    async def analyze(self, client, text):
+        """
+        Score a text, checking the cache before sending any request.
+
+        Args:
+            client (perspective_client.PerspectiveClient): Client used on a cache miss.
+            text (str): Text of the utterance.
+
+        Returns:
+            dict: Perspective API response, with spans relative to `text`.
+        """
+        normalized_text = normalize_text(text)
+        if not normalized_text:
+            # Same as empty utterances: nothing to score
+            return {}
+        body = perspective_client.build_analyze_request(normalized_text)
+        key = make_cache_key(body)
+
+        response = self.get(key)
+        if response is not None:
+            self.hits += 1
+            return map_span_annotations(response, text)
+        if key in self.in_flight:
+            self.shared += 1
+            return map_span_annotations(await asyncio.shield(self.in_flight[key]), text)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            response = await client.analyze(body)
+            self.put(key, response)
+            future.set_result(response)
+        except Exception as e:
+            future.set_exception(e)
+            # The error is raised to the caller below; don't warn about it being never retrieved
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+        return map_span_annotations(response, text)
+
+    def stats(self):
+        """
+        Get the hit-rate statistics of this run.
+
+        Returns:
+            dict: hits, shared (duplicates served by an in-flight request), misses and hit_rate.
+        """
+        total = self.hits + self.shared + self.misses
+        return {"hits": self.hits, "shared": self.shared, "misses": self.misses,
+                "hit_rate": (self.hits + self.shared) / total if total else 0.0}
+
+    def close(self):
+        self.connection.close()
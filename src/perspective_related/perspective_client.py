@@ -0,0 +1,149 @@
+import time
+import random
+import asyncio
+import aiohttp
+from ..tv_debs_utils import debate_utils
+
+# get a logger to use
+logger = debate_utils.get_logger()
+
+REQUESTED_ATTRIBUTES = ['TOXICITY', 'SEVERE_TOXICITY', 'IDENTITY_ATTACK', 'THREAT', 'INSULT', 'PROFANITY']
+
+# Statuses worth retrying: quota exhaustion and server-side errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PerspectiveRequestError(Exception):
+    """Raised when the Perspective API rejects a request, or keeps failing after all retries."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter: `rate` tokens per second, at most `capacity` tokens stored.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """
+        Take a token if one is available.
+
+        Returns:
+            bool: True if a token was taken, False otherwise.
+        """
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it. Waiters are served in arrival order.
+        """
+        async with self.lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+def build_analyze_request(text):
+    """
+    Build the body of a comments:analyze request.
+
+    Args:
+        text (str): Text of the utterance.
+
+    Returns:
+        dict: Request body.
+    """
+    return {
+        'comment': {'text': text},
+        'requestedAttributes': {attribute: {} for attribute in REQUESTED_ATTRIBUTES},
+        'spanAnnotations': True,
+        'languages': ["en"]
+    }
+
+
+class PerspectiveClient:
+    """
+    Asynchronous Perspective API client for one API key, with its own rate limit.
+
+    Args:
+        session (aiohttp.ClientSession): Session shared by all clients.
+        api_key (str): Perspective API key.
+        api_url (str): URL of the comments:analyze endpoint.
+        qps (float): Requests per second allowed for this key.
+        max_in_flight (int): Maximum number of concurrent requests for this key.
+        max_retries (int): Retries on 429/5xx and network errors before giving up.
+        base_backoff (float): First backoff delay in seconds, doubled at every retry.
+        max_backoff (float): Upper bound of the backoff delay in seconds.
+    """
+
+    def __init__(self, session, api_key, api_url, qps=1.0, max_in_flight=8, max_retries=5,
+                 base_backoff=1.0, max_backoff=60.0):
+        self.session = session
+        self.api_key = api_key
+        self.api_url = api_url
+        self.bucket = TokenBucket(qps)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.num_requests = 0
+        self.num_retries = 0
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    async def analyze(self, body):
+        """
+        Send a comments:analyze request, retrying with exponential backoff on 429/5xx.
+
+        Args:
+            body (dict): Request body, see `build_analyze_request`.
+
+        Returns:
+            dict: Perspective API response.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.num_requests += 1
+            retry_after = None
+            try:
+                async with self.session.post(self.api_url, params={'key': self.api_key}, json=body) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    message = await response.text()
+                    if response.status not in RETRYABLE_STATUSES:
+                        raise PerspectiveRequestError(response.status, message)
+                    retry_after = response.headers.get('Retry-After')
+                    error = PerspectiveRequestError(response.status, message)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = PerspectiveRequestError(None, repr(e))
+
+            if attempt == self.max_retries:
+                raise error
+            self.num_retries += 1
+            delay = self._backoff(attempt, retry_after)
+            logger.debug(f"Retrying in {delay:.1f}s after: {error}")
+            await asyncio.sleep(delay)
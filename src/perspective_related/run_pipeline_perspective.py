@@ -1,101 +1,318 @@
-from googleapiclient import discovery
 import json
 import os
-from time import sleep
-from multiprocessing import Process
+import time
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+from contextlib import asynccontextmanager
+import aiohttp
 from ..config_constants import ConfigConstants
 from ..tv_debs_utils import debate_utils
+from ..tv_debs_utils.run_journal import UtteranceJournal
+from ..tv_debs_utils.run_manifest import RunManifest
+from ..tv_debs_utils import columnar_store, instrumentation
+from . import perspective_client, perspective_cache
 
 # get a logger to use
 logger = debate_utils.get_logger()
 logger.info("INFO IS FROM THE LOGGER/")
 
+# Names of the stages in the run manifest
+TRANSCRIPTION_STAGE = "transcription"
+STAGE = "perspective"
 
-def process_target(API_KEY, files):
-    logger.info("Going to initialize PerspectiveAPI client.")
-    client = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=API_KEY,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
-    )
 
-    logger.debug("Client has been initialized")
-    for file_id, file in enumerate(files):
-        logger.info(f"Processing: [{file_id}/{len(files)}]: {file}")
+class TranscriptJob:
+    """
+    A transcript being scored: its utterances are spread over the shared work queue, each finished
+    utterance is journaled, and the file is written once the last of them is done.
+
+    Its span lasts from loading the transcript to writing the file, and totals the time the
+    utterances waited for the API (api_seconds). `on_finished`, if given, is called with the job and
+    the exception raised while writing the file (None once written).
+    """
+
+    def __init__(self, file, transcript_data, num_pending, journal, manifest, on_finished=None):
+        self.file = file
+        self.transcript_data = transcript_data
+        self.num_pending = num_pending
+        self.journal = journal
+        self.manifest = manifest
+        self.on_finished = on_finished
+        self.span = instrumentation.start_span("perspective", file, num_utterances=len(transcript_data),
+                                               num_pending=num_pending)
+
+    def utterance_done(self, ind):
+        if "perspective" in self.transcript_data[ind]:
+            self.journal.append(ind, self.transcript_data[ind]["perspective"])
+        self.num_pending -= 1
+        if self.num_pending == 0:
+            try:
+                self.write()
+            except Exception as e:
+                # Logged here, so that the worker scoring the last utterance keeps serving the queue
+                logger.exception(f"Error while writing the perspective data of: {self.file}: {e}")
+
+    def write(self):
+        write_path = os.path.join(ConfigConstants.PERSPECTIVE_FILE_DIR, f"{self.file}.json")
+        try:
+            self.journal.compact(self.transcript_data, write_path, indent=1)
+            columnar_store.store_video("perspective", self.file, self.transcript_data)
+            self.manifest.mark_done(STAGE, self.file, write_path, input_stages=[TRANSCRIPTION_STAGE])
+        except Exception as e:
+            self.span.end(error=e)
+            if self.on_finished is not None:
+                self.on_finished(self, e)
+            raise
+        self.span.end()
+        logger.info(f"Perspective data written for: {self.file}")
+        if self.on_finished is not None:
+            self.on_finished(self, None)
+
+
+async def enqueue_transcript(file, queue, manifest, transcript_data=None, on_finished=None):
+    """
+    Put the utterances of a claimed transcript on the shared work queue.
+
+    Args:
+        file (str): ID of the video
+        queue (asyncio.Queue): Shared work queue of (TranscriptJob, utterance index) items
+        manifest (RunManifest): Run manifest, where the video is marked as done
+        transcript_data (list, optional): Transcript records (e.g. handed over in memory by the
+            transcription stage); loaded from the transcription folder by default
+        on_finished (callable, optional): Called once the job is over (see `TranscriptJob`)
+
+    Returns:
+        TranscriptJob: The job of the transcript
+    """
+    if transcript_data is None:
         with open(os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{file}.json"), 'r') as f:
             transcript_data = json.load(f)
-        write_path = os.path.join(
-            ConfigConstants.PERSPECTIVE_FILE_DIR, f"{file}.json")
-        if os.path.exists(write_path):
-            logger.debug(f"Perspective data already exists for: {file}")
+    logger.debug(f"Number of utterances is: {len(transcript_data)}")
+
+    # Utterances scored by an interrupted run
+    journal = UtteranceJournal("perspective", file)
+    for ind, perspective in journal.load().items():
+        transcript_data[ind]["perspective"] = perspective
+
+    pending = []
+    for ind, utterance in enumerate(transcript_data):
+        if "perspective" in utterance:
             continue
-        logger.debug(f"Number of utterances is: {len(transcript_data)}")
-        for ind, utterance in enumerate(transcript_data):
-
-            logger.debug(f"Processing utterance: {ind}/{len(transcript_data)}")
-            if "perspective" in utterance:
-                continue
-            if len(utterance["text"]):
-                analyze_request = {
-                    'comment': {'text': utterance['text']},
-                    'requestedAttributes': {
-                        'TOXICITY': {},
-                        'SEVERE_TOXICITY': {},
-                        'IDENTITY_ATTACK': {},
-                        'THREAT': {},
-                        'INSULT': {},
-                        'PROFANITY': {}
-                    },
-                    'spanAnnotations': True,
-                    'languages': ["en"]
-                }
-                try:
-                    response = client.comments().analyze(body=analyze_request).execute()
-                    transcript_data[ind]["perspective"] = response
-                except Exception as e:
-                    logger.exception(f"Error occurred for: {file}, {ind}: {e}")
-
-                sleep(1.2)
-            else:
-                transcript_data[ind]["perspective"] = {}
-        with open(write_path, 'w') as f:
-            json.dump(transcript_data, f, indent=1)
-        sleep(0.5)
-
-
-files = os.listdir(ConfigConstants.TRANSCRIPT_FILE_DIR)
-logger.info("Number of files with transcripts: ", len(files))
-
-files_done = os.listdir(ConfigConstants.PERSPECTIVE_FILE_DIR)
-
-
-files = sorted(list(set(files).difference(set(files_done))))
-logger.info(
-    "Number of files after removing files that are already processed: ", len(files))
-
-
-files = list(filter(lambda x: "json" in x, files))
-logger.info("Number of files after restricting to json files only: ", len(files))
-
-process_files = {id: []
-                 for id in range(len(ConfigConstants.PERSPECTIVE_API_KEYS))}
-[process_files[idx % len(ConfigConstants.PERSPECTIVE_API_KEYS)].append(
-    file_name.split('.json')[0]) for idx, file_name in enumerate(files)]
-
-
-def run():
-    procs = []
-
-    for pID, API_KEY in enumerate(ConfigConstants.PERSPECTIVE_API_KEYS):
-        proc = Process(target=process_target, args=(
-            API_KEY, process_files[pID], ))
-        procs.append(proc)
-        proc.start()
-
-    for proc in procs:
-        proc.join()
-
-
-run()
+        if len(utterance["text"]):
+            pending.append(ind)
+        else:
+            transcript_data[ind]["perspective"] = {}
+
+    job = TranscriptJob(file, transcript_data, len(pending), journal, manifest, on_finished)
+    if not pending:
+        job.write()
+    for ind in pending:
+        await queue.put((job, ind))
+    return job
+
+
+async def enqueue_files(files, queue, manifest):
+    """
+    Load the transcripts one by one and put their utterances on the shared work queue.
+
+    The queue is bounded, so only the transcripts currently being scored are held in memory.
+
+    Args:
+        files (list): IDs of the videos to process
+        queue (asyncio.Queue): Shared work queue of (TranscriptJob, utterance index) items
+        manifest (RunManifest): Run manifest, where the videos are claimed and marked as done
+    """
+    for file_id, file in enumerate(files):
+        logger.info(f"Processing: [{file_id}/{len(files)}]: {file}")
+        if not manifest.try_start(STAGE, file):
+            logger.debug(f"Perspective data already exists (or is being computed) for: {file}")
+            continue
+        await enqueue_transcript(file, queue, manifest)
+
+
+async def score_utterances(client, cache, queue):
+    """
+    Score utterances from the shared work queue with one API key, until cancelled.
+
+    Args:
+        client (perspective_client.PerspectiveClient): Client of the API key
+        cache (perspective_cache.PerspectiveCache): Cache checked before any request
+        queue (asyncio.Queue): Shared work queue of (TranscriptJob, utterance index) items
+    """
+    while True:
+        job, ind = await queue.get()
+        try:
+            utterance = job.transcript_data[ind]
+            start = time.perf_counter()
+            utterance["perspective"] = await cache.analyze(client, utterance['text'])
+            job.span.add("api_seconds", time.perf_counter() - start)
+        except Exception as e:
+            job.span.add("num_errors", 1)
+            logger.exception(f"Error occurred for: {job.file}, {ind}: {e}")
+        finally:
+            try:
+                job.utterance_done(ind)
+            finally:
+                queue.task_done()
+
+
+def make_queue():
+    """
+    Returns:
+        asyncio.Queue: The shared work queue, bounded to twice the requests all API keys can have in flight
+    """
+    return asyncio.Queue(maxsize=2 * ConfigConstants.PERSPECTIVE_MAX_IN_FLIGHT_PER_KEY
+                         * len(ConfigConstants.PERSPECTIVE_API_KEYS))
+
+
+@asynccontextmanager
+async def start_scoring(queue):
+    """
+    Start a client per API key, and the tasks scoring the utterances of the shared work queue with
+    them; the tasks are stopped on exit (once the caller has waited for the queue).
+
+    Args:
+        queue (asyncio.Queue): Shared work queue of (TranscriptJob, utterance index) items
+
+    Yields:
+        list: The PerspectiveClient of every API key
+    """
+    cache = perspective_cache.PerspectiveCache(ConfigConstants.PERSPECTIVE_CACHE_PATH)
+    timeout = aiohttp.ClientTimeout(total=ConfigConstants.PERSPECTIVE_REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        logger.info("Going to initialize PerspectiveAPI clients.")
+        clients = [perspective_client.PerspectiveClient(
+            session, api_key, ConfigConstants.PERSPECTIVE_API_URL,
+            qps=ConfigConstants.PERSPECTIVE_QPS_PER_KEY, max_in_flight=ConfigConstants.PERSPECTIVE_MAX_IN_FLIGHT_PER_KEY,
+            max_retries=ConfigConstants.PERSPECTIVE_MAX_RETRIES) for api_key in ConfigConstants.PERSPECTIVE_API_KEYS]
+        workers = [asyncio.create_task(score_utterances(client, cache, queue))
+                   for client in clients for _ in range(client.max_in_flight)]
+        try:
+            yield clients
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    for pID, client in enumerate(clients):
+        logger.info(f"API key {pID}: {client.num_requests} requests, {client.num_retries} retries")
+    logger.info(f"Perspective cache: {cache.stats()}")
+    cache.close()
+
+
+async def run(files, manifest):
+    """
+    Score all utterances of the given transcripts, sharing one work queue across all API keys.
+
+    Args:
+        files (list): IDs of the videos to process
+        manifest (RunManifest): Run manifest, where the videos are claimed and marked as done
+    """
+    queue = make_queue()
+    with instrumentation.span("perspective_run", num_videos=len(files),
+                              num_keys=len(ConfigConstants.PERSPECTIVE_API_KEYS)) as span:
+        async with start_scoring(queue) as clients:
+            await enqueue_files(files, queue, manifest)
+            await queue.join()
+        span.set(num_requests=sum(client.num_requests for client in clients),
+                 num_retries=sum(client.num_retries for client in clients))
+
+
+class PerspectiveScorer:
+    """
+    Scores the transcripts handed over by other threads (e.g. the stages of
+    orchestration_related/run_pipeline_all.py), on an event loop thread of its own where all of them share
+    the clients, the cache and the work queue, like the transcripts of `run`.
+
+    Args:
+        manifest (RunManifest): Run manifest, where the videos are marked as done; the callers claim them.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="perspective", daemon=True)
+        self.thread.start()
+        # Set once the clients are started, or with the error that kept them from starting
+        started = concurrent.futures.Future()
+        self.serving = asyncio.run_coroutine_threadsafe(self._serve(started), self.loop)
+        started.result()
+
+    async def _serve(self, started):
+        self.queue = make_queue()
+        self.stopping = asyncio.Event()
+        try:
+            with instrumentation.span("perspective_run", num_keys=len(ConfigConstants.PERSPECTIVE_API_KEYS)) as span:
+                async with start_scoring(self.queue) as clients:
+                    started.set_result(None)
+                    await self.stopping.wait()
+                    await self.queue.join()
+                span.set(num_requests=sum(client.num_requests for client in clients),
+                         num_retries=sum(client.num_retries for client in clients))
+        except BaseException as e:
+            if not started.done():
+                started.set_exception(e)
+            raise
+
+    def score(self, file, transcript_data=None):
+        """
+        Score the utterances of a claimed transcript and write its perspective data; blocks until
+        the file is written.
+
+        Args:
+            file (str): ID of the video
+            transcript_data (list, optional): Transcript records; loaded from the transcription folder by default
+
+        Returns:
+            list: The transcript records, with their perspective scores
+        """
+        finished = threading.Event()
+        errors = []
+
+        def on_finished(job, error):
+            if error is not None:
+                errors.append(error)
+            finished.set()
+
+        job = asyncio.run_coroutine_threadsafe(
+            enqueue_transcript(file, self.queue, self.manifest, transcript_data, on_finished), self.loop).result()
+        finished.wait()
+        if errors:
+            raise errors[0]
+        return job.transcript_data
+
+    def close(self):
+        """
+        Wait for the transcripts being scored, then stop the clients and the event loop.
+        """
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.serving.result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the transcribed utterances with the Perspective API.")
+    parser.parse_args()
+    ConfigConstants.create_directories()
+
+    # Transcribed videos without perspective data, from the run manifest rather than folder listings
+    manifest = RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    manifest.sync_directory(TRANSCRIPTION_STAGE)
+    manifest.sync_directory(STAGE)
+    files = manifest.pending(STAGE, after=TRANSCRIPTION_STAGE)
+    logger.info(f"Number of transcribed files left to process: {len(files)}")
+
+    try:
+        asyncio.run(run(files, manifest))
+        logger.info(f"Run manifest: {manifest.summary().get(STAGE)}")
+    finally:
+        # Gives back the transcripts still claimed if the run is interrupted; their journals resume them
+        manifest.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import torch
+import whisper
+from whisper.audio import N_FRAMES, N_SAMPLES
+from whisper.tokenizer import get_tokenizer
+from ..tv_debs_utils import debate_utils
+
+# get a logger to use
+logger = debate_utils.get_logger()
+
+# Defaults of `whisper.transcribe`, used to decide whether a greedy decode is accepted as is
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def utterance_mel(whisper_model, utter_audio):
+    """
+    Compute the 30-second log-mel input of an utterance, exactly as `whisper.transcribe` does for its first window.
+
+    Args:
+        whisper_model: Loaded whisper model.
+        utter_audio (np.ndarray): int16 audio samples of the utterance.
+
+    Returns:
+        tuple: (n_mels, N_FRAMES) mel tensor and the number of frames with content.
+    """
+    mel = whisper.log_mel_spectrogram(debate_utils.to_float32(utter_audio), whisper_model.dims.n_mels, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    return whisper.pad_or_trim(mel[:, :content_frames], N_FRAMES), content_frames
+
+
+def transcribe_one(whisper_model, utter_audio, language):
+    """
+    Transcribe a single utterance with the full `whisper.transcribe` loop (temperature fallback, long-form decoding).
+
+    Args:
+        whisper_model: Loaded whisper model.
+        utter_audio (np.ndarray): int16 audio samples of the utterance.
+        language (str): Language of the audio.
+
+    Returns:
+        dict: text, language and (if any segment was decoded) no_speech_prob.
+    """
+    result = whisper_model.transcribe(debate_utils.to_float32(utter_audio), language=language,
+                                      fp16=whisper_model.device.type != "cpu")
+    useful_data = {'text': result['text'], 'language': result['language']}
+    if 'segments' in result and len(result['segments']) > 0 and 'no_speech_prob' in result['segments'][0]:
+        useful_data['no_speech_prob'] = result['segments'][0]['no_speech_prob']
+    return useful_data
+
+
+def transcribe_utterances(whisper_model, audio, bounds, batch_size=16, language="en", done_results=None,
+                          on_result=None):
+    """
+    Transcribe many utterances of an in-memory track, decoding a batch of them per forward pass.
+
+    Utterances up to 30 seconds are padded into 30-second mel inputs and greedily decoded in
+    batches. Utterances that are longer, or whose greedy decode fails the quality thresholds of
+    `whisper.transcribe`, go through `whisper.transcribe` one by one, so the output matches the
+    per-utterance path.
+
+    Args:
+        whisper_model: Loaded whisper model.
+        audio (np.ndarray): int16 audio samples of the track, sampled at `debate_utils.sr`.
+        bounds (list): [start, end) sample indices of each utterance.
+        batch_size (int): Number of utterances decoded per forward pass.
+        language (str): Language of the audio.
+        done_results (dict, optional): Results of utterances already transcribed (by index), which are skipped.
+        on_result (callable, optional): Called with (index, result) as soon as an utterance is transcribed.
+
+    Returns:
+        list: One dict per utterance (in order) with text, language and, if any segment was decoded,
+            no_speech_prob.
+    """
+    tokenizer = get_tokenizer(whisper_model.is_multilingual, num_languages=whisper_model.num_languages,
+                              language=language, task="transcribe")
+    options = whisper.DecodingOptions(language=language, temperature=0.0,
+                                      fp16=whisper_model.device.type != "cpu")
+    results = [None] * len(bounds)
+    fallback_indices = []
+    done_results = done_results or {}
+    for idx, result in done_results.items():
+        results[idx] = result
+
+    def set_result(idx, result):
+        results[idx] = result
+        if on_result is not None:
+            on_result(idx, result)
+
+    def decode_batch(batch_indices, batch_mels):
+        decoded = whisper.decode(whisper_model, torch.stack(batch_mels).to(whisper_model.device), options)
+        for idx, result in zip(batch_indices, decoded):
+            is_silence = result.no_speech_prob > NO_SPEECH_THRESHOLD
+            if not is_silence and (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                                   or result.avg_logprob < LOGPROB_THRESHOLD):
+                fallback_indices.append(idx)
+            elif is_silence and result.avg_logprob <= LOGPROB_THRESHOLD:
+                # whisper.transcribe skips the window: no text and no segment
+                set_result(idx, {'text': "", 'language': language})
+            else:
+                text = tokenizer.decode(result.tokens)
+                set_result(idx, {'text': text, 'language': language, 'no_speech_prob': result.no_speech_prob})
+
+    batch_indices, batch_mels = [], []
+    for idx, (start, end) in enumerate(bounds):
+        if idx in done_results:
+            continue
+        mel, content_frames = utterance_mel(whisper_model, audio[start:end])
+        if content_frames > N_FRAMES:
+            fallback_indices.append(idx)
+            continue
+        batch_indices.append(idx)
+        batch_mels.append(mel)
+        if len(batch_indices) == batch_size:
+            decode_batch(batch_indices, batch_mels)
+            logger.debug(f"{idx + 1} utterances out of {len(bounds)} went through batched decoding")
+            batch_indices, batch_mels = [], []
+    if batch_indices:
+        decode_batch(batch_indices, batch_mels)
+
+    logger.debug(f"{len(fallback_indices)} utterances out of {len(bounds)} need the sequential path")
+    for idx in sorted(fallback_indices):
+        start, end = bounds[idx]
+        set_result(idx, transcribe_one(whisper_model, audio[start:end], language))
+    return results
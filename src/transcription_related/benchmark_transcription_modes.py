@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import argparse
+from ..config_constants import ConfigConstants
+from ..tv_debs_utils import debate_utils
+from . import run_pipeline_transcription
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+
+def normalize_words(text):
+    """
+    Lowercase a text and split it into words, ignoring punctuation.
+
+    Args:
+        text (str): Text to normalize
+
+    Returns:
+        list: List of words
+    """
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def word_edit_distance(reference, hypothesis):
+    """
+    Compute the word-level Levenshtein distance between two word lists.
+
+    Args:
+        reference (list): Reference words
+        hypothesis (list): Hypothesis words
+
+    Returns:
+        int: Number of substitutions, deletions and insertions
+    """
+    previous_row = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, start=1):
+        current_row = [i]
+        for j, hyp_word in enumerate(hypothesis, start=1):
+            current_row.append(min(previous_row[j] + 1, current_row[j - 1] + 1,
+                                   previous_row[j - 1] + (ref_word != hyp_word)))
+        previous_row = current_row
+    return previous_row[-1]
+
+
+def word_error_rate(reference_records, hypothesis_records):
+    """
+    Compute the WER of a transcript against a reference, turn by turn.
+
+    Both transcripts must have one record per diarization turn, in the same order.
+
+    Args:
+        reference_records (list): Reference transcript records
+        hypothesis_records (list): Hypothesis transcript records
+
+    Returns:
+        float: Word error rate
+    """
+    errors, num_words = 0, 0
+    for ref_record, hyp_record in zip(reference_records, hypothesis_records):
+        ref_words = normalize_words(ref_record['text'])
+        errors += word_edit_distance(ref_words, normalize_words(hyp_record['text']))
+        num_words += len(ref_words)
+    return errors / max(num_words, 1)
+
+
+def benchmark_video(curr_yt_id, whisper_model, reference_dir=None):
+    """
+    Transcribe a video with both modes and compare their speed and WER.
+
+    Args:
+        curr_yt_id (str): YouTube video ID (with VAD, OSD and diarization data available)
+        whisper_model: Loaded whisper model
+        reference_dir (str, optional): Directory with reference transcripts (<id>.json, same schema)
+
+    Returns:
+        dict: Benchmark results of the video
+    """
+    if not debate_utils.download_ytvid_as_wav(curr_yt_id):
+        logger.debug(f"Video download failed for {curr_yt_id=}")
+        return None
+    non_overlap_audio = debate_utils.rebuild_non_overlap_audio(curr_yt_id)
+    with open(os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json"), 'r') as fd:
+        dia_data = json.load(fd)
+
+    results = {"video_id": curr_yt_id, "audio_seconds": len(non_overlap_audio) / debate_utils.sr,
+               "num_turns": len(dia_data)}
+    transcripts = {}
+    for mode in [run_pipeline_transcription.PER_UTTERANCE_MODE, run_pipeline_transcription.WHOLE_TRACK_MODE]:
+        start_time = time.perf_counter()
+        transcripts[mode] = run_pipeline_transcription.transcribe_track(whisper_model, non_overlap_audio, dia_data, mode)
+        elapsed = time.perf_counter() - start_time
+        results[mode] = {"seconds": elapsed, "real_time_factor": elapsed / max(results["audio_seconds"], 1e-9)}
+        logger.info(f"{curr_yt_id}: {mode} took {elapsed:.1f}s")
+
+    # Without a reference, the per-utterance transcript is the reference
+    reference = transcripts[run_pipeline_transcription.PER_UTTERANCE_MODE]
+    if reference_dir is not None:
+        with open(os.path.join(reference_dir, f"{curr_yt_id}.json"), 'r') as fd:
+            reference = json.load(fd)
+        results[run_pipeline_transcription.PER_UTTERANCE_MODE]["wer"] = word_error_rate(
+            reference, transcripts[run_pipeline_transcription.PER_UTTERANCE_MODE])
+    results[run_pipeline_transcription.WHOLE_TRACK_MODE]["wer"] = word_error_rate(
+        reference, transcripts[run_pipeline_transcription.WHOLE_TRACK_MODE])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the speed and WER of whole-track and per-utterance transcription.")
+    parser.add_argument("video_ids", help="YouTube ID or path to a JSON list of IDs")
+    parser.add_argument("--reference-dir", default=None,
+                        help="Reference transcripts; by default the per-utterance output is the reference")
+    parser.add_argument("--output", default="transcription_modes_benchmark.json")
+    args = parser.parse_args()
+    ConfigConstants.create_directories()
+
+    vid_id_list = run_pipeline_transcription.load_video_ids(args.video_ids)
+    whisper_model = run_pipeline_transcription.load_whisper_model()
+
+    all_results = []
+    for curr_yt_id in vid_id_list:
+        video_results = benchmark_video(curr_yt_id, whisper_model, args.reference_dir)
+        if video_results is not None:
+            all_results.append(video_results)
+
+    with open(args.output, 'w') as fd:
+        json.dump(all_results, fd, indent=1)
+    logger.info(f"Benchmark results written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import os
-import sys
 import json
-import glob
-from pydub import AudioSegment
-import whisper
+import argparse
+import functools
 from ..config_constants import ConfigConstants
 from ..tv_debs_utils import debate_utils
+from ..tv_debs_utils.run_journal import UtteranceJournal
+from ..tv_debs_utils.staged_pipeline import Stage, run_stages
+from ..tv_debs_utils import worker_pool, run_manifest, columnar_store, audio_stream, audio_cache, instrumentation
+from ..tv_debs_utils import inference_backend
+from ..tv_debs_utils.timeline_map import load_timeline_map, ORIGINAL, PART_2
+from . import whole_track_transcription, turn_consolidation
 
 # Set environment variable for Hugging Face model cache
 # os.environ['HF_HOME'] = 'mounted_dump/hf_model_cache'
@@ -13,6 +17,14 @@ from ..tv_debs_utils import debate_utils
 # Get a logger to use
 logger = debate_utils.get_logger()
 
+# Transcription modes
+PER_UTTERANCE_MODE = "per_utterance"  # transcribe each diarization turn on its own
+WHOLE_TRACK_MODE = "whole_track"  # transcribe the whole part_2 track once, then split the words over the turns
+
+# Names of the stages in the run manifest
+DIARIZATION_STAGE = "diarization"
+STAGE = "transcription"
+
 def load_video_ids(args_received):
     """
     Load video IDs from command line argument or JSON file.
@@ -26,127 +38,396 @@ def load_video_ids(args_received):
     if args_received.endswith(".json"):
         assert os.path.exists(args_received)
         with open(args_received) as fd:
-            return json.load(fd)
+            vid_ids = json.load(fd)
+        if vid_ids and isinstance(vid_ids[0], dict):
+            # data/video_details.json: longest videos first, so that no worker is left with a
+            # long video once the others are done
+            vid_ids = sorted(vid_ids, key=lambda vid: -vid.get("total_duration", 0))
+            vid_ids = [vid["yt_vid_id"] for vid in vid_ids]
+        return vid_ids
     else:
         return [args_received]
 
-# Load video IDs
-vid_id_list = load_video_ids(sys.argv[1])
+def load_whisper_model(model_name=None, device=None, precision=None):
+    """
+    Load the Whisper model on the configured inference backend.
 
-# Load Whisper model
-whisper_model = whisper.load_model("large-v2", download_root=os.environ['HF_HOME'])
+    Args:
+        model_name (str, optional): Model size (default: WHISPER_MODEL)
+        device (str, optional): 'auto', 'cpu' or 'cuda' (default: INFERENCE_DEVICE)
+        precision (str, optional): 'fp32' or 'int8' (default: INFERENCE_PRECISION)
 
-def process_video(curr_yt_id, curr_vid_idx):
+    Returns:
+        whisper.Whisper: Loaded model
     """
-    Process a single video through the entire pipeline.
+    import whisper
+
+    inference_backend.configure_threads()
+    device = inference_backend.get_device(device)
+    precision = precision or ConfigConstants.INFERENCE_PRECISION
+    inference_backend.check_precision(precision, device)
+    whisper_model = whisper.load_model(model_name or ConfigConstants.WHISPER_MODEL, device=device,
+                                       download_root=os.environ['HF_HOME'])
+    return inference_backend.prepare_whisper_model(whisper_model, precision)
+
+def transcribe_track(whisper_model, non_overlap_audio, dia_data, mode=PER_UTTERANCE_MODE, source_turns=None,
+                     journal=None):
+    """
+    Transcribe every diarization turn of an overlap-free track.
 
     Args:
-        curr_yt_id (str): YouTube video ID
-        curr_vid_idx (int): Index of the current video in the list
+        whisper_model: Loaded whisper model
+        non_overlap_audio (np.ndarray): int16 audio samples of the part_2 track
+        dia_data (list): Diarization data of the track
+        mode (str): PER_UTTERANCE_MODE or WHOLE_TRACK_MODE
+        source_turns (list, optional): For every turn, the indices of the original diarization turns it
+            was consolidated from; saved in the records when given
+        journal (UtteranceJournal, optional): Journal of the finished utterances (per-utterance mode only);
+            utterances found in it are not transcribed again
 
     Returns:
-        bool: True if processing was successful, False otherwise
+        list: Transcript records (text, language, segment_start, segment_end, speaker), one per turn
     """
-    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
-    part_1_path = os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav")
-    part_2_path = os.path.join(ConfigConstants.PART_2_PATH, f"{curr_yt_id}.wav")
+    if mode == WHOLE_TRACK_MODE:
+        results = whole_track_transcription.transcribe_whole_track(
+            whisper_model, non_overlap_audio, dia_data, language="en")
+    else:
+        # Imports whisper and torch
+        from . import batched_transcription
 
-    # Check if diarization data exists
-    diarization_file_path = os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json")
-    if not os.path.exists(diarization_file_path):
-        logger.debug(f"Diarization data doesn't exist for: {curr_yt_id} | hence, skipping it currently.")
-        return False
+        # Transcribe utterances in batches, slicing them straight out of the in-memory track
+        bounds = [(int(utter[0]['start'] * debate_utils.sr), int(utter[0]['end'] * debate_utils.sr)) for utter in dia_data]
+        done_results, on_result = {}, None
+        if journal is not None:
+            # Utterances are journaled by their sample bounds, which don't depend on turn indices
+            journaled = journal.load()
+            done_results = {idx: journaled[f"{start}-{end}"] for idx, (start, end) in enumerate(bounds)
+                            if f"{start}-{end}" in journaled}
 
-    # Check if transcription data already exists
-    transcription_file_path = os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{curr_yt_id}.json")
-    if os.path.exists(transcription_file_path):
-        logger.debug(f"Transcript data already exists for: {curr_yt_id}")
-        return True
+            def on_result(idx, result):
+                journal.append(f"{bounds[idx][0]}-{bounds[idx][1]}", result)
+        results = batched_transcription.transcribe_utterances(
+            whisper_model, non_overlap_audio, bounds, batch_size=ConfigConstants.WHISPER_BATCH_SIZE, language="en",
+            done_results=done_results, on_result=on_result)
+
+    trans_data = []
+    for utter, result in zip(dia_data, results):
+        start = utter[0]['start'] * 1000  # convert to millisecond
+        end = utter[0]['end'] * 1000  # convert to millisecond
+        useful_data = {
+            'text': result['text'],
+            'language': result['language'],
+            'segment_start': f"{start}",
+            'segment_end': f"{end}",
+            'speaker': list(utter[1].values())[0]
+        }
+        if 'no_speech_prob' in result:
+            useful_data['no_speech_prob'] = result['no_speech_prob']
+        trans_data.append(useful_data)
+    if source_turns is not None:
+        for useful_data, turn_indices in zip(trans_data, source_turns):
+            useful_data['source_turns'] = turn_indices
+    return trans_data
+
+def prepare_video(curr_yt_id):
+    """
+    Download a video.
+
+    Args:
+        curr_yt_id (str): YouTube video ID
 
+    Returns:
+        str: The video ID, or None if the download failed
+    """
     # Download the video
     if not debate_utils.download_ytvid_as_wav(curr_yt_id):
         logger.debug(f"Video download failed for {curr_yt_id=}")
-        return False
+        return None
+    return curr_yt_id
 
-    # Load VAD data and remove non-speech
-    with open(os.path.join(ConfigConstants.VAD_FILE_DIR, f"{curr_yt_id}.json"), 'r') as fd:
-        vad_data = json.load(fd)
-    debate_utils.remove_non_speech(curr_yt_id, vad_data)
+@instrumentation.traced("cut")
+def cut_video(curr_yt_id, merge_turns=True, streaming=False, cache=None):
+    """
+    Get the part_2 track of a video (from the audio cache, else rebuilt from the downloaded audio)
+    and load its diarization turns.
 
-    # Load OSD data and remove overlap
-    with open(os.path.join(ConfigConstants.OSD_FILE_DIR, f"{curr_yt_id}.json"), 'r') as fd:
-        osd_data = json.load(fd)
-    debate_utils.write_non_overlap(curr_yt_id, osd_data)
+    Args:
+        curr_yt_id (str): YouTube video ID
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them
+        streaming (bool): Read the utterances from the part_2 file as they are transcribed instead
+            of decoding the track into memory
+        cache (AudioCache, optional): Cache of the audio tracks
+
+    Returns:
+        dict: video_id, audio (part_2 track, or an AudioFileReader of it when streaming), dia_data,
+            source_turns and scratch_files (files to remove once transcribed)
+    """
+    timeline_map = load_timeline_map(curr_yt_id)
+    track_params = audio_cache.get_track_params(PART_2, timeline_map)
+    # A cached track that can't be read (e.g. evicted since `prepare` checked it) is a miss
+    non_overlap_audio = None
+    if cache is not None:
+        non_overlap_audio = (cache.open_reader if streaming else cache.load)(curr_yt_id, PART_2, track_params)
+    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
+    if non_overlap_audio is None and not os.path.exists(part_0_path) and prepare_video(curr_yt_id) is None:
+        raise RuntimeError(f"Video download failed for {curr_yt_id}")
+
+    scratch_files = []
+    if non_overlap_audio is None and streaming:
+        # Cut part_2 straight out of the downloaded audio, a block at a time
+        part_2_path = os.path.join(ConfigConstants.PART_2_PATH, f"{curr_yt_id}.wav")
+        with audio_stream.AudioFileReader(part_0_path) as reader:
+            audio_stream.write_cut(reader, part_2_path, timeline_map.maps[(ORIGINAL, PART_2)].segment_map)
+        scratch_files.append(part_2_path)
+        if cache is not None:
+            cache.put_file(curr_yt_id, PART_2, track_params, part_2_path)
+        non_overlap_audio = audio_stream.AudioFileReader(part_2_path)
+    elif non_overlap_audio is None:
+        # Decode the audio once and rebuild the part_2 track in memory
+        non_overlap_audio = debate_utils.rebuild_non_overlap_audio(curr_yt_id)
+        if cache is not None:
+            cache.put(curr_yt_id, PART_2, track_params, non_overlap_audio)
 
     # Load diarization data
     with open(os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{curr_yt_id}.json"), 'r') as fd:
         dia_data = json.load(fd)
+    return make_cut_data(curr_yt_id, non_overlap_audio, dia_data, merge_turns, scratch_files)
 
-    # Clear temporary utterance files
-    files = glob.glob(os.path.join(ConfigConstants.UTTERANCES_FILE_DIR_TMP, "*"))
-    for f in files:
-        os.remove(f)
+def make_cut_data(curr_yt_id, non_overlap_audio, dia_data, merge_turns=True, scratch_files=None):
+    """
+    Put together the input of `transcribe_video` from the part_2 track and the diarization data of a
+    video (e.g. handed over in memory by the diarization stage).
 
-    # Split audio into utterances
-    audio = AudioSegment.from_wav(part_2_path)
-    wav_names = []
-    print(f"Processing {curr_yt_id} at position {curr_vid_idx}")
-    for utter in dia_data:
-        start = utter[0]['start'] * 1000  # convert to millisecond
-        end = utter[0]['end'] * 1000  # convert to millisecond
-        speaker_id = list(utter[1].values())[0]
-        name = f'{start}-{end}-{speaker_id}'
-        wav_names.append(name)
-        audio[start:end].export(os.path.join(ConfigConstants.UTTERANCES_FILE_DIR_TMP, f"{name}.wav"), format='wav')
+    Args:
+        curr_yt_id (str): YouTube video ID
+        non_overlap_audio: part_2 track (int16 audio, or an AudioFileReader of it)
+        dia_data (list): Diarization data of the track
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them
+        scratch_files (list, optional): Files to remove once transcribed
 
-    # Transcribe utterances
-    trans_data = []
-    logger.debug(f"Using whisper, now starting to transcribe {curr_yt_id}")
-    for i, wav_name in enumerate(wav_names):
-        result = whisper_model.transcribe(os.path.join(ConfigConstants.UTTERANCES_FILE_DIR_TMP, f"{wav_name}.wav"), language="en")
-        useful_data = {
-            'text': result['text'],
-            'language': result['language'],
-            'segment_start': wav_name.split('-')[0],
-            'segment_end': wav_name.split('-')[1],
-            'speaker': wav_name.split('-')[2]
-        }
-        if 'segments' in result and len(result['segments']) > 0 and 'no_speech_prob' in result['segments'][0]:
-            useful_data['no_speech_prob'] = result['segments'][0]['no_speech_prob']
-        trans_data.append(useful_data)
-        logger.debug(f"{i} wav transcribed out of {len(wav_names)}")
+    Returns:
+        dict: Same as `cut_video`
+    """
+    # Merge adjacent turns of the same speaker, keeping track of the original turns
+    source_turns = None
+    if merge_turns:
+        dia_data, source_turns = turn_consolidation.consolidate_turns(
+            dia_data, ConfigConstants.TURN_MERGE_MAX_GAP, ConfigConstants.TURN_MERGE_MAX_DURATION)
+        logger.debug(f"{sum(map(len, source_turns))} turns consolidated into {len(dia_data)}")
+
+    return {"video_id": curr_yt_id, "audio": non_overlap_audio, "dia_data": dia_data, "source_turns": source_turns,
+            "scratch_files": scratch_files or []}
+
+def transcribe_video(cut_data, whisper_model, mode=PER_UTTERANCE_MODE):
+    """
+    Transcribe the turns of a video and save its transcription data.
+
+    Args:
+        cut_data (dict): Output of `cut_video`
+        whisper_model: Loaded whisper model
+        mode (str): PER_UTTERANCE_MODE or WHOLE_TRACK_MODE
+
+    Returns:
+        list: Transcript records, as saved
+    """
+    curr_yt_id = cut_data["video_id"]
+    logger.debug(f"Using whisper ({mode}), now starting to transcribe {curr_yt_id}")
+    journal = UtteranceJournal("transcription", curr_yt_id)
+    try:
+        audio_seconds = instrumentation.get_audio_seconds(cut_data["audio"])
+        with inference_backend.inference_mode(), instrumentation.span("whisper", curr_yt_id, audio_seconds, mode=mode,
+                                                                       num_turns=len(cut_data["dia_data"])):
+            trans_data = transcribe_track(whisper_model, cut_data["audio"], cut_data["dia_data"], mode,
+                                          cut_data["source_turns"], journal)
+    finally:
+        if isinstance(cut_data["audio"], audio_stream.AudioFileReader):
+            cut_data["audio"].close()
+        for file_path in cut_data["scratch_files"]:
+            os.remove(file_path)
+    logger.debug(f"{len(trans_data)} utterances transcribed")
 
     # Save transcription data
     transcript_path = os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{curr_yt_id}.json")
-    with open(transcript_path, 'w') as f:
-        json.dump(trans_data, f, indent=2)
+    journal.compact(trans_data, transcript_path, indent=2)
+    columnar_store.store_video("transcription", curr_yt_id, trans_data)
     logger.debug(f"Transcription done for {curr_yt_id}")
 
-    # Remove intermediate files
-    for path in [part_0_path, part_1_path, part_2_path]:
-        os.remove(path)
+    # Remove intermediate files (none were downloaded if the audio cache had the part_2 track)
+    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
+    if os.path.exists(part_0_path):
+        os.remove(part_0_path)
     logger.debug(f"Removed intermediate data for {curr_yt_id}")
+    return trans_data
 
-    return True
+def process_video(curr_yt_id, curr_vid_idx, whisper_model, mode=PER_UTTERANCE_MODE, merge_turns=True):
+    """
+    Process a single video through the entire pipeline.
 
-# Main processing loop
-error_ids = []
-for curr_vid_idx, curr_yt_id in enumerate(vid_id_list):
-    try:
-        logger.info(f"Starting to process: {curr_vid_idx}/{len(vid_id_list)}: {curr_yt_id}")
-        process_video(curr_yt_id, curr_vid_idx)
-    except Exception as e:
-        logger.exception(f"Error in processing {curr_yt_id}: {e}")
+    Args:
+        curr_yt_id (str): YouTube video ID
+        curr_vid_idx (int): Index of the current video in the list
+        whisper_model: Loaded whisper model
+        mode (str): PER_UTTERANCE_MODE or WHOLE_TRACK_MODE
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them
+
+    Returns:
+        bool: True if processing was successful (or already done), False otherwise
+    """
+    print(f"Processing {curr_yt_id} at position {curr_vid_idx}")
+    return not process_videos([curr_yt_id], whisper_model, mode, merge_turns, prefetch=1)
+
+def get_params_hash(mode, merge_turns):
+    """
+    Returns:
+        str: Hash of the model and settings the transcription data is computed with
+    """
+    params = {"whisper_model": ConfigConstants.WHISPER_MODEL, "mode": mode, "merge_turns": merge_turns}
+    if ConfigConstants.INFERENCE_PRECISION != inference_backend.FP32:
+        # Kept out of the fp32 hash, so that the transcripts made before precisions existed stay done
+        params["precision"] = ConfigConstants.INFERENCE_PRECISION
+    if merge_turns:
+        params["turn_merge"] = [ConfigConstants.TURN_MERGE_MAX_GAP, ConfigConstants.TURN_MERGE_MAX_DURATION]
+    return run_manifest.make_params_hash(params)
+
+def process_videos(vid_ids, whisper_model, mode=PER_UTTERANCE_MODE, merge_turns=True,
+                   prefetch=ConfigConstants.PREFETCH_WORKERS, cut_workers=1, on_progress=None, streaming=False):
+    """
+    Transcribe the videos with a loaded whisper model, downloading and cutting the next ones while it runs.
+
+    Args:
+        vid_ids (iterable): YouTube video IDs
+        whisper_model: Loaded whisper model
+        mode (str): PER_UTTERANCE_MODE or WHOLE_TRACK_MODE
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them
+        prefetch (int): Number of videos downloaded while whisper runs
+        cut_workers (int): Number of threads decoding and cutting downloaded videos
+        on_progress (callable, optional): Called with an event dict (video_id, status and, for
+            errors, error) whenever a video is done, skipped or failed
+        streaming (bool): Read the utterances from the part_2 track on disk instead of memory
+            (per-utterance mode only)
+
+    Returns:
+        list: [video ID, error] of the videos that failed
+    """
+    if streaming and mode != PER_UTTERANCE_MODE:
+        raise ValueError(f"The streaming mode needs the {PER_UTTERANCE_MODE} transcription mode")
+    ConfigConstants.create_directories()
+    on_progress = on_progress or (lambda event: None)
+
+    # The manifest tells which videos are diarized and which are transcribed, and keeps concurrent
+    # runs off the same video
+    manifest = run_manifest.RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    manifest.sync_directory(DIARIZATION_STAGE)
+    manifest.sync_directory(STAGE)
+    params_hash = get_params_hash(mode, merge_turns)
+    # The part_2 tracks cut by the OSD+VAD stage, which spare the downloads
+    cache = audio_cache.open_cache()
+
+    error_ids = []
+
+    def prepare(curr_yt_id):
+        if not manifest.is_done(DIARIZATION_STAGE, curr_yt_id):
+            logger.debug(f"Diarization data doesn't exist for: {curr_yt_id} | hence, skipping it currently.")
+            on_progress({"video_id": curr_yt_id, "status": "skipped"})
+            return None
+        if not manifest.try_start(STAGE, curr_yt_id, params_hash):
+            logger.debug(f"Transcript data already exists (or is being computed) for: {curr_yt_id}")
+            on_progress({"video_id": curr_yt_id, "status": "skipped"})
+            return None
+        if cache is not None and cache.get_path(
+                curr_yt_id, PART_2, audio_cache.get_track_params(PART_2, load_timeline_map(curr_yt_id))):
+            return curr_yt_id
+        if prepare_video(curr_yt_id) is None:
+            raise RuntimeError(f"Video download failed for {curr_yt_id}")
+        return curr_yt_id
+
+    def consume(cut_data):
+        curr_yt_id = cut_data["video_id"]
+        transcribe_video(cut_data, whisper_model, mode)
+        manifest.mark_done(STAGE, curr_yt_id, os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{curr_yt_id}.json"),
+                           input_stages=[DIARIZATION_STAGE])
+        on_progress({"video_id": curr_yt_id, "status": "done"})
+
+    def on_error(stage_name, item, e):
+        curr_yt_id = item["video_id"] if isinstance(item, dict) else item
         error_ids.append([curr_yt_id, f"{e}"])
-        for path in [os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav"),
-                     os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav"),
-                     os.path.join(ConfigConstants.PART_2_PATH, f"{curr_yt_id}.wav")]:
-            if os.path.exists(path):
-                os.remove(path)
-
-# Clean up temporary files
-files = glob.glob(os.path.join(ConfigConstants.UTTERANCES_FILE_DIR_TMP, "*"))
-for f in files:
-    os.remove(f)
-
-logger.info("ENTIRE RAN. Done")
\ No newline at end of file
+        manifest.mark_failed(STAGE, curr_yt_id, e)
+        on_progress({"video_id": curr_yt_id, "status": "error", "error": f"{e}"})
+        for scratch_dir in [ConfigConstants.PART_0_PATH, ConfigConstants.PART_2_PATH]:
+            scratch_path = os.path.join(scratch_dir, f"{curr_yt_id}.wav")
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+    # Downloads and audio cutting run on thread pools ahead of whisper; bounded queues between the
+    # stages cap the scratch disk and RAM used by prefetched videos
+    prefetch, cut_workers = max(1, prefetch), max(1, cut_workers)
+    stages = [
+        Stage("download", prepare, prefetch, prefetch),
+        Stage("cut", lambda curr_yt_id: cut_video(curr_yt_id, merge_turns, streaming, cache), cut_workers, 1),
+    ]
+    try:
+        run_stages(vid_ids, stages, consume, on_error=on_error)
+    finally:
+        manifest.close()
+        if cache is not None:
+            cache.close()
+    return error_ids
+
+def run_videos(vid_ids, mode=PER_UTTERANCE_MODE, merge_turns=True, prefetch=ConfigConstants.PREFETCH_WORKERS,
+               cut_workers=1, streaming=False):
+    """
+    Load whisper and transcribe the videos.
+
+    Args:
+        vid_ids (iterable): YouTube video IDs
+        mode (str): PER_UTTERANCE_MODE or WHOLE_TRACK_MODE
+        merge_turns (bool): Whether to merge adjacent same-speaker turns before transcribing them
+        prefetch (int): Number of videos downloaded while whisper runs
+        cut_workers (int): Number of threads decoding and cutting downloaded videos
+        streaming (bool): Read the utterances from disk instead of memory
+
+    Returns:
+        list: [video ID, error] of the videos that failed
+    """
+    return process_videos(vid_ids, load_whisper_model(), mode, merge_turns, prefetch, cut_workers,
+                          streaming=streaming)
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe the diarized utterances of the videos.")
+    parser.add_argument("video_ids", help="YouTube ID, path to a JSON list of IDs or data/video_details.json")
+    parser.add_argument("--mode", choices=[PER_UTTERANCE_MODE, WHOLE_TRACK_MODE], default=PER_UTTERANCE_MODE)
+    parser.add_argument("--no-turn-merging", action="store_true",
+                        help="Transcribe every diarization turn separately, without merging same-speaker turns")
+    parser.add_argument("--prefetch", type=int, default=ConfigConstants.PREFETCH_WORKERS,
+                        help="Number of videos downloaded while whisper runs")
+    parser.add_argument("--cut-workers", type=int, default=1,
+                        help="Number of threads decoding and cutting downloaded videos")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes, each holding its own whisper model")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch threads of every worker (default: cores / workers)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Cut the part_2 track to disk and read the utterances from there, so that memory "
+                             "stays flat with the length of the videos (per_utterance mode only)")
+    args = parser.parse_args()
+    if args.streaming and args.mode != PER_UTTERANCE_MODE:
+        parser.error(f"--streaming needs --mode {PER_UTTERANCE_MODE}")
+
+    # Load video IDs
+    vid_id_list = load_video_ids(args.video_ids)
+
+    run_fn = functools.partial(run_videos, mode=args.mode, merge_turns=not args.no_turn_merging,
+                               prefetch=args.prefetch, cut_workers=args.cut_workers, streaming=args.streaming)
+    if args.workers > 1:
+        error_ids = worker_pool.run_workers(vid_id_list, args.workers, run_fn, args.threads_per_worker)
+    else:
+        if args.threads_per_worker is not None:
+            inference_backend.configure_threads(args.threads_per_worker, 1, pin=True)
+        error_ids = run_fn(vid_id_list)
+
+    logger.info(f"Errors in {len(error_ids)} videos: {error_ids}")
+    logger.info("ENTIRE RAN. Done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+def get_speaker(utter):
+    """
+    Get the speaker label of a diarization turn.
+
+    Args:
+        utter (list): Diarization turn: [{"start", "end"}, {track: speaker}]
+
+    Returns:
+        str: Speaker label (e.g. SPEAKER_00)
+    """
+    return list(utter[1].values())[0]
+
+
+def consolidate_turns(dia_data, max_gap, max_duration):
+    """
+    Merge consecutive diarization turns of the same speaker.
+
+    A turn is merged into the previous (possibly already merged) turn when both have the same
+    speaker, the silence between them is at most `max_gap` and the merged turn would not be longer
+    than `max_duration`.
+
+    Args:
+        dia_data (list): Diarization data sorted by time: [{"start", "end"}, {track: speaker}] pairs
+        max_gap (float): Largest gap (in seconds) bridged by a merge
+        max_duration (float): Longest merged turn (in seconds)
+
+    Returns:
+        tuple: Merged diarization data (same format) and, for every merged turn, the indices of the
+            original turns it covers.
+    """
+    merged_turns, source_turns = [], []
+    for idx, utter in enumerate(dia_data):
+        if merged_turns:
+            last_turn = merged_turns[-1]
+            if (get_speaker(last_turn) == get_speaker(utter)
+                    and utter[0]['start'] - last_turn[0]['end'] <= max_gap
+                    and utter[0]['end'] - last_turn[0]['start'] <= max_duration):
+                last_turn[0]['end'] = max(last_turn[0]['end'], utter[0]['end'])
+                source_turns[-1].append(idx)
+                continue
+        merged_turns.append([{'start': utter[0]['start'], 'end': utter[0]['end']}, dict(utter[1])])
+        source_turns.append([idx])
+    return merged_turns, source_turns
@@ -0,0 +1,94 @@
+import numpy as np
+from ..tv_debs_utils import debate_utils
+
+# get a logger to use
+logger = debate_utils.get_logger()
+
+
+def build_turn_index(dia_data):
+    """
+    Build a sorted-array interval index over diarization turns.
+
+    Args:
+        dia_data (list): Diarization data, as saved by the OSD/VAD pipeline: [{"start", "end"}, {track: speaker}] pairs.
+
+    Returns:
+        dict: Sorted turn starts and ends (seconds), and for every turn the latest end (and its
+            turn) among the turns starting at or before it.
+    """
+    starts = np.array([utter[0]['start'] for utter in dia_data], dtype=np.float64)
+    ends = np.array([utter[0]['end'] for utter in dia_data], dtype=np.float64)
+    order = np.argsort(starts, kind='stable')
+    prefix_max_end = np.maximum.accumulate(ends[order]) if len(order) else ends
+    is_new_max = ends[order] == prefix_max_end
+    prefix_max_turn = order[np.maximum.accumulate(np.where(is_new_max, np.arange(len(order)), 0))]
+    return {
+        "order": order,
+        "starts": starts[order],
+        "ends": ends[order],
+        "prefix_max_end": prefix_max_end,
+        "prefix_max_turn": prefix_max_turn,
+    }
+
+
+def assign_times_to_turns(turn_index, times):
+    """
+    Find the diarization turn each timestamp belongs to, with one binary search per timestamp.
+
+    A timestamp inside one or more turns goes to one of the turns containing it; a timestamp
+    between turns goes to the closest turn.
+
+    Args:
+        turn_index (dict): Index returned by `build_turn_index`.
+        times (np.ndarray): Timestamps in seconds.
+
+    Returns:
+        np.ndarray: Index (into the diarization data) of the turn of every timestamp.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    order, starts, ends = turn_index["order"], turn_index["starts"], turn_index["ends"]
+    num_turns = len(order)
+
+    # Last turn starting at or before each timestamp
+    pos = np.searchsorted(starts, times, side='right') - 1
+    prev_pos = np.clip(pos, 0, num_turns - 1)
+    next_pos = np.clip(pos + 1, 0, num_turns - 1)
+
+    in_last_turn = (pos >= 0) & (times < ends[prev_pos])
+    in_earlier_turn = (pos >= 0) & (times < turn_index["prefix_max_end"][prev_pos])
+
+    # Otherwise, the closest of the turn ending last before the timestamp and the next turn
+    dist_prev = np.where(pos >= 0, times - turn_index["prefix_max_end"][prev_pos], np.inf)
+    dist_next = np.where(pos + 1 < num_turns, starts[next_pos] - times, np.inf)
+    closest = np.where(dist_prev <= dist_next, turn_index["prefix_max_turn"][prev_pos], order[next_pos])
+
+    return np.where(in_last_turn, order[prev_pos],
+                    np.where(in_earlier_turn, turn_index["prefix_max_turn"][prev_pos], closest))
+
+
+def transcribe_whole_track(whisper_model, audio, dia_data, language="en"):
+    """
+    Transcribe the whole overlap-free track in one whisper run and split the words over the diarization turns.
+
+    Args:
+        whisper_model: Loaded whisper model.
+        audio (np.ndarray): int16 audio samples of the part_2 track, sampled at `debate_utils.sr`.
+        dia_data (list): Diarization data of the same track.
+        language (str): Language of the audio.
+
+    Returns:
+        list: One dict per diarization turn (in order) with text and language.
+    """
+    # fp16 only on GPU: on CPU whisper would warn and fall back to fp32 anyway
+    result = whisper_model.transcribe(debate_utils.to_float32(audio), language=language, word_timestamps=True,
+                                      fp16=whisper_model.device.type != "cpu")
+    words = [word for segment in result['segments'] for word in segment.get('words', [])]
+    logger.debug(f"{len(words)} words transcribed over {len(dia_data)} turns")
+
+    turn_texts = [[] for _ in dia_data]
+    if len(words) and len(dia_data):
+        word_middles = np.array([(word['start'] + word['end']) / 2 for word in words])
+        for word, turn_idx in zip(words, assign_times_to_turns(build_turn_index(dia_data), word_middles)):
+            turn_texts[turn_idx].append(word['word'])
+
+    return [{'text': "".join(texts), 'language': result['language']} for texts in turn_texts]
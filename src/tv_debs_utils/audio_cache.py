@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
+from ..config_constants import ConfigConstants
+from . import debate_utils, audio_stream
+# Tracks are named after their timeline: the downloaded audio (ORIGINAL) and its two cuts (PART_1, PART_2)
+from .timeline_map import ORIGINAL
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    track TEXT NOT NULL,
+    params TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entries_video_id ON entries (video_id);
+"""
+
+
+def make_key(video_id, track, params):
+    """
+    Key of a track: the hash of the video, the track and the parameters it was produced with.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    return hashlib.sha256(json.dumps([video_id, track, params], sort_keys=True).encode()).hexdigest()
+
+
+def whole_track_map(num_samples):
+    return debate_utils.build_segment_map(np.array([[0, num_samples]], dtype=np.int64))
+
+
+def get_track_params(track, timeline_map=None):
+    """
+    Parameters a track of a video is produced with: the decoding format of the downloaded audio,
+    plus the cut (segment map) for part_1 and part_2, so that new VAD/OSD data gives new keys.
+
+    Args:
+        track (str): ORIGINAL, PART_1 or PART_2.
+        timeline_map (TimelineMap, optional): Timeline map of the video (for PART_1 and PART_2).
+
+    Returns:
+        dict: JSON-serializable parameters.
+    """
+    params = {"sample_rate": debate_utils.sr, "channels": 1}
+    if track != ORIGINAL:
+        segment_map = np.ascontiguousarray(timeline_map.maps[(ORIGINAL, track)].segment_map, dtype=np.int64)
+        params["segment_map"] = hashlib.sha256(segment_map.tobytes()).hexdigest()[:16]
+    return params
+
+
+class AudioCache:
+    """
+    Persistent cache of the 16 kHz mono audio tracks of the videos, as FLAC files named after their
+    key, so that later stages and reruns read them locally instead of downloading and cutting the
+    videos again.
+
+    The total size is kept under `max_bytes` by evicting the least recently used files. An SQLite
+    index (shared by the workers) records the size and last access of every file.
+
+    Args:
+        cache_dir (str): Folder of the cache.
+        max_bytes (int): Size above which the least recently used files are evicted.
+    """
+
+    def __init__(self, cache_dir=ConfigConstants.AUDIO_CACHE_DIR, max_bytes=ConfigConstants.AUDIO_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=60, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def get_file_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.flac")
+
+    def get_path(self, video_id, track, params):
+        """
+        Get the cached file of a track, and mark it as used.
+
+        Returns:
+            str: Path of the FLAC file, or None if the track isn't cached.
+        """
+        key = make_key(video_id, track, params)
+        file_path = self.get_file_path(key)
+        with self.lock:
+            if not os.path.exists(file_path):
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return file_path
+
+    def _discard(self, video_id, track, params, e):
+        # A cached file that can't be read (corrupt, or evicted by another worker since `get_path`) is a miss
+        logger.warning(f"Error while reading the cached {track} track of {video_id}, treated as a miss: {e}")
+        key = make_key(video_id, track, params)
+        file_path = self.get_file_path(key)
+        with self.lock:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def load(self, video_id, track, params):
+        """
+        Decode a cached track.
+
+        Returns:
+            np.ndarray: 1-D int16 samples, or None if the track isn't cached (or can't be read).
+        """
+        import soundfile as sf
+
+        file_path = self.get_path(video_id, track, params)
+        if file_path is None:
+            return None
+        try:
+            return sf.read(file_path, dtype='int16')[0]
+        except Exception as e:
+            self._discard(video_id, track, params, e)
+            return None
+
+    def open_reader(self, video_id, track, params):
+        """
+        Open a cached track for streaming; once open, it stays readable even if the file is evicted.
+
+        Returns:
+            AudioFileReader: Reader of the track, or None if the track isn't cached (or can't be read).
+        """
+        file_path = self.get_path(video_id, track, params)
+        if file_path is None:
+            return None
+        try:
+            return audio_stream.AudioFileReader(file_path)
+        except Exception as e:
+            self._discard(video_id, track, params, e)
+            return None
+
+    def _add(self, video_id, track, params, write_fn):
+        # Errors are logged: the cache only saves work, the stages don't rely on it
+        key = make_key(video_id, track, params)
+        file_path = self.get_file_path(key)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            # write_fn writes under a temporary name, so that readers never see a partial file
+            write_fn(file_path)
+        except Exception as e:
+            logger.exception(f"Error while caching the {track} track of {video_id}: {e}")
+            return None
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, video_id, track, params, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, video_id, track, json.dumps(params, sort_keys=True), os.path.getsize(file_path), now, now))
+        self.evict()
+        return file_path
+
+    def put(self, video_id, track, params, audio):
+        """
+        Cache the in-memory samples of a track.
+
+        Args:
+            video_id (str): YouTube video ID.
+            track (str): ORIGINAL, PART_1 or PART_2.
+            params (dict): Output of `get_track_params`.
+            audio (np.ndarray): 1-D int16 samples sampled at `debate_utils.sr`.
+
+        Returns:
+            str: Path of the cached file, or None if it couldn't be written.
+        """
+        import soundfile as sf
+
+        def write(file_path):
+            tmp_path = f"{file_path}.tmp"
+            sf.write(tmp_path, audio, debate_utils.sr, subtype='PCM_16', format='FLAC')
+            os.replace(tmp_path, file_path)
+
+        return self._add(video_id, track, params, write)
+
+    def put_segments(self, video_id, track, params, reader, segment_map):
+        """
+        Cache a track cut out of an audio file, streamed a block at a time.
+
+        Args:
+            reader (AudioFileReader): Source audio.
+            segment_map (np.ndarray): Segments of the source to keep (all of it for ORIGINAL).
+
+        Returns:
+            str: Path of the cached file, or None if it couldn't be written.
+        """
+        return self._add(video_id, track, params,
+                         lambda file_path: audio_stream.write_cut(reader, file_path, segment_map, file_format='FLAC'))
+
+    def put_file(self, video_id, track, params, wav_path):
+        """
+        Cache a whole audio file (e.g. a downloaded part_0 WAV), streamed a block at a time.
+
+        Returns:
+            str: Path of the cached file, or None if it couldn't be written.
+        """
+        def write(file_path):
+            with audio_stream.AudioFileReader(wav_path) as reader:
+                audio_stream.write_cut(reader, file_path, whole_track_map(len(reader)), file_format='FLAC')
+
+        return self._add(video_id, track, params, write)
+
+    def restore_file(self, video_id, track, params, wav_path):
+        """
+        Write a cached track to a WAV file, streamed a block at a time.
+
+        Returns:
+            bool: Whether the track was cached (and could be read).
+        """
+        reader = self.open_reader(video_id, track, params)
+        if reader is None:
+            return False
+        try:
+            with reader:
+                audio_stream.write_cut(reader, wav_path, whole_track_map(len(reader)))
+        except Exception as e:
+            if os.path.exists(f"{wav_path}.tmp"):
+                os.remove(f"{wav_path}.tmp")
+            self._discard(video_id, track, params, e)
+            return False
+        return True
+
+    def total_size(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """
+        Delete the least recently used files until the cache fits in `max_bytes`. Files being read
+        stay readable until they are closed.
+
+        Returns:
+            int: Number of files deleted.
+        """
+        num_evicted = 0
+        with self.lock:
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return 0
+            for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+                if total_size <= self.max_bytes:
+                    break
+                file_path = self.get_file_path(key)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total_size -= size
+                num_evicted += 1
+        logger.debug(f"{num_evicted} files evicted from the audio cache")
+        return num_evicted
+
+    def summary(self):
+        """
+        Returns:
+            dict: For every track, the number of files and their size in bytes.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT track, COUNT(*), SUM(size) FROM entries GROUP BY track").fetchall()
+        return {track: {"files": count, "bytes": size} for track, count, size in rows}
+
+    def close(self):
+        self.connection.close()
+
+
+def open_cache():
+    """
+    Open the audio cache, unless it's disabled (AUDIO_CACHE=0).
+
+    Returns:
+        AudioCache: The cache, or None.
+    """
+    if not ConfigConstants.AUDIO_CACHE:
+        return None
+    return AudioCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent cache of the audio tracks of the videos.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("summary", help="Print the number of files and size of every track")
+    evict_parser = subparsers.add_parser("evict", help="Evict the least recently used files")
+    evict_parser.add_argument("--max-gb", type=float, default=None,
+                              help="Size to shrink the cache to (default: AUDIO_CACHE_MAX_GB)")
+    args = parser.parse_args()
+
+    cache = AudioCache()
+    if args.command == "evict":
+        if args.max_gb is not None:
+            cache.max_bytes = int(args.max_gb * 1024 ** 3)
+        cache.evict()
+    print(json.dumps(cache.summary(), indent=1))
+    print(f"Total: {cache.total_size() / 1024 ** 3:.2f} GB out of {cache.max_bytes / 1024 ** 3:.2f} GB")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Samples read or written at once when streaming cut audio to a file (one minute)
+BLOCK_SAMPLES = 60 * debate_utils.sr
+
+
+class AudioFileReader:
+    """
+    Random access to the samples of a canonical (16 kHz mono int16) WAV file, read from disk on
+    every access, so that the memory used doesn't grow with the length of the audio.
+
+    Slicing (`reader[start:end]`) returns an int16 array like slicing the decoded buffer would,
+    so the reader can stand in for the audio buffer of functions that only slice it.
+
+    Args:
+        file_path (str): Path of the WAV file.
+    """
+
+    def __init__(self, file_path):
+        import soundfile as sf
+
+        self.file_path = file_path
+        self.fd = sf.SoundFile(file_path)
+        if self.fd.samplerate != debate_utils.sr or self.fd.channels != 1:
+            self.fd.close()
+            raise ValueError(f"{file_path} is {self.fd.samplerate} Hz with {self.fd.channels} channel(s), streaming "
+                             f"needs {debate_utils.sr} Hz mono audio")
+        self.num_samples = self.fd.frames
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("AudioFileReader only supports contiguous slices")
+        start, stop, _ = key.indices(self.num_samples)
+        self.fd.seek(start)
+        return self.fd.read(max(0, stop - start), dtype='int16')
+
+    def iter_blocks(self, start, end, block_samples=BLOCK_SAMPLES):
+        """
+        Yield the samples in [start, end) in blocks of at most `block_samples`.
+        """
+        for block_start in range(start, end, block_samples):
+            yield self[block_start:min(end, block_start + block_samples)]
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_cut(reader, save_path, segment_map, block_samples=BLOCK_SAMPLES, file_format='WAV'):
+    """
+    Stream the kept segments of an audio file to an int16 audio file, a block at a time.
+
+    Args:
+        reader (AudioFileReader): Source audio.
+        save_path (str): Path of the file to write; written under a temporary name first.
+        segment_map (np.ndarray): Mapping returned by `debate_utils.build_segment_map`.
+        block_samples (int): Maximum number of samples held in memory.
+        file_format (str): 'WAV' or 'FLAC'.
+    """
+    import soundfile as sf
+
+    tmp_path = f"{save_path}.tmp"
+    with sf.SoundFile(tmp_path, 'w', samplerate=debate_utils.sr, channels=1, subtype='PCM_16',
+                      format=file_format) as fd:
+        for start, end, _ in segment_map:
+            for block in reader.iter_blocks(int(start), int(end), block_samples):
+                fd.write(block)
+    os.replace(tmp_path, save_path)
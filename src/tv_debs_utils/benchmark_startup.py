@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Libraries that must only be imported once a stage needs them
+HEAVY_MODULES = ["torch", "torchaudio", "pyannote", "whisper", "librosa", "pytubefix", "pydub", "soundfile"]
+
+# Run in a fresh interpreter: imports the module and reports the heavy modules it loaded
+IMPORT_PROBE = """
+import sys, json, time, importlib
+start_time = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start_time
+heavy = sorted({name.split('.')[0] for name in sys.modules} & set(sys.argv[2].split(',')))
+print(json.dumps({"import_seconds": elapsed, "heavy_modules": heavy}))
+"""
+
+ProjectDir = os.path.join(os.path.dirname(__file__), '../../')
+
+# Line marking a module run with `python -m`
+MAIN_GUARD = 'if __name__ == "__main__":'
+
+
+def discover_entry_points():
+    """
+    Find the entry points whose startup is measured: every module under src/ with a main guard, so
+    that new command line tools are checked without being registered.
+
+    Returns:
+        list: Sorted dotted names of the modules (this one excluded).
+    """
+    src_dir = os.path.join(ProjectDir, "src")
+    entry_points = []
+    for dir_path, _, file_names in os.walk(src_dir):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            if not file_name.endswith(".py") or os.path.samefile(file_path, __file__):
+                continue
+            with open(file_path) as fd:
+                if not any(line.rstrip() == MAIN_GUARD for line in fd):
+                    continue
+            module_path = os.path.relpath(file_path, ProjectDir)[:-len(".py")]
+            entry_points.append(module_path.replace(os.sep, "."))
+    return sorted(entry_points)
+
+
+def measure_startup(module):
+    """
+    Measure the startup cost of an entry point, each in a fresh interpreter.
+
+    Args:
+        module (str): Dotted name of the entry point.
+
+    Returns:
+        dict: import_seconds, heavy_modules (loaded by the import) and help_seconds (`python -m module --help`).
+    """
+    probe = subprocess.run([sys.executable, "-c", IMPORT_PROBE, module, ",".join(HEAVY_MODULES)],
+                           cwd=ProjectDir, capture_output=True, text=True)
+    if probe.returncode != 0:
+        return {"error": probe.stderr.strip().splitlines()[-1]}
+    result = json.loads(probe.stdout.strip().splitlines()[-1])
+
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, "-m", module, "--help"], cwd=ProjectDir, capture_output=True)
+    result["help_seconds"] = time.perf_counter() - start_time
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the entry points start fast and import no model library.")
+    parser.add_argument("--max-seconds", type=float, default=2.0,
+                        help="Largest allowed `--help` time of an entry point")
+    parser.add_argument("--output", default=None, help="JSON file to save the measurements to")
+    parser.add_argument("--modules", nargs="+", default=None,
+                        help="Dotted names of the entry points to check (default: every module with a main guard)")
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for module in args.modules or discover_entry_points():
+        results[module] = measure_startup(module)
+        result = results[module]
+        print(f"{module}: {json.dumps(result)}")
+        if "error" in result:
+            failures.append(f"{module} can't be imported: {result['error']}")
+            continue
+        if result["heavy_modules"]:
+            failures.append(f"{module} imports {result['heavy_modules']} at import time")
+        if result["help_seconds"] > args.max_seconds:
+            failures.append(f"{module} --help took {result['help_seconds']:.2f}s (> {args.max_seconds}s)")
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import json
+import argparse
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Stages stored, with the folder of their JSON files
+STAGE_DIRECTORIES = {
+    "vad": "VAD_FILE_DIR",
+    "osd": "OSD_FILE_DIR",
+    "diarization": "DIARIZATION_FILE_DIR",
+    "transcription": "TRANSCRIPT_FILE_DIR",
+    "perspective": "PERSPECTIVE_FILE_DIR",
+}
+
+# Perspective attributes (perspective_client.REQUESTED_ATTRIBUTES), stored as <attribute> (summary
+# score) and <attribute>_spans columns
+PERSPECTIVE_ATTRIBUTES = ['TOXICITY', 'SEVERE_TOXICITY', 'IDENTITY_ATTACK', 'THREAT', 'INSULT', 'PROFANITY']
+
+PARTITION_COLUMN = "video_id"
+
+
+def _categorical():
+    import pyarrow as pa
+
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def get_schema(stage):
+    """
+    Get the typed schema of a stage (without the video_id partition column).
+
+    Args:
+        stage (str): Name of the stage.
+
+    Returns:
+        pyarrow.Schema: Schema of the stage.
+    """
+    import pyarrow as pa
+
+    if stage in ("vad", "osd"):
+        return pa.schema([("start", pa.float32()), ("end", pa.float32())])
+    if stage == "diarization":
+        return pa.schema([("start", pa.float32()), ("end", pa.float32()), ("track", pa.string()),
+                          ("speaker", _categorical())])
+    transcript_fields = [("turn", pa.int32()), ("start", pa.float32()), ("end", pa.float32()),
+                         ("speaker", _categorical()), ("text", pa.string()), ("language", _categorical()),
+                         ("no_speech_prob", pa.float32()), ("source_turns", pa.list_(pa.int32()))]
+    if stage == "transcription":
+        return pa.schema(transcript_fields)
+    span_type = pa.list_(pa.struct([("begin", pa.int32()), ("end", pa.int32()), ("score", pa.float32())]))
+    return pa.schema(transcript_fields
+                     + [(attribute.lower(), pa.float32()) for attribute in PERSPECTIVE_ATTRIBUTES]
+                     + [(f"{attribute.lower()}_spans", span_type) for attribute in PERSPECTIVE_ATTRIBUTES])
+
+
+def _transcript_columns(records):
+    return {
+        "turn": list(range(len(records))),
+        # segment_start/segment_end are saved as millisecond strings
+        "start": [float(record["segment_start"]) / 1000 for record in records],
+        "end": [float(record["segment_end"]) / 1000 for record in records],
+        "speaker": [record["speaker"] for record in records],
+        "text": [record["text"] for record in records],
+        "language": [record.get("language") for record in records],
+        "no_speech_prob": [record.get("no_speech_prob") for record in records],
+        "source_turns": [record.get("source_turns") for record in records],
+    }
+
+
+def build_table(stage, data):
+    """
+    Convert the JSON data of one video for a stage into a typed table.
+
+    Args:
+        stage (str): Name of the stage.
+        data (list): Data as saved in the stage's JSON file.
+
+    Returns:
+        pyarrow.Table: One row per segment, turn or utterance.
+    """
+    import pyarrow as pa
+
+    if stage in ("vad", "osd"):
+        columns = {"start": [segment[0] for segment in data], "end": [segment[1] for segment in data]}
+    elif stage == "diarization":
+        # [segment, {track: speaker}] pairs; a segment may hold several tracks
+        rows = [(segment["start"], segment["end"], track, speaker)
+                for segment, tracks in data for track, speaker in tracks.items()]
+        columns = {"start": [row[0] for row in rows], "end": [row[1] for row in rows],
+                   "track": [row[2] for row in rows], "speaker": [row[3] for row in rows]}
+    elif stage == "transcription":
+        columns = _transcript_columns(data)
+    else:
+        columns = _transcript_columns(data)
+        for attribute in PERSPECTIVE_ATTRIBUTES:
+            scores, spans = [], []
+            for record in data:
+                attribute_score = record.get("perspective", {}).get("attributeScores", {}).get(attribute)
+                if attribute_score is None:
+                    scores.append(None)
+                    spans.append([])
+                    continue
+                scores.append(attribute_score["summaryScore"]["value"])
+                spans.append([{"begin": span.get("begin", 0), "end": span.get("end", 0),
+                               "score": span["score"]["value"]} for span in attribute_score.get("spanScores", [])])
+            columns[attribute.lower()] = scores
+            columns[f"{attribute.lower()}_spans"] = spans
+    return pa.Table.from_pydict(columns, schema=get_schema(stage))
+
+
+def get_partition_dir(stage, video_id):
+    return os.path.join(ConfigConstants.COLUMNAR_STORE_DIR, stage, f"{PARTITION_COLUMN}={video_id}")
+
+
+def write_video(stage, video_id, data):
+    """
+    Append (or replace) the partition of one video in the store of a stage.
+
+    Every video is its own Parquet file, written atomically, so stages append videos as they finish.
+
+    Args:
+        stage (str): Name of the stage.
+        video_id (str): YouTube video ID.
+        data (list): Data as saved in the stage's JSON file.
+    """
+    import pyarrow.parquet as pq
+
+    # Written next to the partitions (hidden from the dataset), so that a failed write leaves no partition folder
+    stage_dir = os.path.join(ConfigConstants.COLUMNAR_STORE_DIR, stage)
+    os.makedirs(stage_dir, exist_ok=True)
+    tmp_path = os.path.join(stage_dir, f".{video_id}.parquet.tmp")
+    pq.write_table(build_table(stage, data), tmp_path, compression="zstd")
+    partition_dir = get_partition_dir(stage, video_id)
+    os.makedirs(partition_dir, exist_ok=True)
+    os.replace(tmp_path, os.path.join(partition_dir, "part-0.parquet"))
+
+
+def store_video(stage, video_id, data):
+    """
+    Write a video to the store of a stage if the store is enabled; errors are logged, the JSON
+    output of the stage is what the pipelines rely on.
+    """
+    if not ConfigConstants.COLUMNAR_STORE:
+        return
+    try:
+        write_video(stage, video_id, data)
+    except Exception as e:
+        logger.exception(f"Error while writing {video_id} to the {stage} store: {e}")
+
+
+def open_dataset(stage):
+    """
+    Open the store of a stage as a dataset partitioned by video.
+
+    Args:
+        stage (str): Name of the stage.
+
+    Returns:
+        pyarrow.dataset.Dataset: Dataset with a video_id column.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive")
+    return ds.dataset(os.path.join(ConfigConstants.COLUMNAR_STORE_DIR, stage), format="parquet",
+                      schema=get_schema(stage).append(pa.field(PARTITION_COLUMN, pa.string())),
+                      partitioning=partitioning, exclude_invalid_files=False)
+
+
+def read_stage(stage, columns=None, video_ids=None, filter=None):
+    """
+    Read the store of a stage. Only the requested columns are decoded, and the filters are pushed
+    down: the partitions of other videos are never opened, and row groups are skipped using their
+    statistics.
+
+    Args:
+        stage (str): Name of the stage.
+        columns (list, optional): Columns to read (all by default).
+        video_ids (list, optional): Videos to read (all by default).
+        filter (pyarrow.compute.Expression, optional): Row filter, e.g. `pc.field("toxicity") > 0.5`.
+
+    Returns:
+        pyarrow.Table: Requested rows and columns.
+    """
+    import pyarrow.dataset as ds
+
+    expression = None
+    if video_ids is not None:
+        expression = ds.field(PARTITION_COLUMN).isin(list(video_ids))
+    if filter is not None:
+        expression = filter if expression is None else expression & filter
+    return open_dataset(stage).to_table(columns=columns, filter=expression)
+
+
+def stored_video_ids(stage):
+    stage_dir = os.path.join(ConfigConstants.COLUMNAR_STORE_DIR, stage)
+    if not os.path.isdir(stage_dir):
+        return set()
+    prefix = f"{PARTITION_COLUMN}="
+    # Only the partitions holding their file (a folder may be left empty by an older failed write)
+    return {name[len(prefix):] for name in os.listdir(stage_dir)
+            if name.startswith(prefix) and os.path.exists(os.path.join(stage_dir, name, "part-0.parquet"))}
+
+
+def convert_stage(stage, overwrite=False):
+    """
+    Import the JSON files of a stage into its store.
+
+    Args:
+        stage (str): Name of the stage.
+        overwrite (bool): Convert the videos already in the store again.
+
+    Returns:
+        int: Number of videos converted.
+    """
+    json_dir = getattr(ConfigConstants, STAGE_DIRECTORIES[stage])
+    done = set() if overwrite else stored_video_ids(stage)
+    num_converted = 0
+    for file_name in sorted(os.listdir(json_dir)):
+        video_id = file_name[:-len(".json")]
+        if not file_name.endswith(".json") or video_id in done:
+            continue
+        try:
+            with open(os.path.join(json_dir, file_name)) as fd:
+                write_video(stage, video_id, json.load(fd))
+            num_converted += 1
+        except Exception as e:
+            logger.exception(f"Error while converting {file_name} of {stage}: {e}")
+    logger.info(f"{num_converted} {stage} files converted")
+    return num_converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar (Parquet) store of the stage outputs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Import the existing JSON files")
+    stages_help = f"Stages, among {', '.join(STAGE_DIRECTORIES)} (default: all)"
+    convert_parser.add_argument("stages", nargs="*", metavar="stage", help=stages_help)
+    convert_parser.add_argument("--overwrite", action="store_true", help="Convert the videos already stored again")
+    info_parser = subparsers.add_parser("info", help="Print the number of videos and rows of every stage")
+    info_parser.add_argument("stages", nargs="*", metavar="stage", help=stages_help)
+    args = parser.parse_args()
+    unknown = [stage for stage in args.stages if stage not in STAGE_DIRECTORIES]
+    if unknown:
+        parser.error(f"unknown stages {unknown} (choose from {', '.join(STAGE_DIRECTORIES)})")
+    args.stages = args.stages or list(STAGE_DIRECTORIES)
+
+    ConfigConstants.create_directories()
+    for stage in args.stages:
+        if args.command == "convert":
+            convert_stage(stage, args.overwrite)
+        else:
+            num_videos = len(stored_video_ids(stage))
+            num_rows = open_dataset(stage).count_rows() if num_videos else 0
+            print(f"{stage}: {num_videos} videos, {num_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
 import time
 import os
-import librosa
-from pytubefix import YouTube
-import torch
-import soundfile as sf
-from pydub import AudioSegment
+import json
+import glob
+import numpy as np
 import logging
 from ..config_constants import ConfigConstants
+from . import instrumentation
+
+# torch, librosa, soundfile, pydub and pytubefix are imported by the functions using them, so that
+# importing this module (e.g. for `--help` or a resume check) doesn't load them
 
 # Constants for audio processing
 sr = 16000  # sample rate
@@ -26,6 +28,9 @@ def get_logger():
     timestamp_epoch = int(time.time())
     logger = logging.getLogger(__name__+str(timestamp_epoch))
     logger.setLevel(logging.DEBUG)
+    # Modules imported within the same second share the logger: only the first one adds the handler
+    if logger.handlers:
+        return logger
 
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
@@ -43,14 +48,20 @@ logger = get_logger()
 
 def force_cudnn_initialization():
     """
-    Force CUDA initialization by performing a dummy operation.
+    Force CUDA initialization by performing a dummy operation. Does nothing on machines without CUDA.
     """
+    import torch
+
+    if not torch.cuda.is_available():
+        logger.debug("No CUDA device, skipping the CUDA initialization")
+        return
     logger.debug("Force Cuda initialization")
     s = 32
     dev = torch.device('cuda')
     torch.nn.functional.conv2d(torch.zeros(
         s, s, s, s, device=dev), torch.zeros(s, s, s, s, device=dev))
 
+@instrumentation.traced("download")
 def download_ytvid_as_wav(video_id: str) -> bool:
     """
     Download a YouTube video as a WAV file.
@@ -61,6 +72,9 @@ def download_ytvid_as_wav(video_id: str) -> bool:
     Returns:
         bool: True if download was successful (or if video was already present), False otherwise.
     """
+    from pytubefix import YouTube
+    from pydub import AudioSegment
+
     logger.info(f"video with id: {video_id} download started.")
     expected_download_path = os.path.join(
         ConfigConstants.PART_0_PATH, f"{video_id}.wav")
@@ -72,29 +86,53 @@ def download_ytvid_as_wav(video_id: str) -> bool:
         logger.debug(f"Wav file for Video with id: {video_id=} already exists.")
         return True
 
+    # Or if an earlier run (or stage) left it in the audio cache
+    from . import audio_cache
+
+    cache = audio_cache.open_cache()
+    track_params = audio_cache.get_track_params(audio_cache.ORIGINAL)
+
     # Constructing the YouTube video URL using the provided video ID
     video_url = f"https://www.youtube.com/watch?v={video_id}"
 
     try:
-        # Creating a YouTube object by passing the video URL
-        yt = YouTube(video_url)
-        result = yt.streams.filter(adaptive=True, only_audio=True).first()
-
-        # Checking if the video has all its fragments available
-        if result is None:
-            raise ValueError("All video fragments are not available.")
-
-        # Download and convert the video
-        out_file = result.download(
-            output_path=ConfigConstants.MP3_FILE_DIR, filename=f'{video_id}.mp4')
+        if cache is not None and cache.restore_file(video_id, audio_cache.ORIGINAL, track_params,
+                                                    expected_download_path):
+            logger.info(f"video with id: {video_id} restored from the audio cache.")
+            return True
+
+        # A local media file (e.g. for testing) replaces the download when LOCAL_AUDIO_DIR is set
+        local_files = glob.glob(os.path.join(ConfigConstants.LOCAL_AUDIO_DIR, f"{video_id}.*")) \
+            if ConfigConstants.LOCAL_AUDIO_DIR else []
+        if local_files:
+            out_file = local_files[0]
+        else:
+            # Creating a YouTube object by passing the video URL
+            yt = YouTube(video_url)
+            result = yt.streams.filter(adaptive=True, only_audio=True).first()
+
+            # Checking if the video has all its fragments available
+            if result is None:
+                raise ValueError("All video fragments are not available.")
+
+            # Download the video
+            out_file = result.download(
+                output_path=ConfigConstants.MP3_FILE_DIR, filename=f'{video_id}.mp4')
         original_extension = out_file.split('.')[-1]
+        # Let ffmpeg downmix and resample while decoding, so the WAV on disk already is the
+        # canonical 16 kHz mono int16 buffer that every later stage reads
         mp3_converted_file = AudioSegment.from_file(
-            out_file, original_extension)
-        mp3_converted_file.export(
-            expected_download_path, format='wav', bitrate="192k")
+            out_file, original_extension, parameters=["-ac", "1", "-ar", str(sr)])
+        # Export under a temporary name, so an interrupted export is never mistaken for a download
+        tmp_download_path = f"{expected_download_path}.tmp"
+        mp3_converted_file.set_sample_width(2).export(
+            tmp_download_path, format='wav')
+        os.replace(tmp_download_path, expected_download_path)
+        if cache is not None:
+            cache.put_file(video_id, audio_cache.ORIGINAL, track_params, expected_download_path)
 
         # Clean up temporary files
-        for file_path in [mp3_path, out_file, mp4_path]:
+        for file_path in [mp3_path, mp4_path] + ([] if local_files else [out_file]):
             if os.path.exists(file_path):
                 os.remove(file_path)
 
@@ -103,6 +141,63 @@ def download_ytvid_as_wav(video_id: str) -> bool:
     except Exception as e:
         logger.exception(f"Error occurred while downloading the video: {e}")
         return False
+    finally:
+        if cache is not None:
+            cache.close()
+
+@instrumentation.traced("decode", audio_arg=instrumentation.RESULT)
+def load_audio(video_id: str) -> np.ndarray:
+    """
+    Load the canonical 16 kHz mono int16 audio buffer of a downloaded video.
+
+    Every stage (VAD, OSD, diarization, whisper) works on slices of this buffer, so the
+    audio is decoded exactly once per video.
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        np.ndarray: 1-D int16 array sampled at `sr`.
+    """
+    import soundfile as sf
+
+    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{video_id}.wav")
+    audio, file_sr = sf.read(part_0_path, dtype='int16', always_2d=True)
+    if file_sr == sr and audio.shape[1] == 1:
+        return audio[:, 0]
+
+    # WAV files downloaded before the canonical format was introduced
+    import librosa
+
+    logger.debug(f"Converting {video_id=} from {file_sr} Hz, {audio.shape[1]} channel(s) to {sr} Hz mono")
+    audio = librosa.resample(to_float32(audio).mean(axis=1), orig_sr=file_sr, target_sr=sr)
+    return np.clip(np.round(audio * 32768), -32768, 32767).astype(np.int16)
+
+def to_float32(audio):
+    """
+    Convert int16 samples to float32 samples in [-1, 1], as expected by whisper and pyannote.
+
+    Args:
+        audio (np.ndarray): int16 audio samples.
+
+    Returns:
+        np.ndarray: float32 audio samples.
+    """
+    return audio.astype(np.float32) / 32768.0
+
+def as_pyannote_input(audio):
+    """
+    Wrap an int16 audio buffer into the in-memory input format of pyannote pipelines.
+
+    Args:
+        audio (np.ndarray): 1-D int16 audio samples sampled at `sr`.
+
+    Returns:
+        dict: {"waveform": (1, num_samples) float32 tensor, "sample_rate": sr}
+    """
+    import torch
+
+    return {"waveform": torch.from_numpy(to_float32(audio))[None], "sample_rate": sr}
 
 def extract_speech_segments(speech_segments):
     """
@@ -121,78 +216,187 @@ def extract_speech_segments(speech_segments):
         speech_present_arr.append(use_tuple)
     return sorted(speech_present_arr)
 
-def remove_non_speech(curr_yt_id, timestamps):
+def timestamps_to_sample_bounds(timestamps, sr, num_samples):
     """
-    Remove non-speech segments from the audio file.
+    Convert [start, end] timestamps (in seconds) to sample bounds.
 
     Args:
-        curr_yt_id (str): YouTube video ID.
-        timestamps (list): List of tuples containing start and end times of speech segments.
+        timestamps (list): List of [start, end] pairs in seconds.
+        sr (int): Sample rate of the audio the bounds refer to.
+        num_samples (int): Length of the audio, used to clip the bounds.
 
     Returns:
-        tuple: Concatenated audio array and sample rate.
+        np.ndarray: Array of shape (n, 2) with int64 [start, end) sample indices.
     """
-    part_0_path = os.path.join(ConfigConstants.PART_0_PATH, f"{curr_yt_id}.wav")
-    part_1_path = os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav")
-    audio, sr = librosa.load(part_0_path, sr=None)  # Load the WAV file
+    bounds = np.asarray(timestamps, dtype=np.float64).reshape(-1, 2) * sr
+    # truncation (not rounding) keeps the samples identical to the old int(t * sr) cuts
+    bounds = bounds.astype(np.int64)
+    np.clip(bounds, 0, num_samples, out=bounds)
+    bounds[:, 1] = np.maximum(bounds[:, 0], bounds[:, 1])
+    return bounds
+
+def complement_sample_bounds(bounds, num_samples):
+    """
+    Get the sample bounds lying between the given (sorted) bounds.
 
-    extracted_segments = []
-    for start, end in timestamps:
-        start_frame = int(start * sr)
-        end_frame = int(end * sr)
-        segment = audio[start_frame:end_frame]
-        extracted_segments.extend(segment)
+    Args:
+        bounds (np.ndarray): Array of shape (n, 2) with sorted [start, end) sample indices.
+        num_samples (int): Length of the audio.
+
+    Returns:
+        np.ndarray: Array of shape (n + 1, 2) with the [start, end) sample indices of the gaps.
+    """
+    starts = np.concatenate(([0], bounds[:, 1]))
+    ends = np.concatenate((bounds[:, 0], [num_samples]))
+    return np.column_stack((starts, np.maximum(starts, ends)))
+
+def build_segment_map(bounds):
+    """
+    Build the sample-exact mapping between the source audio and the cut audio.
+
+    Args:
+        bounds (np.ndarray): Array of shape (n, 2) with [start, end) sample indices to keep.
+
+    Returns:
+        np.ndarray: Array of shape (m, 3) with one row per non-empty kept segment:
+            [source_start, source_end, output_start].
+    """
+    bounds = bounds[bounds[:, 1] > bounds[:, 0]]
+    lengths = bounds[:, 1] - bounds[:, 0]
+    output_starts = np.cumsum(lengths) - lengths
+    return np.column_stack((bounds, output_starts))
+
+def cut_segments(audio, segment_map):
+    """
+    Concatenate the kept segments of an audio array with a single copy.
+
+    Args:
+        audio (np.ndarray): Source audio samples.
+        segment_map (np.ndarray): Mapping returned by `build_segment_map`.
+
+    Returns:
+        np.ndarray: The concatenated audio.
+    """
+    if len(segment_map) == 0:
+        return audio[:0].copy()
+    return np.concatenate([audio[start:end] for start, end, _ in segment_map])
+
+def write_segments(save_path, audio, segment_map, sr):
+    """
+    Stream the kept segments of an audio array straight to a WAV file, without concatenating them.
+
+    Args:
+        save_path (str): Path of the WAV file to write.
+        audio (np.ndarray): Source audio samples.
+        segment_map (np.ndarray): Mapping returned by `build_segment_map`.
+        sr (int): Sample rate of the audio.
+    """
+    import soundfile as sf
 
-    concatenated_audio = extracted_segments  # Concatenate the segments
-    sf.write(part_1_path, concatenated_audio, sr)
+    with sf.SoundFile(save_path, 'w', samplerate=sr, channels=1) as fd:
+        for start, end, _ in segment_map:
+            fd.write(audio[start:end])
 
-    return concatenated_audio, sr
+@instrumentation.traced("remove_non_speech", audio_arg="audio")
+def remove_non_speech(audio, timestamps, save_path=None):
+    """
+    Remove non-speech segments from the audio.
+
+    Args:
+        audio (np.ndarray): Audio samples of the whole video (part_0), sampled at `sr`.
+        timestamps (list): List of tuples containing start and end times of speech segments.
+        save_path (str, optional): If given, the speech-only audio (part_1) is also written there.
+
+    Returns:
+        tuple: Concatenated audio array and the segment map
+            ([source_start, source_end, output_start] rows) from part_0 to part_1 samples.
+    """
+    speech_bounds = timestamps_to_sample_bounds(timestamps, sr, len(audio))
+    segment_map = build_segment_map(speech_bounds)
+    concatenated_audio = cut_segments(audio, segment_map)
+    if save_path is not None:
+        import soundfile as sf
+
+        sf.write(save_path, concatenated_audio, sr)
 
-def remove_overlap(OSD, curr_yt_id):
+    return concatenated_audio, segment_map
+
+def project_timestamps(timestamps, segment_map):
     """
-    Remove overlapping segments from the audio file.
+    Map [start, end] timestamps of a source audio onto the audio cut with `segment_map`.
+
+    Parts of an interval that fall in removed regions are dropped; pieces that become adjacent
+    after the cut are merged back into one interval.
 
     Args:
-        OSD: Overlap Speech Detection object.
-        curr_yt_id (str): YouTube video ID.
+        timestamps (list): Sorted [start, end] pairs in seconds, on the source timeline.
+        segment_map (np.ndarray): Mapping returned by `build_segment_map`.
 
     Returns:
-        list: List of non-overlapping timestamps.
+        list: [start, end] pairs in seconds, on the cut timeline.
     """
-    video_input_path = os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav")
+    source_starts = segment_map[:, 0] / sr
+    source_ends = segment_map[:, 1] / sr
+    output_starts = segment_map[:, 2] / sr
 
-    OSD_output = OSD(video_input_path)
+    projected = []
+    for start, end in timestamps:
+        first = np.searchsorted(source_ends, start, side='right')
+        last = np.searchsorted(source_starts, end, side='left')
+        for k in range(first, last):
+            lb = max(start, source_starts[k]) - source_starts[k] + output_starts[k]
+            ub = min(end, source_ends[k]) - source_starts[k] + output_starts[k]
+            if ub <= lb:
+                continue
+            if projected and lb - projected[-1][1] < 1.0 / sr:
+                projected[-1][1] = float(ub)
+            else:
+                projected.append([float(lb), float(ub)])
+    return projected
+
+@instrumentation.traced("write_non_overlap", audio_arg="audio")
+def write_non_overlap(audio, timestamps, save_path=None):
+    """
+    Keep only the non-overlapping segments of the audio.
 
-    overlap_timestamps_arr = []
-    for curr_elem in OSD_output.__dict__['_tracks']:
-        lb, ub = curr_elem.__dict__['start'], curr_elem.__dict__['end']
-        overlap_timestamps_arr.append([lb, ub])
+    Args:
+        audio (np.ndarray): Speech-only audio samples (part_1), sampled at `sr`.
+        timestamps (list): List of overlapping timestamps.
+        save_path (str, optional): If given, the kept segments (part_2) are streamed to this WAV file.
+
+    Returns:
+        tuple: Concatenated audio array and the segment map
+            ([source_start, source_end, output_start] rows) from part_1 to part_2 samples.
+    """
+    overlap_bounds = timestamps_to_sample_bounds(timestamps, sr, len(audio))
+    segment_map = build_segment_map(complement_sample_bounds(overlap_bounds, len(audio)))
+    if save_path is not None:
+        logger.debug(f"Writing at: {save_path}")
+        write_segments(save_path, audio, segment_map, sr)
 
-    return overlap_timestamps_arr
+    return cut_segments(audio, segment_map), segment_map
 
-def write_non_overlap(curr_yt_id, timestamps):
+@instrumentation.traced("rebuild_non_overlap", audio_arg=instrumentation.RESULT)
+def rebuild_non_overlap_audio(video_id):
     """
-    Write non-overlapping segments to a new audio file.
+    Rebuild the overlap-free (part_2) track of a downloaded video from its saved VAD and OSD data.
 
     Args:
-        curr_yt_id (str): YouTube video ID.
-        timestamps (list): List of non-overlapping timestamps.
-    """
-    part_1_path = os.path.join(ConfigConstants.PART_1_PATH, f"{curr_yt_id}.wav")
-    part_2_path = os.path.join(ConfigConstants.PART_2_PATH, f"{curr_yt_id}.wav")
-    y, sr = librosa.load(part_1_path)
-
-    overlap_removed_sample = []
-    position_start = 0
-    for curr_bounds in timestamps:
-        sample_start, sample_end = curr_bounds
-
-        # The starting position of the sample
-        position_end = int(sample_start * sr)
-        overlap_removed_sample.extend(y[position_start:position_end])
-        # The end of the sample
-        position_start = int(sample_end * sr)
-
-    overlap_removed_sample.extend(y[position_start:])
-    logger.debug(f"Writing at: {part_2_path}")
-    sf.write(part_2_path, overlap_removed_sample, sr)
\ No newline at end of file
+        video_id (str): YouTube video ID.
+
+    Returns:
+        np.ndarray: int16 audio samples of the part_2 track, sampled at `sr`.
+    """
+    audio = load_audio(video_id)
+
+    # Load VAD data and remove non-speech
+    with open(os.path.join(ConfigConstants.VAD_FILE_DIR, f"{video_id}.json"), 'r') as fd:
+        vad_data = json.load(fd)
+    speech_audio, _ = remove_non_speech(audio, vad_data)
+    del audio
+
+    # Load OSD data and remove overlap
+    with open(os.path.join(ConfigConstants.OSD_FILE_DIR, f"{video_id}.json"), 'r') as fd:
+        osd_data = json.load(fd)
+    non_overlap_audio, _ = write_non_overlap(speech_audio, osd_data)
+    return non_overlap_audio
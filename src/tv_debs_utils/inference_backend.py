@@ -0,0 +1,173 @@
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Weight precisions
+FP32 = "fp32"
+INT8 = "int8"  # dynamic quantization: int8 weights, activations quantized on the fly (CPU only)
+PRECISIONS = [FP32, INT8]
+
+# Set once the threads of this process are pinned (e.g. by a worker of the pool, sharing the cores)
+_threads_pinned = False
+
+
+def get_device(device=None):
+    """
+    Get the torch device the models run on.
+
+    Args:
+        device (str, optional): 'auto', 'cpu' or 'cuda' (default: INFERENCE_DEVICE); 'auto' picks
+            cuda when it's available.
+
+    Returns:
+        torch.device: The device.
+    """
+    import torch
+
+    device = device or ConfigConstants.INFERENCE_DEVICE
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def check_precision(precision, device):
+    """
+    Raise a ValueError unless the models can run with `precision` on `device`.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    if precision == INT8 and device.type != "cpu":
+        raise ValueError(f"int8 dynamic quantization only runs on CPU, not on {device} (set INFERENCE_DEVICE=cpu)")
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None, pin=False):
+    """
+    Set the number of threads torch uses within an operator (intra-op) and to run independent
+    operators at the same time (inter-op). 0 keeps the current setting.
+
+    Once the threads are pinned, the calls taking the settings (e.g. when the models are loaded)
+    leave them as they are.
+
+    Args:
+        intra_op_threads (int, optional): Default: TORCH_INTRA_OP_THREADS.
+        inter_op_threads (int, optional): Default: TORCH_INTER_OP_THREADS.
+        pin (bool): Keep these numbers over the settings for the rest of the process.
+    """
+    import torch
+
+    global _threads_pinned
+    if _threads_pinned and intra_op_threads is None and inter_op_threads is None:
+        return
+    _threads_pinned = _threads_pinned or pin
+    if intra_op_threads is None:
+        intra_op_threads = ConfigConstants.TORCH_INTRA_OP_THREADS
+    if inter_op_threads is None:
+        inter_op_threads = ConfigConstants.TORCH_INTER_OP_THREADS
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Can only be set before the first parallel work of the process
+            logger.debug("torch inter-op threads already set")
+    logger.info(f"torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+
+def inference_mode():
+    """
+    Context manager running the models without autograd (no gradient graph or version counters).
+    """
+    import torch
+
+    return torch.inference_mode()
+
+
+def replace_linear_subclasses(model):
+    """
+    Swap the subclasses of nn.Linear in a model for nn.Linear layers holding the same parameters.
+
+    Dynamic quantization only converts modules whose type is exactly one of the given types, and
+    whisper's Linear subclass (which casts its weights to the dtype of the input) would stay fp32.
+
+    Returns:
+        torch.nn.Module: The model, changed in place.
+    """
+    import torch
+
+    for name, child in model.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None,
+                                     device="meta")
+            linear.weight = child.weight
+            linear.bias = child.bias
+            setattr(model, name, linear)
+        else:
+            replace_linear_subclasses(child)
+    return model
+
+
+def quantize_dynamic(model, layer_types=("Linear",)):
+    """
+    Quantize the weights of the given layer types of a model to int8, in place.
+
+    Args:
+        model (torch.nn.Module): Model on CPU.
+        layer_types (tuple): Names of the torch.nn layers to quantize ("Linear", "LSTM", "GRU").
+
+    Returns:
+        torch.nn.Module: The quantized model.
+    """
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(model, {getattr(torch.nn, name) for name in layer_types},
+                                                  dtype=torch.qint8, inplace=True)
+
+
+def prepare_whisper_model(whisper_model, precision):
+    """
+    Get a loaded whisper model ready for inference with `precision`.
+
+    Returns:
+        whisper.Whisper: The model, in eval mode, with int8 Linear layers for INT8.
+    """
+    if precision == INT8:
+        quantize_dynamic(replace_linear_subclasses(whisper_model))
+        logger.info("whisper Linear layers quantized to int8")
+    return whisper_model.eval()
+
+
+def prepare_pyannote_model(model, precision):
+    """
+    Get a loaded pyannote model (segmentation or speaker embedding) ready for inference with `precision`.
+
+    Returns:
+        torch.nn.Module: The model, in eval mode, with int8 Linear and LSTM layers for INT8.
+    """
+    if precision == INT8:
+        quantize_dynamic(model, ("Linear", "LSTM"))
+    return model.eval()
+
+
+def prepare_diarization_pipeline(pipeline, precision):
+    """
+    Get the models of a loaded pyannote speaker diarization pipeline ready for inference with `precision`.
+
+    The pipeline has no public access to its models: they are the `_segmentation` inference and
+    the `_embedding` wrapper of pyannote 3.x, which are left as they are when missing.
+
+    Returns:
+        Pipeline: The pipeline.
+    """
+    segmentation = getattr(pipeline, "_segmentation", None)
+    if segmentation is not None:
+        prepare_pyannote_model(segmentation.model, precision)
+    embedding_model = getattr(getattr(pipeline, "_embedding", None), "model_", None)
+    if embedding_model is not None:
+        prepare_pyannote_model(embedding_model, precision)
+    if precision == INT8:
+        logger.info(f"Diarization models quantized to int8 (segmentation: {segmentation is not None}, "
+                    f"embedding: {embedding_model is not None})")
+    return pipeline
@@ -0,0 +1,497 @@
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import signal
+import shutil
+import inspect
+import itertools
+import argparse
+import resource
+import functools
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+from ..config_constants import ConfigConstants
+
+# Spans time the stages of the pipelines: every finished span is a line of the JSON Lines trace of
+# the run (results/traces/<run id>.jsonl, shared by the worker processes), and is added to the
+# per-stage totals of a Prometheus text file (results/traces/<run id>_<pid>.prom, one per process)
+
+# Passed as `audio_arg` to `traced` to measure the audio returned by the function
+RESULT = "<result>"
+
+# Current span of the thread or asyncio task, the parent of the spans started in it
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# One profiled span at a time: cProfile profilers can't nest
+_profile_lock = threading.Lock()
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def _get_logger():
+    # debate_utils imports this module (to trace its functions), so its logger is fetched once needed
+    from . import debate_utils
+
+    return debate_utils.logger
+
+
+def get_rss_bytes():
+    """
+    Current resident set size of this process (its peak where /proc isn't available).
+    """
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return get_peak_rss_bytes()
+
+
+def get_peak_rss_bytes():
+    """
+    Peak resident set size of this process since it started (or since `reset_peak_rss`).
+    """
+    try:
+        with open("/proc/self/status") as fd:
+            for line in fd:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process to its current size (Linux only).
+
+    Returns:
+        bool: Whether the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_audio_seconds(audio):
+    """
+    Length in seconds of audio samples (or of an AudioFileReader) sampled at `debate_utils.sr`.
+    """
+    from . import debate_utils
+
+    return len(audio) / debate_utils.sr
+
+
+def get_run_id():
+    """
+    ID of the run: given by TRACE_RUN_ID, else made up from the start time and set in the
+    environment, so that the worker processes spawned by the run share it.
+    """
+    run_id = os.environ.get("TRACE_RUN_ID")
+    if not run_id:
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        os.environ["TRACE_RUN_ID"] = run_id
+    return run_id
+
+
+class Span:
+    """
+    Timing of a stage (or of any block of work) of a video: wall and CPU time, resident memory and
+    the seconds of audio it processed.
+
+    Started by `start_span` (or the `span` context manager and the `traced` decorator) and recorded
+    by `end`. Code running in the span can set `audio_seconds` and `status`, and add attributes.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, tracer, name, video_id=None, audio_seconds=None, **attributes):
+        self.tracer = tracer
+        self.name = name
+        self.video_id = video_id
+        self.audio_seconds = audio_seconds
+        self.attributes = attributes
+        self.status = "ok"
+        self.ended = tracer is None
+        if tracer is None:
+            return
+        self.span_id = f"{os.getpid()}-{next(Span._ids)}"
+        parent = _current_span.get()
+        self.parent_id = None
+        if parent is not None and parent.tracer is not None:
+            # Functions called for a video (e.g. the cuts of debate_utils) don't all take its ID
+            self.parent_id = parent.span_id
+            self.video_id = video_id if video_id is not None else parent.video_id
+        self.thread_id = threading.get_ident()
+        self.start_time = time.time()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_thread_cpu = time.thread_time()
+        self._start_rss = get_rss_bytes()
+        self._start_peak_rss = get_peak_rss_bytes()
+        self._profiler = _start_profiler(self) if name in ConfigConstants.PROFILE_STAGES else None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key, value):
+        """
+        Add `value` to the attribute `key` (e.g. the seconds spent waiting for an API).
+        """
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self, status=None, error=None):
+        """
+        Record the span (once; later calls are ignored).
+
+        Args:
+            status (str, optional): Overrides the status ("ok", "failed" or "error").
+            error (Exception, optional): Error the span ended with.
+        """
+        if self.ended:
+            return
+        self.ended = True
+        wall_seconds = time.perf_counter() - self._start_wall
+        cpu_seconds = time.process_time() - self._start_cpu
+        if self._profiler is not None:
+            _stop_profiler(self._profiler)
+        if error is not None:
+            self.status = "error"
+        elif status is not None:
+            self.status = status
+        peak_rss = get_peak_rss_bytes()
+        record = {
+            "run_id": self.tracer.run_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "video_id": self.video_id,
+            "status": self.status,
+            "start_time": self.start_time,
+            "wall_seconds": wall_seconds,
+            # Process CPU time: includes the threads of torch and of the stages running concurrently
+            "cpu_seconds": cpu_seconds,
+            # CPU time of the thread the span ran in, when it started and ended in the same thread
+            "thread_cpu_seconds": time.thread_time() - self._start_thread_cpu
+            if threading.get_ident() == self.thread_id else None,
+            "rss_start_bytes": self._start_rss,
+            "rss_end_bytes": get_rss_bytes(),
+            "peak_rss_bytes": peak_rss,
+            # How much the span raised the peak memory of the process
+            "peak_rss_increase_bytes": peak_rss - self._start_peak_rss,
+            "audio_seconds": self.audio_seconds,
+            "real_time_factor": wall_seconds / self.audio_seconds if self.audio_seconds else None,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+        if self.attributes:
+            record["attributes"] = self.attributes
+        self.tracer.record(record)
+
+
+def _start_profiler(current):
+    file_name = f"{current.tracer.run_id}_{current.name}_{current.video_id or 'run'}_{current.span_id}"
+    if not _profile_lock.acquire(blocking=False):
+        _get_logger().debug(f"Span {current.name} not profiled: another span is being profiled")
+        return None
+    os.makedirs(ConfigConstants.TRACE_DIR, exist_ok=True)
+    if ConfigConstants.PROFILER == "py-spy":
+        py_spy = shutil.which("py-spy")
+        if py_spy is None:
+            _get_logger().warning("py-spy isn't installed, spans aren't profiled (pip install py-spy)")
+            _profile_lock.release()
+            return None
+        output_path = os.path.join(ConfigConstants.TRACE_DIR, f"{file_name}.speedscope.json")
+        # py-spy samples every thread of the process from outside (it needs ptrace permissions), and
+        # writes its profile when interrupted
+        process = subprocess.Popen([py_spy, "record", "--pid", str(os.getpid()), "--format", "speedscope",
+                                    "--output", output_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return "py-spy", process, output_path
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    return "cprofile", profile, os.path.join(ConfigConstants.TRACE_DIR, f"{file_name}.prof")
+
+
+def _stop_profiler(profiler):
+    kind, handle, output_path = profiler
+    try:
+        if kind == "py-spy":
+            handle.send_signal(signal.SIGINT)
+            _, stderr = handle.communicate(timeout=120)
+            if handle.returncode:
+                _get_logger().warning(f"py-spy failed ({handle.returncode}): {stderr.decode(errors='replace')}")
+                return
+        else:
+            handle.disable()
+            handle.dump_stats(output_path)
+        _get_logger().info(f"Profile written to: {output_path}")
+    except Exception as e:
+        _get_logger().exception(f"Error while writing the profile {output_path}: {e}")
+    finally:
+        _profile_lock.release()
+
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Tracer:
+    """
+    Writes the finished spans of this process to the trace of the run, and keeps per-stage totals
+    in its Prometheus text file (for the node exporter's textfile collector, or to read by hand).
+
+    Args:
+        run_id (str): ID of the run (see `get_run_id`).
+        trace_dir (str): Folder of the traces.
+    """
+
+    METRICS = [
+        ("spans_total", "counter", "Spans finished, by status"),
+        ("wall_seconds_total", "counter", "Wall time of the spans"),
+        ("cpu_seconds_total", "counter", "Process CPU time during the spans"),
+        ("audio_seconds_total", "counter", "Seconds of audio processed by the spans"),
+        ("real_time_factor", "gauge", "Wall time per second of audio"),
+        ("peak_rss_bytes", "gauge", "Highest peak resident memory of the process at the end of a span"),
+    ]
+
+    def __init__(self, run_id, trace_dir):
+        self.run_id = run_id
+        self.trace_path = os.path.join(trace_dir, f"{run_id}.jsonl")
+        self.metrics_path = os.path.join(trace_dir, f"{run_id}_{os.getpid()}.prom")
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def record(self, record):
+        """
+        Append a finished span to the trace and update the metrics file. Errors are logged: a
+        trace that can't be written doesn't stop the stages.
+        """
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            totals = self.stages.setdefault(record["name"], {"spans_total": {}, "wall_seconds_total": 0.0,
+                                                             "cpu_seconds_total": 0.0, "audio_seconds_total": 0.0,
+                                                             "timed_audio_wall_seconds": 0.0, "peak_rss_bytes": 0})
+            totals["spans_total"][record["status"]] = totals["spans_total"].get(record["status"], 0) + 1
+            totals["wall_seconds_total"] += record["wall_seconds"]
+            totals["cpu_seconds_total"] += record["cpu_seconds"]
+            if record["audio_seconds"]:
+                totals["audio_seconds_total"] += record["audio_seconds"]
+                totals["timed_audio_wall_seconds"] += record["wall_seconds"]
+            totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"], record["peak_rss_bytes"])
+            try:
+                if self.fd is None:
+                    os.makedirs(os.path.dirname(self.trace_path), exist_ok=True)
+                    self.fd = open(self.trace_path, 'a')
+                    _get_logger().info(f"Tracing the stages to: {self.trace_path}")
+                # One write per line, so that the lines of concurrent workers don't interleave
+                self.fd.write(line)
+                self.fd.flush()
+                self._write_metrics()
+            except OSError as e:
+                _get_logger().exception(f"Error while writing the trace: {e}")
+
+    def _write_metrics(self):
+        lines = []
+        for metric, metric_type, description in self.METRICS:
+            lines.append(f"# HELP tvdebs_stage_{metric} {description}.")
+            lines.append(f"# TYPE tvdebs_stage_{metric} {metric_type}")
+            for stage, totals in sorted(self.stages.items()):
+                labels = {"run_id": self.run_id, "pid": os.getpid(), "stage": stage}
+                if metric == "spans_total":
+                    for status, count in sorted(totals[metric].items()):
+                        lines.append(f"tvdebs_stage_{metric}{{{_format_labels({**labels, 'status': status})}}} {count}")
+                elif metric == "real_time_factor":
+                    if totals["audio_seconds_total"]:
+                        rtf = totals["timed_audio_wall_seconds"] / totals["audio_seconds_total"]
+                        lines.append(f"tvdebs_stage_{metric}{{{_format_labels(labels)}}} {rtf}")
+                else:
+                    lines.append(f"tvdebs_stage_{metric}{{{_format_labels(labels)}}} {totals[metric]}")
+        tmp_path = f"{self.metrics_path}.tmp"
+        with open(tmp_path, 'w') as fd:
+            fd.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.metrics_path)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.fd.close()
+                self.fd = None
+
+
+def get_tracer():
+    """
+    Get the tracer of this process, created on first use (None when TRACING=0).
+    """
+    global _tracer
+
+    if not ConfigConstants.TRACING:
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(get_run_id(), ConfigConstants.TRACE_DIR)
+            atexit.register(_tracer.close)
+        return _tracer
+
+
+def start_span(name, video_id=None, audio_seconds=None, **attributes):
+    """
+    Start a span that isn't tied to a block of code (e.g. a video scored by several asyncio tasks);
+    it's recorded when its `end` method is called.
+
+    Args:
+        name (str): Name of the stage.
+        video_id (str, optional): YouTube ID of the video processed.
+        audio_seconds (float, optional): Seconds of audio processed (can also be set later).
+        **attributes: Saved with the span.
+
+    Returns:
+        Span: The started span.
+    """
+    return Span(get_tracer(), name, video_id, audio_seconds, **attributes)
+
+
+@contextmanager
+def span(name, video_id=None, audio_seconds=None, **attributes):
+    """
+    Time the block of code it wraps, as a span of `start_span`'s arguments; spans started in the
+    block are its children. The span is recorded with the "error" status if the block raises.
+
+    Yields:
+        Span: The span, whose audio_seconds, status and attributes can be set in the block.
+    """
+    current = start_span(name, video_id, audio_seconds, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name, audio_arg=None):
+    """
+    Decorator timing every call of a function as a span. The video ID is taken from its `video_id`
+    (or `curr_yt_id`) argument, and calls returning False are recorded as failed.
+
+    Args:
+        name (str): Name of the stage.
+        audio_arg (str, optional): Argument holding the audio processed, or RESULT for the audio returned.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ConfigConstants.TRACING:
+                return fn(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            video_id = arguments.get("video_id", arguments.get("curr_yt_id"))
+            audio_seconds = get_audio_seconds(arguments[audio_arg]) if audio_arg in arguments else None
+            with span(name, video_id, audio_seconds) as current:
+                result = fn(*args, **kwargs)
+                if audio_arg == RESULT:
+                    current.audio_seconds = get_audio_seconds(result)
+                if result is False:
+                    current.status = "failed"
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def load_trace(trace_path):
+    """
+    Load the spans of a trace.
+
+    Returns:
+        list: Span records (dicts), in the order they ended.
+    """
+    with open(trace_path) as fd:
+        return [json.loads(line) for line in fd if line.strip()]
+
+
+def summarize_spans(spans, by_video=False):
+    """
+    Total the spans of every stage (or of every video and stage).
+
+    Args:
+        spans (list): Span records.
+        by_video (bool): Group the spans by video and stage, instead of by stage only.
+
+    Returns:
+        dict: For every stage (or (video ID, stage) pair): spans, errors, wall_seconds, cpu_seconds,
+            audio_seconds, real_time_factor and peak_rss_bytes.
+    """
+    summary = {}
+    for record in spans:
+        key = (record["video_id"], record["name"]) if by_video else record["name"]
+        totals = summary.setdefault(key, {"spans": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                          "audio_seconds": 0.0, "timed_audio_wall_seconds": 0.0,
+                                          "peak_rss_bytes": 0})
+        totals["spans"] += 1
+        totals["errors"] += record["status"] != "ok"
+        totals["wall_seconds"] += record["wall_seconds"]
+        totals["cpu_seconds"] += record["cpu_seconds"]
+        if record["audio_seconds"]:
+            totals["audio_seconds"] += record["audio_seconds"]
+            totals["timed_audio_wall_seconds"] += record["wall_seconds"]
+        totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"], record["peak_rss_bytes"])
+    for totals in summary.values():
+        timed_wall_seconds = totals.pop("timed_audio_wall_seconds")
+        totals["real_time_factor"] = timed_wall_seconds / totals["audio_seconds"] if totals["audio_seconds"] else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the stage spans traced by the pipelines.")
+    parser.add_argument("trace", nargs="?", default=None,
+                        help="Trace (JSON Lines) to summarize (default: the latest one in results/traces)")
+    parser.add_argument("--video", default=None, help="Only the spans of this video")
+    parser.add_argument("--by-video", action="store_true", help="Total the spans of every video separately")
+    args = parser.parse_args()
+
+    trace_path = args.trace
+    if trace_path is None:
+        trace_paths = glob.glob(os.path.join(ConfigConstants.TRACE_DIR, "*.jsonl"))
+        if not trace_paths:
+            parser.error(f"No trace in {ConfigConstants.TRACE_DIR}")
+        trace_path = max(trace_paths, key=os.path.getmtime)
+    spans = load_trace(trace_path)
+    if args.video is not None:
+        spans = [record for record in spans if record["video_id"] == args.video]
+
+    print(f"{trace_path}: {len(spans)} spans")
+    print(f"{'stage':>48} {'spans':>6} {'errors':>6} {'wall s':>10} {'cpu s':>10} {'audio s':>10} {'RTF':>8} "
+          f"{'peak RSS MB':>12}")
+    summary = summarize_spans(spans, args.by_video)
+    for key, totals in sorted(summary.items(), key=lambda item: -item[1]["wall_seconds"]):
+        name = f"{key[0]}/{key[1]}" if args.by_video else key
+        rtf = f"{totals['real_time_factor']:8.4f}" if totals["real_time_factor"] is not None else f"{'-':>8}"
+        print(f"{name:>48} {totals['spans']:>6} {totals['errors']:>6} {totals['wall_seconds']:>10.3f} "
+              f"{totals['cpu_seconds']:>10.3f} {totals['audio_seconds']:>10.1f} {rtf} "
+              f"{totals['peak_rss_bytes'] / 1024 ** 2:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
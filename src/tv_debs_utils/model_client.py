@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import aiohttp
+from ..config_constants import ConfigConstants
+
+# Thin client of the model server: it doesn't import torch or any model library, so it starts
+# instantly and leaves the models to the server
+
+
+async def submit_job(task, video_ids, options, socket_path=None, port=None):
+    """
+    Send a job to the model server and print its progress as it streams back.
+
+    Args:
+        task (str): "osd_vad" or "transcription".
+        video_ids (str): YouTube ID, or path to a JSON list of IDs.
+        options (dict): Keyword arguments of the task's `process_videos`.
+        socket_path (str, optional): Unix socket of the server.
+        port (int, optional): Local TCP port of the server, used instead of the socket.
+
+    Returns:
+        dict: Last event of the job (finished, with the errors, or failed).
+    """
+    if video_ids.endswith(".json"):
+        # The server may run from another working directory
+        video_ids = os.path.abspath(video_ids)
+    if port:
+        connector, url = None, f"http://127.0.0.1:{port}/jobs/{task}"
+    else:
+        connector, url = aiohttp.UnixConnector(path=socket_path), f"http://localhost/jobs/{task}"
+
+    final_event = None
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with session.post(url, json={"video_ids": video_ids, "options": options}) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                event = json.loads(line)
+                print(json.dumps(event), flush=True)
+                final_event = event
+    return final_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run pipeline jobs on the model server.")
+    parser.add_argument("--socket", default=ConfigConstants.MODEL_SERVER_SOCKET, help="Unix socket of the server")
+    parser.add_argument("--port", type=int, default=None, help="Local TCP port of the server, instead of the socket")
+    subparsers = parser.add_subparsers(dest="task", required=True)
+
+    osd_vad_parser = subparsers.add_parser("osd_vad", help="VAD, OSD and speaker diarization")
+    osd_vad_parser.add_argument("video_ids", help="YouTube ID or path to a JSON list of IDs")
+    osd_vad_parser.add_argument("--prefetch", type=int, default=ConfigConstants.PREFETCH_WORKERS)
+    osd_vad_parser.add_argument("--streaming", action="store_true")
+
+    transcription_parser = subparsers.add_parser("transcription", help="Transcription of the diarized turns")
+    transcription_parser.add_argument("video_ids", help="YouTube ID or path to a JSON list of IDs")
+    transcription_parser.add_argument("--mode", choices=["per_utterance", "whole_track"], default="per_utterance")
+    transcription_parser.add_argument("--no-turn-merging", action="store_true")
+    transcription_parser.add_argument("--prefetch", type=int, default=ConfigConstants.PREFETCH_WORKERS)
+    transcription_parser.add_argument("--cut-workers", type=int, default=1)
+    transcription_parser.add_argument("--streaming", action="store_true")
+
+    args = parser.parse_args()
+    if args.task == "osd_vad":
+        options = {"prefetch": args.prefetch, "streaming": args.streaming}
+    else:
+        options = {"mode": args.mode, "merge_turns": not args.no_turn_merging, "prefetch": args.prefetch,
+                   "cut_workers": args.cut_workers, "streaming": args.streaming}
+
+    final_event = asyncio.run(submit_job(args.task, args.video_ids, options, args.socket, args.port))
+    if final_event is None or final_event["status"] != "finished" or final_event["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
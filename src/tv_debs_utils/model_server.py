@@ -0,0 +1,142 @@
+import os
+import json
+import asyncio
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Tasks served: name -> (pipeline module, function loading its models)
+TASKS = {
+    "osd_vad": ("..diarization_vad_osd_related.run_pipeline_osd_vad", "load_models"),
+    "transcription": ("..transcription_related.run_pipeline_transcription", "load_whisper_model"),
+}
+
+
+class ModelServer:
+    """
+    Keeps the models of every task resident between jobs.
+
+    The models of a task are loaded by its first job (or at startup with `preload`), and the jobs of
+    a task run one at a time on their own thread, since they share the models. Jobs of different
+    tasks run concurrently.
+
+    Args:
+        preload (list, optional): Names of the tasks whose models are loaded at startup.
+    """
+
+    def __init__(self, preload=None):
+        self.modules = {}
+        self.models = {}
+        self.executors = {task: ThreadPoolExecutor(max_workers=1, thread_name_prefix=task) for task in TASKS}
+        self.load_lock = threading.Lock()
+        self.num_jobs = 0
+        for task in preload or []:
+            self.get_models(task)
+
+    def get_models(self, task):
+        with self.load_lock:
+            if task not in self.models:
+                module_name, load_fn = TASKS[task]
+                self.modules[task] = importlib.import_module(module_name, __package__)
+                logger.info(f"Loading the models of {task}")
+                self.models[task] = getattr(self.modules[task], load_fn)()
+        return self.modules[task], self.models[task]
+
+    def run_job(self, task, video_ids, options, on_progress):
+        module, models = self.get_models(task)
+        vid_id_list = module.load_video_ids(video_ids)
+        on_progress({"status": "started", "num_videos": len(vid_id_list)})
+        return module.process_videos(vid_id_list, models, on_progress=on_progress, **options)
+
+    async def handle_job(self, request):
+        """
+        POST /jobs/<task> with {"video_ids": ID or JSON path, "options": {...}}.
+
+        Streams one JSON line per event: started, a status for every video, then finished (with the
+        errors) or failed.
+        """
+        task = request.match_info["task"]
+        if task not in TASKS:
+            raise web.HTTPNotFound(text=f"Unknown task: {task}")
+        job = await request.json()
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def on_progress(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        self.num_jobs += 1
+        future = loop.run_in_executor(self.executors[task], self.run_job, task, job["video_ids"],
+                                      job.get("options", {}), on_progress)
+        future.add_done_callback(lambda _: events.put_nowait(None))
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            await response.write((json.dumps(event) + "\n").encode())
+
+        try:
+            error_ids = future.result()
+            final_event = {"status": "finished", "errors": error_ids}
+        except Exception as e:
+            logger.exception(f"Job failed: {e}")
+            final_event = {"status": "failed", "error": f"{e}"}
+        await response.write((json.dumps(final_event) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def handle_status(self, request):
+        return web.json_response({"pid": os.getpid(), "loaded": sorted(self.models), "num_jobs": self.num_jobs})
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/jobs/{task}", self.handle_job)
+        app.router.add_get("/status", self.handle_status)
+        return app
+
+
+async def serve(args):
+    model_server = ModelServer(args.preload)
+    runner = web.AppRunner(model_server.create_app())
+    await runner.setup()
+    if args.port:
+        site = web.TCPSite(runner, '127.0.0.1', args.port)
+        address = f"http://127.0.0.1:{args.port}"
+    else:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        site = web.UnixSite(runner, args.socket)
+        address = args.socket
+    await site.start()
+    logger.info(f"Model server listening on {address}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local server keeping the pipeline models loaded between jobs.")
+    parser.add_argument("--socket", default=ConfigConstants.MODEL_SERVER_SOCKET, help="Unix socket to listen on")
+    parser.add_argument("--port", type=int, default=None, help="Listen on this local TCP port instead")
+    parser.add_argument("--preload", nargs="*", choices=sorted(TASKS), default=[],
+                        help="Tasks whose models are loaded at startup")
+    args = parser.parse_args()
+    # The default socket lives in the scratch folder
+    ConfigConstants.create_directories()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
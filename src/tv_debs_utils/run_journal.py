@@ -0,0 +1,111 @@
+import os
+import json
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+
+def atomic_json_dump(obj, save_path, indent=None):
+    """
+    Write a JSON file atomically: readers see either the old file or the complete new one.
+
+    Args:
+        obj: JSON-serializable object.
+        save_path (str): Path of the JSON file.
+        indent (int, optional): Indentation passed to `json.dump`.
+    """
+    tmp_path = f"{save_path}.tmp"
+    with open(tmp_path, 'w') as fd:
+        json.dump(obj, fd, indent=indent)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_path, save_path)
+
+
+class UtteranceJournal:
+    """
+    Append-only JSON Lines journal of the utterances of one video finished by one stage.
+
+    Every finished utterance is appended (and flushed to disk) as soon as it completes, so a
+    restarted run resumes exactly where the previous one stopped. Once the video is done, the
+    final file is written atomically and the journal is removed.
+
+    Args:
+        stage (str): Name of the stage (e.g. "transcription", "perspective").
+        video_id (str): YouTube video ID.
+    """
+
+    def __init__(self, stage, video_id):
+        journal_dir = os.path.join(ConfigConstants.JOURNAL_DIR, stage)
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f"{video_id}.jsonl")
+        self.fd = None
+
+    def load(self):
+        """
+        Read the utterances finished by previous runs.
+
+        Returns:
+            dict: Record of every finished utterance, by key.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r') as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line cut short by a crash
+                    logger.debug(f"Ignoring a truncated line of {self.path}")
+                    continue
+                records[entry["key"]] = entry["record"]
+        if records:
+            logger.info(f"Resuming from {len(records)} journaled utterances: {self.path}")
+        return records
+
+    def append(self, key, record):
+        """
+        Record a finished utterance.
+
+        Args:
+            key: JSON-serializable key of the utterance.
+            record: JSON-serializable result of the utterance.
+        """
+        if self.fd is None:
+            self._drop_partial_line()
+            self.fd = open(self.path, 'a')
+        self.fd.write(json.dumps({"key": key, "record": record}) + "\n")
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+
+    def _drop_partial_line(self):
+        # A line cut short by a crash would be glued to the next record, which would be lost with it
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as fd:
+            content = fd.read()
+            if content and not content.endswith(b"\n"):
+                fd.truncate(content.rfind(b"\n") + 1)
+                logger.debug(f"Dropped the truncated last line of {self.path}")
+
+    def compact(self, obj, save_path, indent=None):
+        """
+        Atomically write the final file of the video and remove the journal.
+
+        Args:
+            obj: JSON-serializable final result of the video.
+            save_path (str): Path of the final JSON file.
+            indent (int, optional): Indentation passed to `json.dump`.
+        """
+        atomic_json_dump(obj, save_path, indent=indent)
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
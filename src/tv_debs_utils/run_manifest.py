@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Stages tracked in the manifest, with the folder their outputs are written to
+STAGE_DIRECTORIES = {
+    "diarization": "DIARIZATION_FILE_DIR",
+    "transcription": "TRANSCRIPT_FILE_DIR",
+    "perspective": "PERSPECTIVE_FILE_DIR",
+}
+
+# Status of a (video, stage) row
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    video_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    error TEXT,
+    params_hash TEXT,
+    output_path TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    input_versions TEXT,
+    PRIMARY KEY (video_id, stage)
+);
+CREATE INDEX IF NOT EXISTS runs_stage_status ON runs (stage, status);
+CREATE TABLE IF NOT EXISTS synced_stages (stage TEXT PRIMARY KEY, synced_at REAL NOT NULL);
+"""
+
+
+def make_params_hash(params):
+    """
+    Hash the parameters (model versions, thresholds, modes) a stage output was computed with.
+
+    Args:
+        params (dict): JSON-serializable parameters.
+
+    Returns:
+        str: Hex SHA-256 digest (first 16 characters).
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_worker_alive(worker_id):
+    """
+    Check whether the process owning a lease still runs. Only the workers of this host can be checked:
+    those of other hosts (and worker IDs that aren't host and pid) are taken as alive.
+    """
+    host, _, pid = (worker_id or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Runs, as another user
+        return True
+    return True
+
+
+class RunManifest:
+    """
+    SQLite record of every (video, stage): status, attempts, duration, error, params hash and output.
+
+    Replaces scanning the result folders to know what is left to do, and lets concurrent workers
+    (threads, processes, or machines sharing the file) claim videos with a lease: a claimed video is
+    skipped by the others until it is done, failed, or its lease expires. The videos still claimed when
+    the manifest is closed (e.g. the run was interrupted) are given back, and the leases of dead
+    processes of this host are taken over at once rather than after the lease time.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+    """
+
+    def __init__(self, db_path):
+        # Stage threads share the connection; every access holds the lock
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Manifests created before the input versions were recorded
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]
+        if "input_versions" not in columns:
+            self.connection.execute("ALTER TABLE runs ADD COLUMN input_versions TEXT")
+        self.lock = threading.Lock()
+        # (stage, video ID, worker ID) of the videos claimed through this manifest and not finished yet
+        self.claims = set()
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock first, so that a read-then-update is atomic across processes
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def sync_directory(self, stage, force=False):
+        """
+        Mark the videos whose output already exists in the stage folder as done (once per stage,
+        or again with `force`), so that outputs computed before the manifest aren't computed again.
+
+        Args:
+            stage (str): Name of the stage.
+            force (bool): List the folder even if it was already synced.
+
+        Returns:
+            int: Number of videos marked as done.
+        """
+        with self.lock:
+            synced = self.connection.execute("SELECT 1 FROM synced_stages WHERE stage = ?", (stage,)).fetchone()
+        if synced and not force:
+            return 0
+        output_dir = getattr(ConfigConstants, STAGE_DIRECTORIES[stage])
+        files = [file for file in os.listdir(output_dir) if file.endswith(".json")] if os.path.isdir(output_dir) else []
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO runs (video_id, stage, status, finished_at, output_path) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (video_id, stage) DO UPDATE SET status = excluded.status, "
+                "finished_at = excluded.finished_at, output_path = excluded.output_path "
+                "WHERE runs.status != 'done'",
+                [(file[:-len(".json")], stage, DONE, now, os.path.join(output_dir, file)) for file in files])
+            connection.execute("INSERT OR REPLACE INTO synced_stages (stage, synced_at) VALUES (?, ?)", (stage, now))
+        logger.info(f"Manifest synced with {len(files)} existing {stage} outputs")
+        return len(files)
+
+    def register(self, stage, video_ids):
+        """
+        Add pending rows for the videos that aren't in the manifest yet.
+
+        Args:
+            stage (str): Name of the stage.
+            video_ids (list): YouTube video IDs.
+        """
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO runs (video_id, stage, status) VALUES (?, ?, ?)",
+                                   [(video_id, stage, PENDING) for video_id in video_ids])
+
+    def get(self, stage, video_id):
+        """
+        Returns:
+            dict: The row of the video for the stage, or None.
+        """
+        with self.lock:
+            cursor = self.connection.execute("SELECT * FROM runs WHERE video_id = ? AND stage = ?", (video_id, stage))
+            row = cursor.fetchone()
+            return None if row is None else dict(zip([column[0] for column in cursor.description], row))
+
+    def is_done(self, stage, video_id, params_hash=None):
+        """
+        Check whether the stage output of a video exists (and, if `params_hash` is given, was computed
+        with the same parameters; outputs computed before the manifest have no hash and always match).
+        """
+        row = self.get(stage, video_id)
+        if row is None or row["status"] != DONE:
+            return False
+        return params_hash is None or row["params_hash"] in (None, params_hash)
+
+    @staticmethod
+    def _get_input_versions(connection, video_id, input_stages):
+        # The version of a stage output is the time it was finished: redoing the stage changes it
+        versions = dict.fromkeys(input_stages)
+        for stage, finished_at in connection.execute(
+                f"SELECT stage, finished_at FROM runs WHERE video_id = ? AND status = ? "
+                f"AND stage IN ({','.join('?' * len(input_stages))})", (video_id, DONE, *input_stages)):
+            versions[stage] = finished_at
+        return versions
+
+    def try_start(self, stage, video_id, params_hash=None, worker_id=None,
+                  lease_seconds=ConfigConstants.MANIFEST_LEASE_SECONDS, input_stages=None, force=False):
+        """
+        Atomically claim a video for a stage, unless it is done or leased by another worker.
+
+        Args:
+            stage (str): Name of the stage.
+            video_id (str): YouTube video ID.
+            params_hash (str, optional): Parameters of the run; a video done with other parameters is redone.
+            worker_id (str, optional): Owner of the lease (host and pid by default).
+            lease_seconds (float): Time after which the claim lapses if the video isn't finished.
+            input_stages (list, optional): Stages whose outputs the stage reads; a video done from other
+                versions of them (see `mark_done`) is redone. Outputs done without recorded versions match.
+            force (bool): Claim the video even if it is done (e.g. one of its inputs is being redone).
+
+        Returns:
+            bool: True if the video was claimed.
+        """
+        worker_id = worker_id or get_worker_id()
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute("SELECT status, params_hash, lease_owner, lease_expires, input_versions FROM runs "
+                                     "WHERE video_id = ? AND stage = ?", (video_id, stage)).fetchone()
+            if row is not None:
+                status, done_params_hash, lease_owner, lease_expires, input_versions = row
+                if status == DONE and not force and (params_hash is None or done_params_hash in (None, params_hash)) \
+                        and (not input_stages or input_versions is None
+                             or json.loads(input_versions) == self._get_input_versions(connection, video_id,
+                                                                                       input_stages)):
+                    return False
+                if status == RUNNING and lease_owner != worker_id and (lease_expires or 0) > now \
+                        and is_worker_alive(lease_owner):
+                    return False
+            connection.execute(
+                "INSERT INTO runs (video_id, stage, status, attempts, started_at, params_hash, lease_owner, "
+                "lease_expires) VALUES (?, ?, ?, 1, ?, ?, ?, ?) "
+                "ON CONFLICT (video_id, stage) DO UPDATE SET status = excluded.status, attempts = attempts + 1, "
+                "started_at = excluded.started_at, finished_at = NULL, duration = NULL, error = NULL, "
+                "params_hash = excluded.params_hash, lease_owner = excluded.lease_owner, "
+                "lease_expires = excluded.lease_expires",
+                (video_id, stage, RUNNING, now, params_hash, worker_id, now + lease_seconds))
+            self.claims.add((stage, video_id, worker_id))
+        return True
+
+    def claim(self, stage, limit=1, params_hash=None, worker_id=None, max_attempts=None,
+              lease_seconds=ConfigConstants.MANIFEST_LEASE_SECONDS):
+        """
+        Atomically claim the next registered videos that are left to do for a stage: pending, failed
+        (fewer than `max_attempts` times) or with an expired lease.
+
+        Returns:
+            list: Claimed video IDs.
+        """
+        worker_id = worker_id or get_worker_id()
+        now = time.time()
+        with self.transaction() as connection:
+            # Leases of dead workers lapse at once
+            dead_leases = [(stage, video_id) for video_id, lease_owner in connection.execute(
+                "SELECT video_id, lease_owner FROM runs WHERE stage = ? AND status = ? AND lease_expires > ?",
+                (stage, RUNNING, now)) if not is_worker_alive(lease_owner)]
+            connection.executemany("UPDATE runs SET lease_expires = ? WHERE stage = ? AND video_id = ?",
+                                   [(now, stage, video_id) for stage, video_id in dead_leases])
+            video_ids = [row[0] for row in connection.execute(
+                "SELECT video_id FROM runs WHERE stage = ? AND (status = ? OR (status = ? AND attempts < ?) "
+                "OR (status = ? AND lease_expires <= ?)) ORDER BY attempts, rowid LIMIT ?",
+                (stage, PENDING, FAILED, max_attempts or 2 ** 31, RUNNING, now, limit))]
+            connection.executemany(
+                "UPDATE runs SET status = ?, attempts = attempts + 1, started_at = ?, finished_at = NULL, "
+                "duration = NULL, error = NULL, params_hash = ?, lease_owner = ?, lease_expires = ? "
+                "WHERE video_id = ? AND stage = ?",
+                [(RUNNING, now, params_hash, worker_id, now + lease_seconds, video_id, stage) for video_id in video_ids])
+            self.claims.update((stage, video_id, worker_id) for video_id in video_ids)
+        return video_ids
+
+    def finish(self, stage, video_id, status, output_path=None, error=None, input_stages=None):
+        now = time.time()
+        with self.transaction() as connection:
+            input_versions = None
+            if input_stages:
+                input_versions = json.dumps(self._get_input_versions(connection, video_id, input_stages))
+            connection.execute(
+                "UPDATE runs SET status = ?, finished_at = ?, duration = ? - started_at, error = ?, "
+                "output_path = COALESCE(?, output_path), lease_owner = NULL, lease_expires = NULL, "
+                "input_versions = COALESCE(?, input_versions) WHERE video_id = ? AND stage = ?",
+                (status, now, now, error, output_path, input_versions, video_id, stage))
+            self.claims = {claim for claim in self.claims if claim[:2] != (stage, video_id)}
+
+    def mark_done(self, stage, video_id, output_path=None, input_stages=None):
+        """
+        Mark a claimed video as done, recording the versions of the stage outputs it was made from
+        (`input_stages`), so that it is redone once one of them is.
+        """
+        self.finish(stage, video_id, DONE, output_path=output_path, input_stages=input_stages)
+
+    def mark_failed(self, stage, video_id, error):
+        self.finish(stage, video_id, FAILED, error=f"{error}")
+
+    def release(self, stage, video_id):
+        """
+        Give a claimed video back (e.g. nothing to do for it yet), without counting a failure.
+        """
+        with self.transaction() as connection:
+            connection.execute("UPDATE runs SET status = ?, attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                               "lease_expires = NULL WHERE video_id = ? AND stage = ? AND status = ?",
+                               (PENDING, video_id, stage, RUNNING))
+            self.claims = {claim for claim in self.claims if claim[:2] != (stage, video_id)}
+
+    def release_claims(self):
+        """
+        Give back the videos claimed through this manifest and not finished (e.g. the run was interrupted,
+        or prefetched videos were never processed), so that the next run picks them up at once.
+
+        Returns:
+            int: Number of videos given back.
+        """
+        with self.transaction() as connection:
+            # Only the rows still leased to the claimer: another worker may have taken an expired lease over
+            released = sum(connection.execute(
+                "UPDATE runs SET status = ?, attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                "lease_expires = NULL WHERE video_id = ? AND stage = ? AND status = ? AND lease_owner = ?",
+                (PENDING, video_id, stage, RUNNING, worker_id)).rowcount for stage, video_id, worker_id in self.claims)
+            self.claims = set()
+        if released:
+            logger.info(f"Gave back {released} unfinished videos claimed by this run")
+        return released
+
+    def video_ids(self, stage, status):
+        """
+        Returns:
+            list: IDs of the videos with this status for the stage.
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT video_id FROM runs WHERE stage = ? AND status = ? ORDER BY rowid", (stage, status))]
+
+    def durations(self, stage):
+        """
+        Returns:
+            list: (video ID, processing seconds) of the videos done by the stage with a timing.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT video_id, duration FROM runs WHERE stage = ? AND status = ? "
+                                           "AND duration IS NOT NULL", (stage, DONE)).fetchall()
+
+    def pending(self, stage, after=None):
+        """
+        Get the videos left to do for a stage.
+
+        Args:
+            stage (str): Name of the stage.
+            after (str, optional): Previous stage; only its done videos are considered, and they don't need
+                to be registered for `stage`.
+
+        Returns:
+            list: Video IDs.
+        """
+        with self.lock:
+            if after is None:
+                query = "SELECT video_id FROM runs WHERE stage = ? AND status != ? ORDER BY rowid"
+                args = (stage, DONE)
+            else:
+                query = ("SELECT previous.video_id FROM runs AS previous LEFT JOIN runs AS current "
+                         "ON current.video_id = previous.video_id AND current.stage = ? "
+                         "WHERE previous.stage = ? AND previous.status = ? "
+                         "AND (current.status IS NULL OR current.status != ?) ORDER BY previous.rowid")
+                args = (stage, after, DONE, DONE)
+            return [row[0] for row in self.connection.execute(query, args)]
+
+    def summary(self):
+        """
+        Returns:
+            dict: For every stage, the number of videos per status and the mean duration of the done ones.
+        """
+        summary = {}
+        with self.lock:
+            for stage, status, count, mean_duration in self.connection.execute(
+                    "SELECT stage, status, COUNT(*), AVG(duration) FROM runs GROUP BY stage, status"):
+                summary.setdefault(stage, {})[status] = count
+                if status == DONE and mean_duration is not None:
+                    summary[stage]["mean_duration"] = mean_duration
+        return summary
+
+    def close(self):
+        """
+        Give back the unfinished claims, then close the database.
+        """
+        try:
+            self.release_claims()
+        finally:
+            self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the run manifest.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("summary", help="Number of videos per stage and status")
+    pending_parser = subparsers.add_parser("pending", help="Print the JSON list of the videos left to do for a stage")
+    pending_parser.add_argument("stage", choices=sorted(STAGE_DIRECTORIES))
+    pending_parser.add_argument("--after", choices=sorted(STAGE_DIRECTORIES), default=None,
+                                help="Only the videos done by this previous stage")
+    failed_parser = subparsers.add_parser("failed", help="Print the failed videos of a stage with their errors")
+    failed_parser.add_argument("stage", choices=sorted(STAGE_DIRECTORIES))
+    sync_parser = subparsers.add_parser("sync", help="Mark the outputs found in the result folders as done")
+    # Checked below: argparse rejects an empty nargs="*" list when `choices` is set
+    sync_parser.add_argument("stages", nargs="*", metavar="stage",
+                             help=f"Stages to sync, among {', '.join(sorted(STAGE_DIRECTORIES))} (default: all)")
+    args = parser.parse_args()
+    if args.command == "sync":
+        unknown = [stage for stage in args.stages if stage not in STAGE_DIRECTORIES]
+        if unknown:
+            parser.error(f"unknown stages {unknown} (choose from {', '.join(sorted(STAGE_DIRECTORIES))})")
+        args.stages = args.stages or sorted(STAGE_DIRECTORIES)
+
+    ConfigConstants.create_directories()
+    manifest = RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    if args.command == "summary":
+        for stage in STAGE_DIRECTORIES:
+            manifest.sync_directory(stage)
+        print(json.dumps(manifest.summary(), indent=2))
+    elif args.command == "pending":
+        for stage in [args.stage] + ([args.after] if args.after else []):
+            manifest.sync_directory(stage)
+        print(json.dumps(manifest.pending(args.stage, args.after)))
+    elif args.command == "failed":
+        for video_id in manifest.video_ids(args.stage, FAILED):
+            row = manifest.get(args.stage, video_id)
+            print(f"{video_id}\t{row['attempts']}\t{row['error']}")
+    else:
+        for stage in args.stages:
+            manifest.sync_directory(stage, force=True)
+    manifest.close()
+
+
+if __name__ == "__main__":
+    main()
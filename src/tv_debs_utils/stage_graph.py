@@ -0,0 +1,244 @@
+import queue
+import itertools
+import threading
+from collections import namedtuple
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# A node of the stage graph, run once per item (e.g. a video):
+#   name: used in the logs and by the nodes taking its output
+#   fn: called with (item, {input name: output}) once the nodes it takes inputs from are over; returns
+#       its output, held in memory until the nodes taking it are done with it
+#   inputs: names of the nodes whose outputs it takes (the output of a node that didn't run is None)
+#   pool: name of the resource pool it runs in
+#   claim: called with (item, upstream_rerun) when the item is planned; returns whether the node has to
+#       run (its output is missing or stale; upstream_rerun tells whether a claimed node it depends on
+#       runs). Nodes without a claim only produce data for the others: they run when a node taking
+#       their output runs
+#   release: called with the item when a claimed node doesn't run after all (a node it depends on failed)
+Node = namedtuple("Node", ["name", "fn", "inputs", "pool", "claim", "release"], defaults=[None, None])
+
+
+class StageGraph:
+    """
+    Runs items through a graph of stages, where every stage can work on a different item at the
+    same time (e.g. the Perspective scores of a video while whisper transcribes the next one).
+
+    Every item is planned first: the nodes whose outputs are missing or stale are claimed, along with
+    the nodes they depend on, and only those run. A node is submitted to the thread pool of its
+    resource (the download slots, a model, the API clients) as soon as its inputs are over, and the
+    outputs are handed to the next nodes in memory.
+
+    Args:
+        nodes (list): Node tuples, every node listed after the nodes it takes inputs from.
+        pool_sizes (dict): Number of threads of every resource pool; a pool of size 1 runs one node at a
+            time (e.g. the nodes sharing a model).
+    """
+
+    def __init__(self, nodes, pool_sizes):
+        self.nodes = {}
+        for node in nodes:
+            missing = [name for name in node.inputs if name not in self.nodes]
+            if missing:
+                raise ValueError(f"Node {node.name} is listed before its inputs {missing}")
+            if node.pool not in pool_sizes:
+                raise ValueError(f"Unknown pool {node.pool} of node {node.name}")
+            self.nodes[node.name] = node
+        self.pool_sizes = pool_sizes
+        # Later nodes are run first when their pool has a choice, so that items get done (and their
+        # outputs freed) before new ones are started
+        self.priorities = {name: -idx for idx, name in enumerate(self.nodes)}
+        self.consumers = {name: [node.name for node in nodes if name in node.inputs] for name in self.nodes}
+        self.ancestors = {}
+        for node in nodes:
+            self.ancestors[node.name] = set(node.inputs).union(*(self.ancestors[name] for name in node.inputs))
+
+    def plan(self, item):
+        """
+        Claim the nodes that have to run for an item, and add the nodes producing their inputs.
+
+        Returns:
+            set: Names of the nodes to run.
+        """
+        claimed = []
+        try:
+            for node in self.nodes.values():
+                if node.claim is not None and node.claim(item, not self.ancestors[node.name].isdisjoint(claimed)):
+                    claimed.append(node.name)
+        except BaseException:
+            self.release(item, claimed)
+            raise
+        to_run = set(claimed)
+        for node in reversed(self.nodes.values()):
+            if node.claim is None and any(name in to_run for name in self.consumers[node.name]):
+                to_run.add(node.name)
+        return to_run
+
+    def release(self, item, names):
+        """
+        Release the claims of nodes that won't run for an item.
+        """
+        for name in names:
+            node = self.nodes[name]
+            if node.release is None:
+                continue
+            try:
+                node.release(item)
+            except Exception as e:
+                logger.exception(f"Error releasing {name} for {item}: {e}")
+
+    def run(self, items, max_items=4, on_error=None, on_item_done=None):
+        """
+        Run the items through the graph.
+
+        An item is planned once fewer than `max_items` are in flight, which bounds the outputs held in
+        memory (and the claims held in a run manifest) to those of `max_items` items.
+
+        Args:
+            items (iterable): Items to run.
+            max_items (int): Number of items in flight at once.
+            on_error (callable, optional): Called with (node name, item, exception) when a node raises (or
+                "plan" when planning the item does); the nodes depending on it don't run and are released.
+            on_item_done (callable, optional): Called with (item, names of the nodes that ran) once all the
+                nodes of an item are over.
+        """
+        on_error = on_error or (lambda name, item, e: None)
+        on_item_done = on_item_done or (lambda item, ran: None)
+        pools = {pool: _Pool(pool, size) for pool, size in self.pool_sizes.items()}
+        slots = threading.BoundedSemaphore(max_items)
+
+        def item_done(item, ran):
+            try:
+                on_item_done(item, ran)
+            finally:
+                slots.release()
+
+        try:
+            for item_idx, item in enumerate(items):
+                slots.acquire()
+                try:
+                    to_run = self.plan(item)
+                except Exception as e:
+                    logger.exception(f"Error planning {item}: {e}")
+                    on_error("plan", item, e)
+                    slots.release()
+                    continue
+                if not to_run:
+                    item_done(item, [])
+                    continue
+                _ItemRun(self, item, item_idx, to_run, pools, on_error, item_done).start()
+            # Wait for the items in flight
+            for _ in range(max_items):
+                slots.acquire()
+        finally:
+            for pool in pools.values():
+                pool.close()
+
+
+class _Pool:
+    """
+    Threads running the calls submitted to a resource pool, by priority: (node priority, item index).
+    """
+
+    def __init__(self, name, size):
+        self.tasks = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = [threading.Thread(target=self._work, name=f"{name}_{idx}", daemon=True) for idx in range(size)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, priority, fn, *args):
+        self.tasks.put((priority, next(self.sequence), fn, args))
+
+    def _work(self):
+        while True:
+            _, _, fn, args = self.tasks.get()
+            if fn is None:
+                return
+            fn(*args)
+
+    def close(self):
+        for _ in self.threads:
+            self.tasks.put(((float("inf"),), next(self.sequence), None, ()))
+        for thread in self.threads:
+            thread.join()
+
+
+class _ItemRun:
+    """
+    The nodes of one item: submits every node once its inputs are over, and drops the outputs once
+    the nodes taking them are done.
+    """
+
+    def __init__(self, graph, item, item_idx, to_run, pools, on_error, on_done):
+        self.graph = graph
+        self.item = item
+        self.item_idx = item_idx
+        self.to_run = to_run
+        self.pools = pools
+        self.on_error = on_error
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.waiting = {name: sum(input_name in to_run for input_name in graph.nodes[name].inputs) for name in to_run}
+        self.num_users = {name: sum(consumer in to_run for consumer in graph.consumers[name]) for name in to_run}
+        self.outputs = {}
+        self.cancelled = set()
+        self.ran = []
+        self.num_left = len(to_run)
+
+    def start(self):
+        for name in [name for name in self.graph.nodes if name in self.to_run and not self.waiting[name]]:
+            self.submit(name)
+
+    def submit(self, name):
+        node = self.graph.nodes[name]
+        inputs = {input_name: self.outputs.get(input_name) for input_name in node.inputs}
+        self.pools[node.pool].submit((self.graph.priorities[name], self.item_idx), self.run_node, node, inputs)
+
+    def run_node(self, node, inputs):
+        try:
+            output = node.fn(self.item, inputs)
+        except Exception as e:
+            logger.exception(f"Error in {node.name} for {self.item}: {e}")
+            try:
+                self.on_error(node.name, self.item, e)
+            except Exception as callback_error:
+                logger.exception(f"Error handling the error of {node.name} for {self.item}: {callback_error}")
+            self.finish(node.name, failed=True)
+        else:
+            del inputs
+            self.finish(node.name, output)
+
+    def finish(self, name, output=None, failed=False):
+        ready, cancelled = [], []
+        with self.lock:
+            for input_name in self.graph.nodes[name].inputs:
+                if input_name in self.to_run:
+                    self.num_users[input_name] -= 1
+                    if not self.num_users[input_name]:
+                        self.outputs.pop(input_name, None)
+            self.num_left -= 1
+            if failed:
+                # Nodes only start once their inputs are over: none of those depending on it has started
+                cancelled = [other for other in self.graph.nodes if other in self.to_run
+                             and name in self.graph.ancestors[other] and other not in self.cancelled]
+                self.cancelled.update(cancelled)
+                self.num_left -= len(cancelled)
+            else:
+                self.ran.append(name)
+                if self.num_users[name]:
+                    self.outputs[name] = output
+                for consumer in self.graph.consumers[name]:
+                    if consumer in self.to_run and consumer not in self.cancelled:
+                        self.waiting[consumer] -= 1
+                        if not self.waiting[consumer]:
+                            ready.append(consumer)
+            done = self.num_left == 0
+        self.graph.release(self.item, cancelled)
+        for consumer in ready:
+            self.submit(consumer)
+        if done:
+            self.outputs.clear()
+            self.on_done(self.item, self.ran)
@@ -0,0 +1,91 @@
+import queue
+import threading
+from collections import namedtuple
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# A stage of the pipeline:
+#   name: used in the logs
+#   fn: called with an item, returns the item for the next stage (None drops it)
+#   num_workers: number of threads running fn
+#   queue_size: maximum number of finished items waiting for the next stage (the backpressure bound)
+Stage = namedtuple("Stage", ["name", "fn", "num_workers", "queue_size"])
+
+# Marks the end of the items on a queue
+_DONE = object()
+
+
+def _run_worker(stage, in_queue, out_queue, on_error):
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        try:
+            result = stage.fn(item)
+        except Exception as e:
+            logger.exception(f"Error in stage {stage.name}: {e}")
+            if on_error is not None:
+                on_error(stage.name, item, e)
+            continue
+        if result is not None:
+            out_queue.put(result)
+
+
+def _close_after(threads, out_queue, num_consumers):
+    for thread in threads:
+        thread.join()
+    for _ in range(num_consumers):
+        out_queue.put(_DONE)
+
+
+def run_stages(items, stages, consume, on_error=None):
+    """
+    Run items through threaded stages connected by bounded queues, then through a single consumer.
+
+    Every stage works on different items at the same time (e.g. downloading the next videos while
+    the models run on the current one), so throughput approaches that of the slowest stage. A stage
+    blocks when its output queue is full, which bounds the number of items (downloaded audio,
+    decoded buffers) held between stages to the queue sizes plus the number of workers.
+
+    Args:
+        items (iterable): Items fed to the first stage.
+        stages (list): Stage tuples, in order.
+        consume (callable): Called in the calling thread with every item coming out of the last stage,
+            one at a time; this is where the (single) model-inference consumer runs.
+        on_error (callable, optional): Called with (stage name, item, exception) when a stage or the
+            consumer raises; the item is then dropped.
+    """
+    in_queue = queue.Queue(maxsize=max(1, stages[0].num_workers) if stages else 1)
+    first_queue = in_queue
+    for idx, stage in enumerate(stages):
+        out_queue = queue.Queue(maxsize=stage.queue_size)
+        threads = [threading.Thread(target=_run_worker, args=(stage, in_queue, out_queue, on_error),
+                                    name=f"{stage.name}-{worker_idx}", daemon=True)
+                   for worker_idx in range(stage.num_workers)]
+        for thread in threads:
+            thread.start()
+        num_consumers = stages[idx + 1].num_workers if idx + 1 < len(stages) else 1
+        threading.Thread(target=_close_after, args=(threads, out_queue, num_consumers), daemon=True).start()
+        in_queue = out_queue
+    last_queue = in_queue
+
+    def feed():
+        for item in items:
+            first_queue.put(item)
+        for _ in range(stages[0].num_workers if stages else 1):
+            first_queue.put(_DONE)
+
+    threading.Thread(target=feed, name="feeder", daemon=True).start()
+
+    while True:
+        item = last_queue.get()
+        if item is _DONE:
+            break
+        try:
+            consume(item)
+        except Exception as e:
+            logger.exception(f"Error in the consumer: {e}")
+            if on_error is not None:
+                on_error("consumer", item, e)
@@ -0,0 +1,347 @@
+import os
+import json
+import argparse
+import numpy as np
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Timelines of a video: the downloaded audio, the speech-only audio (VAD cut) and the speech-only,
+# overlap-free audio (VAD and OSD cuts) diarization and transcription run on
+ORIGINAL = "original"
+PART_1 = "part_1"
+PART_2 = "part_2"
+TIMELINES = [ORIGINAL, PART_1, PART_2]
+
+
+class OffsetMap:
+    """
+    Piecewise-linear map between a source timeline and the timeline of the audio cut from it.
+
+    Kept segments are sorted sample breakpoints, so converting any number of times is a vectorized
+    binary search. Times in a removed region of the source snap to the nearest kept sample: forward
+    for interval starts, backward for interval ends.
+
+    Args:
+        segment_map (np.ndarray): (n, 3) [source_start, source_end, output_start] sample rows, as
+            returned by `debate_utils.build_segment_map`.
+        sample_rate (int): Sample rate of the sample indices.
+    """
+
+    def __init__(self, segment_map, sample_rate=debate_utils.sr):
+        segment_map = np.asarray(segment_map, dtype=np.int64).reshape(-1, 3)
+        self.segment_map = segment_map
+        self.sample_rate = sample_rate
+        self.source_starts = segment_map[:, 0]
+        self.source_ends = segment_map[:, 1]
+        self.cut_starts = segment_map[:, 2]
+        self.cut_ends = self.cut_starts + (self.source_ends - self.source_starts)
+        self.cut_length = int(self.cut_ends[-1]) if len(segment_map) else 0
+
+    def _to_cut_samples(self, samples, side):
+        num_segments = len(self.source_starts)
+        idx = np.searchsorted(self.source_starts, samples, side='right') - 1
+        safe_idx = np.clip(idx, 0, max(0, num_segments - 1))
+        if side == "end":
+            inside = (idx >= 0) & (samples <= self.source_ends[safe_idx])
+            # In a removed region: end of the previous kept segment
+            snapped = np.where(idx >= 0, self.cut_ends[safe_idx], 0)
+        else:
+            inside = (idx >= 0) & (samples < self.source_ends[safe_idx])
+            # In a removed region: start of the next kept segment
+            next_idx = np.clip(idx + 1, 0, max(0, num_segments - 1))
+            snapped = np.where(idx + 1 < num_segments, self.cut_starts[next_idx], self.cut_length)
+        return np.where(inside, samples - self.source_starts[safe_idx] + self.cut_starts[safe_idx], snapped)
+
+    def _to_source_samples(self, samples, side):
+        # A time on the boundary of two kept segments is the start of the second one, or the end of the first
+        idx = np.searchsorted(self.cut_starts, samples, side='left' if side == "end" else 'right') - 1
+        idx = np.clip(idx, 0, max(0, len(self.cut_starts) - 1))
+        return samples - self.cut_starts[idx] + self.source_starts[idx]
+
+    def to_cut(self, times, side="start"):
+        """
+        Convert times (seconds) of the source timeline to the cut timeline.
+
+        Args:
+            times (array-like): Times in seconds.
+            side (str): "start" or "end", the side of the intervals the times are.
+
+        Returns:
+            np.ndarray: float64 times in seconds.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if not len(self.segment_map):
+            return np.zeros_like(times)
+        samples = times * self.sample_rate
+        return self._to_cut_samples(samples, side) / self.sample_rate
+
+    def to_source(self, times, side="start"):
+        """
+        Convert times (seconds) of the cut timeline to the source timeline.
+
+        Args:
+            times (array-like): Times in seconds.
+            side (str): "start" or "end", the side of the intervals the times are.
+
+        Returns:
+            np.ndarray: float64 times in seconds.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if not len(self.segment_map):
+            return np.full_like(times, np.nan)
+        return self._to_source_samples(times * self.sample_rate, side) / self.sample_rate
+
+    def compose(self, inner):
+        """
+        Chain this map (a -> b) with a map of a cut of b (b -> c).
+
+        Args:
+            inner (OffsetMap): Map from this map's cut timeline to a further cut.
+
+        Returns:
+            OffsetMap: Map from a to c.
+        """
+        # Pieces of b between all breakpoints of both maps are linear in both; keep the ones inner keeps
+        breakpoints = np.unique(np.concatenate((self.cut_starts, self.cut_ends, inner.source_starts,
+                                                inner.source_ends)))
+        breakpoints = breakpoints[(breakpoints >= 0) & (breakpoints <= self.cut_length)]
+        lows, highs = breakpoints[:-1], breakpoints[1:]
+        idx = np.searchsorted(inner.source_starts, lows, side='right') - 1
+        kept = (idx >= 0) & (lows < inner.source_ends[np.clip(idx, 0, None)]) if len(inner.source_starts) else \
+            np.zeros(len(lows), dtype=bool)
+        lows, highs = lows[kept], highs[kept]
+
+        source_starts = self._to_source_samples(lows, "start")
+        cut_starts = inner._to_cut_samples(lows, "start")
+        lengths = highs - lows
+        # Merge the pieces contiguous on both timelines
+        new_segment = np.ones(len(lows), dtype=bool)
+        new_segment[1:] = ((source_starts[1:] != source_starts[:-1] + lengths[:-1])
+                           | (cut_starts[1:] != cut_starts[:-1] + lengths[:-1]))
+        segment_ids = np.cumsum(new_segment) - 1
+        source_ends = np.zeros(int(new_segment.sum()), dtype=np.int64)
+        np.maximum.at(source_ends, segment_ids, source_starts + lengths)
+        return OffsetMap(np.column_stack((source_starts[new_segment], source_ends, cut_starts[new_segment])),
+                         self.sample_rate)
+
+
+class TimelineMap:
+    """
+    Conversions between the original, part_1 and part_2 timelines of a video.
+
+    Args:
+        speech_map (np.ndarray): Segment map from the original audio to part_1.
+        non_overlap_map (np.ndarray): Segment map from part_1 to part_2.
+        sample_rate (int): Sample rate of the segment maps.
+    """
+
+    def __init__(self, speech_map, non_overlap_map, sample_rate=debate_utils.sr):
+        self.sample_rate = sample_rate
+        original_to_part_1 = OffsetMap(speech_map, sample_rate)
+        part_1_to_part_2 = OffsetMap(non_overlap_map, sample_rate)
+        # Maps keyed by (source timeline, cut timeline)
+        self.maps = {
+            (ORIGINAL, PART_1): original_to_part_1,
+            (PART_1, PART_2): part_1_to_part_2,
+            (ORIGINAL, PART_2): original_to_part_1.compose(part_1_to_part_2),
+        }
+
+    def convert(self, times, from_timeline, to_timeline, side="start"):
+        """
+        Convert times (seconds) between two timelines of the video.
+
+        Args:
+            times (array-like): Times in seconds.
+            from_timeline (str): ORIGINAL, PART_1 or PART_2.
+            to_timeline (str): ORIGINAL, PART_1 or PART_2.
+            side (str): "start" or "end", the side of the intervals the times are.
+
+        Returns:
+            np.ndarray: float64 times in seconds.
+        """
+        if from_timeline == to_timeline:
+            return np.asarray(times, dtype=np.float64)
+        if TIMELINES.index(from_timeline) < TIMELINES.index(to_timeline):
+            return self.maps[(from_timeline, to_timeline)].to_cut(times, side)
+        return self.maps[(to_timeline, from_timeline)].to_source(times, side)
+
+    def convert_intervals(self, intervals, from_timeline, to_timeline):
+        """
+        Convert [start, end] intervals (seconds) between two timelines of the video.
+
+        On the original timeline, an interval spans the regions cut out within it.
+
+        Args:
+            intervals (array-like): (n, 2) [start, end] pairs in seconds.
+
+        Returns:
+            np.ndarray: (n, 2) float64 [start, end] pairs in seconds.
+        """
+        intervals = np.asarray(intervals, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack((self.convert(intervals[:, 0], from_timeline, to_timeline, "start"),
+                                self.convert(intervals[:, 1], from_timeline, to_timeline, "end")))
+
+    def save(self, video_id):
+        save_path = get_map_path(video_id)
+        np.savez_compressed(save_path, speech_map=self.maps[(ORIGINAL, PART_1)].segment_map,
+                            non_overlap_map=self.maps[(PART_1, PART_2)].segment_map,
+                            sample_rate=self.sample_rate)
+
+
+def get_map_path(video_id):
+    return os.path.join(ConfigConstants.TIMELINE_MAP_DIR, f"{video_id}.npz")
+
+
+def load_timeline_map(video_id):
+    """
+    Load the timeline map of a video; videos processed before the maps were saved get theirs
+    rebuilt from their VAD and OSD data (and saved).
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        TimelineMap: Timeline map of the video.
+    """
+    map_path = get_map_path(video_id)
+    if os.path.exists(map_path):
+        with np.load(map_path) as data:
+            return TimelineMap(data["speech_map"], data["non_overlap_map"], int(data["sample_rate"]))
+    timeline_map = rebuild_timeline_map(video_id)
+    timeline_map.save(video_id)
+    return timeline_map
+
+
+def rebuild_timeline_map(video_id):
+    """
+    Rebuild the timeline map of a video from its saved VAD and OSD data.
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        TimelineMap: Timeline map of the video.
+    """
+    from ..diarization_vad_osd_related import frame_scores
+
+    with open(os.path.join(ConfigConstants.VAD_FILE_DIR, f"{video_id}.json")) as fd:
+        vad_data = json.load(fd)
+    with open(os.path.join(ConfigConstants.OSD_FILE_DIR, f"{video_id}.json")) as fd:
+        osd_data = json.load(fd)
+
+    # Length of the original audio: saved with the frame scores, else the end of the last speech
+    meta_path = frame_scores.get_scores_paths(video_id)[1]
+    if os.path.exists(meta_path):
+        with open(meta_path) as fd:
+            num_samples = json.load(fd)["num_samples"]
+    else:
+        num_samples = int(np.ceil(max([end for _, end in vad_data], default=0) * debate_utils.sr))
+
+    return build_timeline_map(vad_data, osd_data, num_samples)
+
+
+def build_timeline_map(vad_data, osd_data, num_samples):
+    """
+    Build the timeline map of a video from its VAD and OSD data, cutting exactly like
+    `debate_utils.remove_non_speech` and `debate_utils.write_non_overlap` (no audio needed).
+
+    Args:
+        vad_data (list): [start, end] speech timestamps, on the original timeline.
+        osd_data (list): [start, end] overlap timestamps, on the part_1 timeline.
+        num_samples (int): Length of the original audio.
+
+    Returns:
+        TimelineMap: Timeline map of the video.
+    """
+    sr = debate_utils.sr
+    speech_map = debate_utils.build_segment_map(debate_utils.timestamps_to_sample_bounds(vad_data, sr, num_samples))
+    part_1_length = int((speech_map[:, 1] - speech_map[:, 0]).sum())
+    overlap_bounds = debate_utils.timestamps_to_sample_bounds(osd_data, sr, part_1_length)
+    non_overlap_map = debate_utils.build_segment_map(debate_utils.complement_sample_bounds(overlap_bounds,
+                                                                                          part_1_length))
+    return TimelineMap(speech_map, non_overlap_map, sr)
+
+
+def remap_video(video_id):
+    """
+    Write the diarization and transcription data of a video with their times on the original
+    timeline: original_start/original_end are added to every diarization segment (seconds) and
+    every transcript record (milliseconds, like segment_start/segment_end).
+
+    Args:
+        video_id (str): YouTube video ID.
+
+    Returns:
+        list: Names of the stages remapped.
+    """
+    timeline_map = load_timeline_map(video_id)
+    remapped = []
+
+    diarization_path = os.path.join(ConfigConstants.DIARIZATION_FILE_DIR, f"{video_id}.json")
+    if os.path.exists(diarization_path):
+        with open(diarization_path) as fd:
+            dia_data = json.load(fd)
+        intervals = timeline_map.convert_intervals([[segment["start"], segment["end"]] for segment, _ in dia_data],
+                                                   PART_2, ORIGINAL)
+        for (segment, _), (start, end) in zip(dia_data, intervals):
+            segment["original_start"], segment["original_end"] = float(start), float(end)
+        _write_remapped("diarization_data", video_id, dia_data)
+        remapped.append("diarization")
+
+    transcript_path = os.path.join(ConfigConstants.TRANSCRIPT_FILE_DIR, f"{video_id}.json")
+    if os.path.exists(transcript_path):
+        with open(transcript_path) as fd:
+            trans_data = json.load(fd)
+        intervals = timeline_map.convert_intervals(
+            [[float(record["segment_start"]) / 1000, float(record["segment_end"]) / 1000] for record in trans_data],
+            PART_2, ORIGINAL)
+        for record, (start, end) in zip(trans_data, intervals):
+            record["original_start"], record["original_end"] = f"{start * 1000}", f"{end * 1000}"
+        _write_remapped("transcription_data", video_id, trans_data)
+        remapped.append("transcription")
+
+    # Overlapped speech, found on the part_1 timeline
+    with open(os.path.join(ConfigConstants.OSD_FILE_DIR, f"{video_id}.json")) as fd:
+        osd_data = json.load(fd)
+    _write_remapped("osd_data", video_id, timeline_map.convert_intervals(osd_data, PART_1, ORIGINAL).tolist())
+    remapped.append("osd")
+    return remapped
+
+
+def _write_remapped(folder, video_id, data):
+    save_dir = os.path.join(ConfigConstants.ORIGINAL_TIMELINE_DIR, folder)
+    os.makedirs(save_dir, exist_ok=True)
+    with open(os.path.join(save_dir, f"{video_id}.json"), 'w') as fd:
+        json.dump(data, fd, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map the diarization, transcription and OSD data back onto the "
+                                                 "original video timeline.")
+    parser.add_argument("video_ids", nargs="?", default="all",
+                        help="YouTube ID, path to a JSON list of IDs, or all (every video with OSD data)")
+    args = parser.parse_args()
+    ConfigConstants.create_directories()
+
+    if args.video_ids == "all":
+        vid_ids = sorted(file_name[:-len(".json")] for file_name in os.listdir(ConfigConstants.OSD_FILE_DIR)
+                         if file_name.endswith(".json"))
+    elif args.video_ids.endswith(".json"):
+        with open(args.video_ids) as fd:
+            vid_ids = json.load(fd)
+    else:
+        vid_ids = [args.video_ids]
+
+    for curr_yt_id in vid_ids:
+        try:
+            logger.debug(f"{curr_yt_id}: remapped {remap_video(curr_yt_id)}")
+        except Exception as e:
+            logger.exception(f"Error while remapping {curr_yt_id}: {e}")
+    logger.info(f"{len(vid_ids)} videos remapped to {ConfigConstants.ORIGINAL_TIMELINE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
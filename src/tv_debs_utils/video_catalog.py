@@ -0,0 +1,245 @@
+import os
+import json
+import argparse
+import numpy as np
+from ..config_constants import ConfigConstants
+from . import debate_utils
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Numeric columns with a sorted index
+SORTED_COLUMNS = ["publish_time", "total_duration", "view_count", "like_count", "comment_count"]
+
+# yt_stats field of every count column
+STAT_FIELDS = {"view_count": "viewCount", "like_count": "likeCount", "comment_count": "commentCount"}
+
+# Processing seconds per second of audio, used for cost estimates until the run manifest has timings
+DEFAULT_REAL_TIME_FACTORS = {"diarization": 0.3, "transcription": 1.0, "perspective": 0.05}
+
+
+def normalize_hashtag(hashtag):
+    return hashtag.lstrip("#").lower()
+
+
+def to_epoch_seconds(date):
+    """
+    Convert an ISO date or time (e.g. "2021-03-01" or "2021-03-01T18:52:22Z") to epoch seconds.
+    """
+    return int(np.datetime64(date.rstrip("Z"), "s").astype(np.int64))
+
+
+class VideoCatalog:
+    """
+    The metadata of video_details.json as typed arrays, with inverted indexes on the labels and
+    hashtags and sorted indexes on the numeric columns, to select work sets without scanning the
+    records.
+
+    Args:
+        details_path (str): Path of video_details.json.
+    """
+
+    def __init__(self, details_path=ConfigConstants.VIDEO_DETAILS_PATH):
+        with open(details_path) as fd:
+            details = json.load(fd)
+        self.num_videos = len(details)
+        self.video_ids = np.array([video["yt_vid_id"] for video in details])
+        self.columns = {
+            "publish_time": np.array([to_epoch_seconds(video["publish_time"]) for video in details], dtype=np.int64),
+            "total_duration": np.array([video.get("total_duration", 0) for video in details], dtype=np.int32),
+        }
+        # Missing stats (e.g. hidden like counts) are -1
+        for column, field in STAT_FIELDS.items():
+            self.columns[column] = np.array([int(video.get("yt_stats", {}).get(field) or -1) for video in details],
+                                            dtype=np.int64)
+
+        # Major labels as codes into a vocabulary
+        self.major_labels, self.major_label_codes = np.unique([video.get("major_label") or "" for video in details],
+                                                              return_inverse=True)
+        self.major_label_codes = self.major_label_codes.astype(np.int16)
+
+        # Inverted indexes: value -> sorted positions of the videos
+        self.inverted_indexes = {
+            "major_label": self._build_inverted_index([[video.get("major_label")] for video in details]),
+            "minor_labels": self._build_inverted_index([video.get("minor_labels") or [] for video in details]),
+            "hashtags": self._build_inverted_index(
+                [[normalize_hashtag(hashtag) for hashtag in video.get("hashtags_detected") or []] for video in details]),
+        }
+
+        # Sorted indexes: positions ordered by value, and the sorted values for binary searches
+        self.sorted_positions = {column: np.argsort(self.columns[column], kind="stable") for column in SORTED_COLUMNS}
+        self.sorted_values = {column: self.columns[column][self.sorted_positions[column]] for column in SORTED_COLUMNS}
+
+    @staticmethod
+    def _build_inverted_index(values_per_video):
+        index = {}
+        for position, values in enumerate(values_per_video):
+            for value in set(values):
+                if value:
+                    index.setdefault(value, []).append(position)
+        return {value: np.array(positions, dtype=np.int32) for value, positions in index.items()}
+
+    def lookup(self, field, values):
+        """
+        Get the videos having any of the values in an inverted index.
+
+        Args:
+            field (str): major_label, minor_labels or hashtags.
+            values (list): Values to look up.
+
+        Returns:
+            np.ndarray: Sorted positions of the videos.
+        """
+        if field == "hashtags":
+            values = [normalize_hashtag(value) for value in values]
+        index = self.inverted_indexes[field]
+        positions = [index[value] for value in values if value in index]
+        return np.unique(np.concatenate(positions)) if positions else np.array([], dtype=np.int32)
+
+    def range(self, column, low=None, high=None):
+        """
+        Get the videos whose value of a sorted column is in [low, high).
+
+        Returns:
+            np.ndarray: Positions of the videos, ordered by the column.
+        """
+        values = self.sorted_values[column]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        end = len(values) if high is None else np.searchsorted(values, high, side="left")
+        return self.sorted_positions[column][start:end]
+
+    def query(self, major_labels=None, minor_labels=None, hashtags=None, published_after=None, published_before=None,
+              min_duration=None, max_duration=None, min_views=None, sort_by=None, descending=False, limit=None):
+        """
+        Select videos; every given condition must hold, and the values of a list are alternatives.
+
+        Args:
+            major_labels (list, optional): Major labels.
+            minor_labels (list, optional): Minor labels.
+            hashtags (list, optional): Hashtags (with or without '#', case-insensitive).
+            published_after (str, optional): ISO date or time, inclusive.
+            published_before (str, optional): ISO date or time, exclusive.
+            min_duration (int, optional): Seconds, inclusive.
+            max_duration (int, optional): Seconds, inclusive.
+            min_views (int, optional): Views, inclusive.
+            sort_by (str, optional): Column of SORTED_COLUMNS to sort by (catalog order by default).
+            descending (bool): Sort in descending order.
+            limit (int, optional): Number of videos to keep after sorting.
+
+        Returns:
+            np.ndarray: Positions of the selected videos.
+        """
+        selected = np.ones(self.num_videos, dtype=bool)
+
+        def keep(positions):
+            mask = np.zeros(self.num_videos, dtype=bool)
+            mask[positions] = True
+            selected[:] &= mask
+
+        for field, values in [("major_label", major_labels), ("minor_labels", minor_labels), ("hashtags", hashtags)]:
+            if values:
+                keep(self.lookup(field, values))
+        if published_after is not None or published_before is not None:
+            keep(self.range("publish_time",
+                            None if published_after is None else to_epoch_seconds(published_after),
+                            None if published_before is None else to_epoch_seconds(published_before)))
+        if min_duration is not None or max_duration is not None:
+            keep(self.range("total_duration", min_duration, None if max_duration is None else max_duration + 1))
+        if min_views is not None:
+            keep(self.range("view_count", min_views))
+
+        if sort_by is None:
+            positions = np.flatnonzero(selected)
+        else:
+            order = self.sorted_positions[sort_by]
+            positions = order[selected[order]]
+            if descending:
+                positions = positions[::-1]
+        return positions[:limit] if limit is not None else positions
+
+    def get_video_ids(self, positions):
+        return self.video_ids[positions].tolist()
+
+    def estimate_cost(self, positions, stages=("diarization", "transcription"), manifest=None):
+        """
+        Estimate the processing time of videos from their total_duration and a real-time factor per
+        stage, measured on the videos the run manifest has timings for when there are any.
+
+        Args:
+            positions (np.ndarray): Positions of the videos.
+            stages (list): Stages to estimate.
+            manifest (RunManifest, optional): Manifest to measure the real-time factors from.
+
+        Returns:
+            dict: For every stage, the real-time factor used and its source, and the estimated hours.
+        """
+        audio_hours = self.columns["total_duration"][positions].sum() / 3600
+        durations = self.columns["total_duration"]
+        position_by_id = {video_id: position for position, video_id in enumerate(self.video_ids)}
+        estimates = {"audio_hours": float(audio_hours)}
+        for stage in stages:
+            real_time_factor, source = DEFAULT_REAL_TIME_FACTORS.get(stage, 1.0), "default"
+            if manifest is not None:
+                timed = [(position_by_id[video_id], duration) for video_id, duration in manifest.durations(stage)
+                         if video_id in position_by_id]
+                if timed:
+                    timed_positions, processing_seconds = zip(*timed)
+                    real_time_factor = sum(processing_seconds) / max(1, durations[list(timed_positions)].sum())
+                    source = f"measured on {len(timed)} videos"
+            estimates[stage] = {"real_time_factor": real_time_factor, "source": source,
+                                "hours": float(audio_hours * real_time_factor)}
+        return estimates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select videos from video_details.json and print their IDs.")
+    parser.add_argument("--major-label", nargs="*", default=None)
+    parser.add_argument("--minor-label", nargs="*", default=None)
+    parser.add_argument("--hashtag", nargs="*", default=None)
+    parser.add_argument("--published-after", default=None, help="ISO date, inclusive (e.g. 2021-01-01)")
+    parser.add_argument("--published-before", default=None, help="ISO date, exclusive")
+    parser.add_argument("--min-duration", type=int, default=None, help="Seconds")
+    parser.add_argument("--max-duration", type=int, default=None, help="Seconds")
+    parser.add_argument("--min-views", type=int, default=None)
+    parser.add_argument("--sort-by", choices=SORTED_COLUMNS, default=None)
+    parser.add_argument("--descending", action="store_true")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--pending-for", choices=["diarization", "transcription", "perspective"], default=None,
+                        help="Drop the videos this stage has already done (from the run manifest)")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write the IDs to, which the pipelines take as their video_ids argument")
+    args = parser.parse_args()
+
+    catalog = VideoCatalog()
+    positions = catalog.query(args.major_label, args.minor_label, args.hashtag, args.published_after,
+                              args.published_before, args.min_duration, args.max_duration, args.min_views,
+                              args.sort_by, args.descending, None if args.pending_for else args.limit)
+
+    manifest = None
+    if args.pending_for or os.path.exists(ConfigConstants.RUN_MANIFEST_PATH):
+        from .run_manifest import RunManifest
+
+        ConfigConstants.create_directories()
+        manifest = RunManifest(ConfigConstants.RUN_MANIFEST_PATH)
+    try:
+        if args.pending_for:
+            # Outputs already in the stage folder count as done, even without a manifest row
+            manifest.sync_directory(args.pending_for)
+            done = set(manifest.video_ids(args.pending_for, "done"))
+            positions = np.array([position for position in positions if catalog.video_ids[position] not in done],
+                                 dtype=np.int64)[:args.limit]
+
+        video_ids = catalog.get_video_ids(positions)
+        cost_estimate = catalog.estimate_cost(positions, manifest=manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    logger.info(f"{len(video_ids)} videos selected, cost estimate: {json.dumps(cost_estimate)}")
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(video_ids, fd, indent=1)
+    else:
+        print(json.dumps(video_ids))
+
+if __name__ == "__main__":
+    main()
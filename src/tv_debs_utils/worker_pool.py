@@ -0,0 +1,108 @@
+import os
+import queue
+import multiprocessing
+from ..config_constants import ConfigConstants
+from . import debate_utils, instrumentation, inference_backend
+
+# Get a logger to use
+logger = debate_utils.get_logger()
+
+# Scratch directories, which every worker process gets its own copy of
+SCRATCH_DIRECTORIES = ["PART_0_PATH", "PART_1_PATH", "PART_2_PATH", "MP3_FILE_DIR", "MP4_FILE_DIR",
+                       "UTTERANCES_FILE_DIR_TMP"]
+
+
+def use_scratch_namespace(name):
+    """
+    Move the scratch directories of this process to their own sub-folder of the scratch folder.
+
+    Args:
+        name (str): Name of the namespace (e.g. "worker_0").
+    """
+    for attribute in SCRATCH_DIRECTORIES:
+        scratch_dir = os.path.join(ConfigConstants.SCRATCH_FOLDER_DIR, name,
+                                   os.path.basename(getattr(ConfigConstants, attribute)))
+        os.makedirs(scratch_dir, exist_ok=True)
+        setattr(ConfigConstants, attribute, scratch_dir)
+
+
+def iter_queue(work_queue):
+    """
+    Yield the items of a shared work queue until its end marker (None).
+
+    Args:
+        work_queue (multiprocessing.Queue): Shared work queue.
+    """
+    while True:
+        item = work_queue.get()
+        if item is None:
+            return
+        yield item
+
+
+def _worker_main(worker_idx, work_queue, result_queue, run_fn, num_threads):
+    import torch
+
+    # Workers don't oversubscribe the cores, whatever the TORCH_*_THREADS settings
+    inference_backend.configure_threads(num_threads, 1, pin=True)
+    use_scratch_namespace(f"worker_{worker_idx}")
+    if torch.cuda.is_available():
+        torch.cuda.set_device(worker_idx % torch.cuda.device_count())
+    logger.info(f"Worker {worker_idx} started (pid {os.getpid()}, {num_threads} torch threads)")
+    error_ids = run_fn(iter_queue(work_queue))
+    result_queue.put(error_ids or [])
+
+
+def run_workers(items, num_workers, run_fn, threads_per_worker=None):
+    """
+    Process items with several worker processes pulling from a shared work queue.
+
+    Every worker loads its own models (in `run_fn`) once, and takes the next item as soon as it
+    is done with the previous one, so that long videos don't leave the other workers idle.
+
+    Args:
+        items (list): Items to process (e.g. video IDs).
+        num_workers (int): Number of worker processes.
+        run_fn (callable): Picklable function called in every worker with an iterator over the items
+            it takes from the queue; returns a list of [item, error] pairs.
+        threads_per_worker (int, optional): torch intra-op threads of every worker; the cores are
+            shared evenly between the workers by default.
+
+    Returns:
+        list: [item, error] pairs of all workers.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # Workers are spawned rather than forked: forking a process that already holds torch threads
+    # (or CUDA) is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    # The workers inherit the run ID, and write their spans to the same trace
+    instrumentation.get_run_id()
+    work_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    for item in items:
+        work_queue.put(item)
+    for _ in range(num_workers):
+        work_queue.put(None)
+
+    processes = [ctx.Process(target=_worker_main, name=f"worker-{worker_idx}",
+                             args=(worker_idx, work_queue, result_queue, run_fn, threads_per_worker))
+                 for worker_idx in range(num_workers)]
+    for process in processes:
+        process.start()
+
+    error_ids = []
+    num_results = 0
+    while num_results < num_workers:
+        try:
+            error_ids.extend(result_queue.get(timeout=5))
+            num_results += 1
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            logger.error(f"{process.name} exited with code {process.exitcode}")
+    return error_ids